@@ -0,0 +1,604 @@
+"""
+Benchmarks of the meshing pipeline on synthetic images.
+
+Every case (image, size, crit and tree) runs in a new process, which times
+each stage of the pipeline separately and reports its peak memory. The
+results are written as JSON, and two result files can be compared to find
+regressions between versions:
+
+    python benchmarks/benchmark.py run --sizes 256 512 1024 -o new.json
+    python benchmarks/benchmark.py compare old.json new.json
+
+Only the public API is used, and features of later versions are looked up
+before they are used, so an older version of qtreemesh can be benchmarked by
+putting it first on the path:
+
+    PYTHONPATH=old/src python benchmarks/benchmark.py run -o old.json
+
+Author : Sadjad Abedi
+"""
+
+import argparse
+import datetime
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import qtreemesh
+from qtreemesh import QTree, QTreeMesh
+
+try:
+    from qtreemesh import LinearQTree
+except ImportError:  # Versions before 0.2
+    LinearQTree = None
+
+try:
+    from qtreemesh import instrument
+except ImportError:
+    instrument = None
+
+# Stages timed one after the other, whose times add up to the total
+STAGES = (
+    "tree",
+    "balancing",
+    "mesh",
+    "create_elements",
+    "adjust_mesh_for_FEM",
+    "vtk_export",
+)
+# Parts of create_elements, timed by instrument() when it is available
+PARTS = ("labeling", "refactor_edge")
+
+
+# Builders that the installed version of qtreemesh does not have are None,
+# so the same command line can be run against older versions
+TREES = {
+    "qtree": lambda image, crit: QTree(None, image, crit),
+    "pyramid": getattr(QTree, "from_pyramid", None),
+    "integral": getattr(QTree, "from_integral_image", None),
+    "linear": None if LinearQTree is None else LinearQTree.from_array,
+}
+
+
+def _accepts(function, name):
+    """
+    Return whether a function has a parameter of the given name.
+    """
+    return name in inspect.signature(function).parameters
+
+
+def blobs(size, rng):
+    """
+    Disks of random positions, radii and gray levels on a black image.
+
+    Parameters
+    ----------
+    size : int
+        Number of pixels in each direction.
+    rng : numpy.random.Generator
+        Generator of the positions, radii and gray levels.
+
+    Returns
+    -------
+    image : numpy array
+        A (size, size) array of uint8 gray levels.
+    """
+    image = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(32):
+        radius = rng.uniform(size / 32, size / 8)
+        row, col = rng.uniform(0, size, 2)
+        rows = slice(max(0, int(row - radius)), min(size, int(row + radius) + 1))
+        cols = slice(max(0, int(col - radius)), min(size, int(col + radius) + 1))
+        y, x = np.ogrid[rows, cols]
+        disk = (y - row) ** 2 + (x - col) ** 2 <= radius**2
+        image[rows, cols][disk] = rng.integers(0, 256)
+
+    return image
+
+
+def checkerboard(size, rng):
+    """
+    Black and white squares of size/10 pixels, not aligned with cells.
+
+    Parameters
+    ----------
+    size : int
+        Number of pixels in each direction.
+    rng : numpy.random.Generator
+        Not used, the image is not random.
+
+    Returns
+    -------
+    image : numpy array
+        A (size, size) array of uint8 gray levels.
+    """
+    y, x = np.ogrid[:size, :size]
+    side = size / 10
+
+    return ((y // side + x // side) % 2 * 255).astype(np.uint8)
+
+
+def circles(size, rng):
+    """
+    Concentric black and white rings of size/20 pixels.
+
+    Parameters
+    ----------
+    size : int
+        Number of pixels in each direction.
+    rng : numpy.random.Generator
+        Not used, the image is not random.
+
+    Returns
+    -------
+    image : numpy array
+        A (size, size) array of uint8 gray levels.
+    """
+    y, x = np.ogrid[:size, :size]
+    radius = np.hypot(y - size / 2, x - size / 2, dtype=np.float32)
+
+    return (radius // (size / 20) % 2 * 255).astype(np.uint8)
+
+
+def noise(size, rng):
+    """
+    Uniform random gray levels.
+
+    Parameters
+    ----------
+    size : int
+        Number of pixels in each direction.
+    rng : numpy.random.Generator
+        Generator of the gray levels.
+
+    Returns
+    -------
+    image : numpy array
+        A (size, size) array of uint8 gray levels.
+    """
+    return rng.integers(0, 256, (size, size), dtype=np.uint8)
+
+
+IMAGES = {
+    "blobs": blobs,
+    "checkerboard": checkerboard,
+    "circles": circles,
+    "noise": noise,
+}
+
+
+class _Stages:
+    """
+    Record the wall time and, when tracemalloc is tracing, the peak of
+    traced memory of every stage.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.peaks = {}
+
+    @contextmanager
+    def __call__(self, name):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        self.times[name] = time.perf_counter() - start
+        if tracing:
+            self.peaks[name] = tracemalloc.get_traced_memory()[1]
+
+
+def run_pipeline(image, crit, tree, compact=False, binary=True, directory="."):
+    """
+    Run all stages of the pipeline once, through the public API.
+
+    Options that the installed version of qtreemesh does not have (compact
+    elements, binary VTK files) are not used.
+
+    Parameters
+    ----------
+    image : numpy array
+        Square image of a power of 2 size.
+    crit : float
+        Splitting criterion of the tree.
+    tree : str
+        Name of the tree builder in TREES.
+    compact : bool, optional
+        Use create_elements(compact=True). Default value is False.
+    binary : bool, optional
+        Export a binary VTK file. Default value is True.
+    directory : str, optional
+        Directory of the VTK file. Default is the current directory.
+
+    Returns
+    -------
+    stages : _Stages object
+        Times of the STAGES, and of the PARTS when instrument() is
+        available.
+    counts : dict
+        Numbers of leaves, nodes, elements, FEM elements, balancing splits
+        (None for versions whose balancing does not return them) and the
+        size of the VTK file.
+    """
+    stages = _Stages()
+    counts = {}
+    with stages("tree"):
+        quad_tree = TREES[tree](image, crit)
+    with stages("balancing"):
+        counts["splits"] = quad_tree.balancing()
+    with stages("mesh"):
+        mesh = QTreeMesh(quad_tree, balancing=False)
+    options = {"compact": True} if compact else {}
+    if compact and not _accepts(mesh.create_elements, "compact"):
+        options = {}
+    if instrument is None:
+        with stages("create_elements"):
+            mesh.create_elements(**options)
+    else:
+        with instrument() as stats, stages("create_elements"):
+            mesh.create_elements(**options)
+        for name in PARTS:
+            if name in stats.stages:
+                stages.times[name] = stats.stages[name]["seconds"]
+    with stages("adjust_mesh_for_FEM"):
+        _, fem_elements, _ = mesh.adjust_mesh_for_FEM()
+    filename = os.path.join(directory, "mesh.vtk")
+    options = {"binary": binary} if _accepts(mesh.vtk_export, "binary") else {}
+    with stages("vtk_export"):
+        mesh.vtk_export(filename, **options)
+    leaves = getattr(mesh, "leaf_sizes", None)
+    counts.update(
+        leaves=len(mesh.leaves if leaves is None else leaves),
+        nodes=len(mesh.nodes),
+        elements=len(mesh.elements),
+        fem_elements=len(fem_elements),
+        vtk_bytes=os.path.getsize(filename),
+    )
+
+    return stages, counts
+
+
+def run_case(case, repeat=1, memory=True, compact=False, binary=True, seed=0):
+    """
+    Build the image of a case and run the pipeline on it.
+
+    The time of each stage is the best of repeat runs. With memory, the
+    pipeline is run once more with tracemalloc, which gives the peak of
+    memory allocated by Python and NumPy up to the end of each stage.
+
+    Parameters
+    ----------
+    case : dict
+        The image name, size, crit and tree name of the case.
+    repeat : int, optional
+        Number of timed runs. Default value is 1.
+    memory : bool, optional
+        Measure the peak memory of each stage. Default value is True.
+    compact : bool, optional
+        Use create_elements(compact=True). Default value is False.
+    binary : bool, optional
+        Export a binary VTK file. Default value is True.
+    seed : int, optional
+        Seed of the random images. Default value is 0.
+
+    Returns
+    -------
+    result : dict
+        The case with its status, stage times, total time, counts and
+        peak memory.
+    """
+    if TREES[case["tree"]] is None:
+        return dict(case, status="unavailable")
+    rng = np.random.default_rng(seed)
+    image = IMAGES[case["image"]](case["size"], rng)
+    times = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(repeat):
+            stages, counts = run_pipeline(
+                image, case["crit"], case["tree"], compact, binary, directory
+            )
+            for name, seconds in stages.times.items():
+                times[name] = min(seconds, times.get(name, np.inf))
+            del stages
+        result = dict(case, status="ok", times=times, counts=counts)
+        result["total"] = sum(times[name] for name in STAGES)
+        if memory:
+            tracemalloc.start()
+            stages, _ = run_pipeline(
+                image, case["crit"], case["tree"], compact, binary, directory
+            )
+            tracemalloc.stop()
+            result["peak_memory"] = stages.peaks
+    if resource is not None:
+        # Kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["peak_rss"] = peak if sys.platform == "darwin" else peak * 1024
+
+    return result
+
+
+def _child(connection, case, options):
+    try:
+        connection.send(run_case(case, **options))
+    except BaseException as error:  # Reported by the parent
+        connection.send(dict(case, status="error", error=repr(error)))
+    finally:
+        connection.close()
+
+
+def run_isolated(case, timeout=None, **options):
+    """
+    Run a case in a new process, which is killed after timeout seconds.
+
+    Parameters
+    ----------
+    case : dict
+        The image name, size, crit and tree name of the case.
+    timeout : None or float, optional
+        Seconds to wait for the result. Default is no time limit.
+    **options
+        Keyword arguments of run_case.
+
+    Returns
+    -------
+    result : dict
+        The result of run_case, or the case with the status "timeout" or
+        "error" when the process did not return a result.
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(sender, case, options))
+    process.start()
+    sender.close()
+    timed_out = False
+    try:
+        if receiver.poll(timeout):
+            return receiver.recv()
+        timed_out = True
+    except EOFError:  # The process died, e.g. out of memory
+        pass
+    finally:
+        process.join(0 if timed_out else 10)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        receiver.close()
+    if timed_out:
+        return dict(case, status="timeout", timeout=timeout)
+
+    return dict(case, status="error", error=f"exit code {process.exitcode}")
+
+
+def run(args):
+    """
+    Run the cases of the command line arguments and write their results.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The arguments of the run command.
+    """
+    results = []
+    options = dict(
+        repeat=args.repeat,
+        memory=not args.no_memory,
+        compact=args.compact,
+        binary=not args.ascii,
+        seed=args.seed,
+    )
+    for image in args.images:
+        for tree in args.trees:
+            for crit in args.crits:
+                # Sizes are run in increasing order, and once a case fails or
+                # times out, the larger sizes are skipped
+                failed = False
+                for size in sorted(args.sizes):
+                    case = dict(image=image, size=size, crit=crit, tree=tree)
+                    if failed:
+                        result = dict(case, status="skipped")
+                    else:
+                        result = run_isolated(case, args.timeout, **options)
+                        failed = result["status"] not in ("ok", "unavailable")
+                    results.append(result)
+                    print(_format_result(result), flush=True)
+                    _write(args.output, args, results)
+    print(f"Results written to {args.output}")
+
+
+def _write(path, args, results):
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "qtreemesh": os.path.dirname(os.path.abspath(qtreemesh.__file__)),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+        },
+        "settings": {
+            "repeat": args.repeat,
+            "timeout": args.timeout,
+            "compact": args.compact,
+            "binary": not args.ascii,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    # Written after every case, so an interrupted run keeps its results
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as file_open:
+        json.dump(report, file_open, indent=1)
+    os.replace(temporary, path)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _case_name(result):
+    return "{image} {size} crit={crit:g} {tree}".format(**result)
+
+
+def _format_result(result):
+    name = _case_name(result)
+    if result["status"] != "ok":
+        return f"{name:40} {result['status']} {result.get('error', '')}"
+    stages = " ".join(
+        f"{stage}={seconds:.3g}" for stage, seconds in result["times"].items()
+    )
+    peak = max(result.get("peak_memory", {}).values(), default=0)
+    return (
+        f"{name:40} {result['total']:8.3f} s {result['counts']['leaves']:>9} "
+        f"leaves {peak / 2**20:8.1f} MiB  {stages}"
+    )
+
+
+def compare(args):
+    """
+    Print the ratio of the times (new / old) of the cases and stages in both
+    files.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The arguments of the compare command.
+
+    Returns
+    -------
+    status : int
+        1 if a stage got slower by more than the threshold, else 0.
+    """
+    with open(args.old, encoding="utf-8") as file_open:
+        old = json.load(file_open)
+    with open(args.new, encoding="utf-8") as file_open:
+        new = json.load(file_open)
+    old_results = {
+        _case_name(result): result
+        for result in old["results"]
+        if result["status"] == "ok"
+    }
+    print(f"old: {old.get('commit')} {old['created']}")
+    print(f"new: {new.get('commit')} {new['created']}")
+    regressions = 0
+    for result in new["results"]:
+        name = _case_name(result)
+        if result["status"] != "ok" or name not in old_results:
+            continue
+        before = old_results[name]
+        columns = []
+        for stage in ("total",) + STAGES + PARTS:
+            if stage == "total":
+                old_time, new_time = before["total"], result["total"]
+            elif stage in before["times"] and stage in result["times"]:
+                old_time, new_time = before["times"][stage], result["times"][stage]
+            else:
+                continue
+            if old_time < args.min_time and new_time < args.min_time:
+                continue
+            ratio = new_time / max(old_time, 1e-9)
+            mark = ""
+            if ratio > 1 + args.threshold:
+                mark = "!"
+                regressions += stage != "total"
+            columns.append(f"{stage}={ratio:.2f}{mark}")
+        print(f"{name:40} {' '.join(columns)}")
+    print(f"{regressions} stages slower by more than {args.threshold:.0%}")
+
+    return int(regressions > 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the meshing pipeline on synthetic images."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "--images", nargs="+", choices=sorted(IMAGES), default=list(IMAGES)
+    )
+    run_parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[256, 512, 1024, 2048, 4096, 8192],
+        help="image sizes, powers of 2",
+    )
+    run_parser.add_argument(
+        "--crits", nargs="+", type=float, default=[10.0, 50.0, 125.0]
+    )
+    run_parser.add_argument(
+        "--trees", nargs="+", choices=sorted(TREES), default=["qtree", "linear"]
+    )
+    run_parser.add_argument(
+        "--repeat", type=int, default=1, help="best of this many runs"
+    )
+    run_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600.0,
+        help="seconds per case, larger sizes are skipped after a timeout",
+    )
+    run_parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="do not measure the peak memory of each stage",
+    )
+    run_parser.add_argument(
+        "--compact", action="store_true", help="use create_elements(compact=True)"
+    )
+    run_parser.add_argument("--ascii", action="store_true", help="ASCII VTK export")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("-o", "--output", default="benchmark.json")
+    compare_parser = commands.add_parser(
+        "compare", help="compare the times of two result files"
+    )
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown reported as a regression",
+    )
+    compare_parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.01,
+        help="ignore stages faster than this many seconds in both files",
+    )
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return compare(args)
+    run(args)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,6 +24,9 @@ setuptools.setup(
         'numpy',
         'matplotlib',
     ],
+    entry_points = {
+        "console_scripts": ["qtreemesh = qtreemesh._batch:main"],
+    },
     package_dir = {"": "src"},
     packages = setuptools.find_packages(where="src"),
     python_requires = ">=3.7"
@@ -1,8 +1,42 @@
-from ._qtreemesh import QTree,QTreeElement,QTreeMesh,image_preprocess
+from ._qtreemesh import (
+    QTree,
+    QTreeElement,
+    QTreeElementStore,
+    QTreeMesh,
+    ImagePyramid,
+    IntegralImage,
+    PaddedImage,
+    image_preprocess,
+)
+from ._linear import LinearQTree
+from ._criteria import register_criterion
+from ._parallel import build_parallel
+from ._batch import mesh_batch, mesh_image
+from ._tiled import build_tiled, open_image
+from ._cache import MeshCache
+from ._instrument import PipelineStats, instrument
+from ._progress import CancellationToken, MeshingCancelled, progress
 
 __all__ = [
     "QTree",
     "QTreeElement",
+    "QTreeElementStore",
     "QTreeMesh",
-    "image_preprocess"
+    "ImagePyramid",
+    "IntegralImage",
+    "PaddedImage",
+    "LinearQTree",
+    "register_criterion",
+    "build_parallel",
+    "mesh_batch",
+    "mesh_image",
+    "build_tiled",
+    "open_image",
+    "MeshCache",
+    "PipelineStats",
+    "instrument",
+    "CancellationToken",
+    "MeshingCancelled",
+    "progress",
+    "image_preprocess",
 ]
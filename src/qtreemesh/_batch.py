@@ -0,0 +1,421 @@
+"""
+Batch meshing of image stacks and the qtreemesh command line interface.
+
+Author : Sadjad Abedi
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from ._cache import MeshCache
+from ._linear import LinearQTree
+from ._progress import MeshingCancelled, _reset_context, _step
+from ._qtreemesh import QTreeMesh, image_preprocess
+
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".npy", ".png", ".tif", ".tiff")
+
+OUTPUT_FORMATS = {
+    "vtk": (".vtk", "vtk_export", {"binary": True}),
+    "vtk-ascii": (".vtk", "vtk_export", {"binary": False}),
+    "vtu": (".vtu", "vtu_export", {"appended": True, "compress": False}),
+    "vtu-zlib": (".vtu", "vtu_export", {"appended": True, "compress": True}),
+}
+
+
+def find_images(inputs):
+    """
+    Return the image files given by paths, directories or glob patterns.
+
+    Parameters
+    ----------
+    inputs : str or list(str)
+        Paths of images, directories (all images inside them are used) or
+        glob patterns.
+
+    Returns
+    -------
+    paths : list(str)
+        Sorted paths of images without duplicates.
+    """
+    if isinstance(inputs, (str, os.PathLike)):
+        inputs = [inputs]
+    paths = []
+    for item in map(os.fspath, inputs):
+        if os.path.isdir(item):
+            paths.extend(
+                os.path.join(item, name)
+                for name in os.listdir(item)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        elif glob.has_magic(item):
+            paths.extend(glob.glob(item))
+        else:
+            paths.append(item)
+
+    return sorted(set(paths))
+
+
+def load_image(path):
+    """
+    Load an image as a grayscale array. NumPy (.npy) files are loaded
+    directly, other formats are read with Pillow.
+
+    Parameters
+    ----------
+    path : str
+        Path of the image.
+
+    Returns
+    -------
+    image_array : numpy array
+    """
+    if path.lower().endswith(".npy"):
+        return np.load(path)
+    try:
+        from PIL import Image
+    except ImportError as error:
+        raise ImportError(
+            "Reading images requires Pillow (pip install pillow)."
+        ) from error
+    with Image.open(path) as image:
+        return np.asarray(image.convert("L"))
+
+
+def mesh_image(
+    path,
+    output_dir=".",
+    crit=1,
+    criterion="range",
+    balancing=True,
+    output_format="vtk",
+    scale=1.0,
+    drop_outside=False,
+    root_size=None,
+    cache_dir=None,
+    cache_size=1 << 30,
+    output_name=None,
+):
+    """
+    Run the whole meshing pipeline for one image and export the mesh.
+
+    The image is virtually padded (see image_preprocess), a LinearQTree is
+    built from it and the elements of the QTreeMesh are stored compactly
+    before export. With a cache directory, the mesh is loaded from a
+    MeshCache when the same image was meshed with the same parameters.
+
+    Parameters
+    ----------
+    path : str
+        Path of the image.
+    output_dir : str, optional
+        Directory of the output file.
+    crit : int, optional
+        The criteria used for partitioning. Default value is 1.
+    criterion : str, optional
+        The splitting criterion (see ImagePyramid). Default is "range".
+    balancing : bool, optional
+        Indicate whether the quad-tree is balanced for 2:1 ratio or not.
+    output_format : str, optional
+        One of "vtk" (binary), "vtk-ascii", "vtu" and "vtu-zlib".
+    scale : float, optional
+        The ratio between pixels units and real units. Default value is 1.
+    drop_outside : bool, optional
+        If True, the cells in the padding of the image are not meshed.
+        Default value is False.
+    root_size : None or int, optional
+        Size of the root cells of a forest that tiles the image (see
+        LinearQTree.from_array). Default is None (a single root).
+    cache_dir : None or str, optional
+        Directory of a MeshCache. Default is None (no cache).
+    cache_size : int, optional
+        Maximum total size of the cache files in bytes. Default is 1 GiB.
+    output_name : None or str, optional
+        Path of the output file relative to output_dir, without extension.
+        Its directories are created if needed. Default is the name of the
+        image without extension.
+
+    Returns
+    -------
+    summary : dict
+        Input and output paths, numbers of leaves, elements and nodes, the
+        time spent in each stage (seconds) and whether the mesh was loaded
+        from the cache. With a cache, the time of building or loading the
+        mesh is the "mesh" stage.
+    """
+    extension, exporter, options = OUTPUT_FORMATS[output_format]
+    if output_name is None:
+        output_name = os.path.splitext(os.path.basename(path))[0]
+    output = os.path.join(output_dir, output_name + extension)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    timings = {}
+
+    start = time.perf_counter()
+    image_array = image_preprocess(load_image(path), virtual=True)
+    timings["load"] = time.perf_counter() - start
+
+    cached = False
+    if cache_dir is None:
+        start = time.perf_counter()
+        tree = LinearQTree.from_array(
+            image_array, crit, scale, criterion=criterion, root_size=root_size
+        )
+        timings["tree"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mesh = QTreeMesh(tree, balancing, drop_outside)
+        mesh.create_elements(compact=True)
+        timings["mesh"] = time.perf_counter() - start
+    else:
+        start = time.perf_counter()
+        cache = MeshCache(cache_dir, cache_size)
+        mesh = cache.mesh(
+            image_array,
+            crit,
+            scale,
+            criterion=criterion,
+            root_size=root_size,
+            balancing=balancing,
+            drop_outside=drop_outside,
+        )
+        tree = mesh.quad_tree
+        cached = cache.hits > 0
+        timings["tree"] = 0.0
+        timings["mesh"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    getattr(mesh, exporter)(output, **options)
+    timings["export"] = time.perf_counter() - start
+
+    return {
+        "input": path,
+        "output": output,
+        "leaves": tree.count_leaves,
+        "elements": len(mesh.elements),
+        "nodes": mesh.nodes.shape[0],
+        "timings": timings,
+        "cached": cached,
+    }
+
+
+def _output_names(paths):
+    """
+    Return distinct paths of the output files of images relative to the
+    output directory and without extension (see mesh_batch).
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    if not paths:
+        return []
+    common = os.path.commonpath([os.path.dirname(path) for path in paths])
+    relative = [os.path.relpath(path, common) for path in paths]
+    stems = [os.path.splitext(name)[0] for name in relative]
+    counts = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+
+    return [name if counts[stem] > 1 else stem for name, stem in zip(relative, stems)]
+
+
+def _mesh_image_safely(path, output_name, options):
+    try:
+        return mesh_image(path, output_name=output_name, **options)
+    except Exception as error:  # Report the failure and keep the batch going
+        return {"input": path, "error": f"{type(error).__name__}: {error}"}
+
+
+def mesh_batch(inputs, output_dir=".", workers=None, callback=None, **options):
+    """
+    Mesh a stack of images in a pool of processes.
+
+    At most twice as many images as workers are submitted at a time, so
+    the memory use is bounded for any number of images. Each mesh is
+    written to its own file as soon as it is generated. The files are
+    named after the images and mirror their paths relative to the common
+    directory of the images. Images with the same name in the same
+    directory keep their extension (scan.png.vtk and scan.tif.vtk), so
+    no mesh overwrites another one.
+
+    Parameters
+    ----------
+    inputs : str or list(str)
+        Paths of images, directories or glob patterns (see find_images).
+    output_dir : str, optional
+        Directory of output files. It is created if needed.
+    workers : None or int, optional
+        Number of processes. Default is the number of processors.
+    callback : None or callable, optional
+        A function called with the summary of each image when it is done.
+    **options
+        Options of mesh_image (crit, criterion, balancing, output_format,
+        scale, drop_outside, root_size, cache_dir and cache_size).
+
+    Returns
+    -------
+    summaries : list(dict)
+        Summaries of images (see mesh_image) in order of inputs. Failed
+        images have an "error" entry instead of the results.
+    """
+    paths = find_images(inputs)
+    os.makedirs(output_dir, exist_ok=True)
+    options["output_dir"] = output_dir
+    workers = workers or os.cpu_count()
+    summaries = {}
+    # Imported here, worker processes do not need the pool machinery
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_reset_context) as pool:
+        pending = set()
+        queue = zip(paths, _output_names(paths))
+        while True:
+            for path, output_name in queue:
+                pending.add(pool.submit(_mesh_image_safely, path, output_name, options))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                summary = future.result()
+                summaries[summary["input"]] = summary
+                if callback is not None:
+                    callback(summary)
+                try:
+                    _step("images", 1, len(paths))
+                except MeshingCancelled:
+                    # Images that have not started are not meshed
+                    for future in pending:
+                        future.cancel()
+                    raise
+
+    return [summaries[path] for path in paths]
+
+
+def format_summary(summaries):
+    """
+    Return a table of the results and timings of a batch as text.
+
+    Parameters
+    ----------
+    summaries : list(dict)
+        Summaries of images returned by mesh_batch.
+
+    Returns
+    -------
+    text : str
+    """
+    stages = ("load", "tree", "mesh", "export")
+    lines = [
+        f"{'image':<30} {'leaves':>10} {'elements':>10} "
+        + " ".join(f"{stage:>8}" for stage in stages)
+    ]
+    totals = dict.fromkeys(stages, 0.0)
+    elements = failed = 0
+    for summary in summaries:
+        name = os.path.basename(summary["input"])[:30]
+        if "error" in summary:
+            failed += 1
+            lines.append(f"{name:<30} failed: {summary['error']}")
+            continue
+        elements += summary["elements"]
+        for stage in stages:
+            totals[stage] += summary["timings"][stage]
+        lines.append(
+            f"{name:<30} {summary['leaves']:>10} {summary['elements']:>10} "
+            + " ".join(f"{summary['timings'][stage]:>8.3f}" for stage in stages)
+        )
+    lines.append(
+        f"{len(summaries) - failed} images meshed, {failed} failed, "
+        f"{elements} elements, "
+        + ", ".join(f"{stage} {totals[stage]:.3f} s" for stage in stages)
+    )
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+    Entry point of the qtreemesh command.
+    """
+    parser = argparse.ArgumentParser(
+        prog="qtreemesh",
+        description="Generate quadtree meshes from images.",
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="images, directories or glob patterns"
+    )
+    parser.add_argument(
+        "-o", "--output-dir", default=".", help="directory of the mesh files"
+    )
+    parser.add_argument(
+        "-c", "--crit", type=float, default=1, help="criteria for partitioning"
+    )
+    parser.add_argument(
+        "--criterion", default="range", help="splitting criterion (default: range)"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        default="vtk",
+        choices=sorted(OUTPUT_FORMATS),
+        help="output format (default: binary vtk)",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="size of a pixel in real units"
+    )
+    parser.add_argument(
+        "--no-balancing", action="store_true", help="skip 2:1 balancing"
+    )
+    parser.add_argument(
+        "--drop-outside",
+        action="store_true",
+        help="do not mesh the padding of non-square images",
+    )
+    parser.add_argument(
+        "--root-size",
+        type=int,
+        default=None,
+        help="tile the image by root cells of this size (a power of 2)",
+    )
+    parser.add_argument("--cache", default=None, help="directory of a cache of meshes")
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=1024,
+        help="maximum size of the cache in MiB (default: 1024)",
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="number of processes"
+    )
+    parser.add_argument("--json", help="write the summary to a JSON file")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="only print the summary line"
+    )
+    args = parser.parse_args(argv)
+
+    if not find_images(args.inputs):
+        parser.error("no images found")
+    summaries = mesh_batch(
+        args.inputs,
+        args.output_dir,
+        args.workers,
+        crit=args.crit,
+        criterion=args.criterion,
+        balancing=not args.no_balancing,
+        output_format=args.format,
+        scale=args.scale,
+        drop_outside=args.drop_outside,
+        root_size=args.root_size,
+        cache_dir=args.cache,
+        cache_size=int(args.cache_size * (1 << 20)),
+    )
+    text = format_summary(summaries)
+    print(text.splitlines()[-1] if args.quiet else text)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file_open:
+            json.dump(summaries, file_open, indent=2)
+
+    return 1 if any("error" in summary for summary in summaries) else 0
@@ -0,0 +1,332 @@
+"""
+On-disk cache of quadtrees and meshes keyed by the content of images and
+the meshing parameters.
+
+Author : Sadjad Abedi
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+from ._linear import LinearQTree
+from ._qtreemesh import PaddedImage, Point, QTreeMesh
+
+_CACHE_VERSION = 1
+
+
+class MeshCache:
+    """
+    A class used to represent an on-disk cache of quadtrees and meshes.
+
+    Each tree or mesh is stored in a compressed NumPy (.npz) file named
+    after a hash of the pixels of the image and the parameters, so the same
+    image meshed with the same parameters is loaded from the file instead of
+    being built again, also by other processes and later runs. When the
+    files take more than max_bytes, the least recently used ones are
+    removed.
+
+    Only the name of the splitting criterion is part of the key, so the
+    built-in criteria can not be replaced (see register_criterion), and
+    the cache has to be cleared when a custom criterion is registered
+    again with a different function.
+
+    ...
+
+    Attributes
+    ----------
+    directory : str
+        Directory of the cache files. It is created if needed.
+    max_bytes : int, optional
+        Maximum total size of the cache files. Default is 1 GiB.
+    hits : int
+        Number of trees and meshes loaded from the cache.
+    misses : int
+        Number of trees and meshes built and added to the cache.
+
+    Methods
+    -------
+    key(image_array, **parameters)
+        Return the hash of an image and parameters.
+    tree(image_array, crit=1, scale=1.0, ...)
+        Return the LinearQTree of an image from the cache or build it.
+    mesh(image_array, crit=1, scale=1.0, ...)
+        Return the QTreeMesh of an image from the cache or build it.
+    clear()
+        Remove all files of the cache.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(image_array, **parameters):
+        """
+        Return the hash of the pixels of an image and the parameters.
+
+        Parameters
+        ----------
+        image_array : numpy array or PaddedImage
+            The (preprocessed) image. Memory maps are read in blocks of rows.
+        **parameters
+            Parameters given to json.dumps.
+
+        Returns
+        -------
+        key : str
+            Hexadecimal digest.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        settings = {"version": _CACHE_VERSION, "parameters": parameters}
+        if isinstance(image_array, PaddedImage):
+            settings["padding"] = [
+                list(image_array.shape),
+                list(image_array.offset),
+                float(image_array.fill_value),
+            ]
+            image_array = image_array.image
+        settings["image"] = [list(image_array.shape), str(image_array.dtype)]
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        step = max(1, (1 << 24) // max(image_array[:1].nbytes, 1))
+        for start in range(0, image_array.shape[0], step):
+            digest.update(np.ascontiguousarray(image_array[start : start + step]))
+
+        return digest.hexdigest()
+
+    def tree(
+        self,
+        image_array,
+        crit=1,
+        scale=1.0,
+        bottom_left_corner=Point((0.0, 0.0)),
+        criterion="range",
+        min_size=1,
+        max_size=None,
+        root_size=None,
+        balancing=False,
+    ):
+        """
+        Return the LinearQTree of an image from the cache, or build it by
+        LinearQTree.from_array and add it to the cache.
+
+        The parameters are those of LinearQTree.from_array, and balancing
+        indicates whether the tree is balanced for 2:1 ratio. The criterion
+        has to be the name of a registered criterion, which is hashed by
+        name only. A tree loaded from the cache has no image_stats.
+
+        Returns
+        -------
+        tree : LinearQTree object
+        """
+        parameters = _parameters(
+            "tree",
+            crit,
+            scale,
+            bottom_left_corner,
+            criterion,
+            min_size,
+            max_size,
+            root_size,
+            balancing=balancing,
+        )
+        path = self._path(self.key(image_array, **parameters))
+        arrays = self._load(path)
+        if arrays is not None:
+            return LinearQTree._from_arrays(arrays)
+
+        tree = LinearQTree.from_array(
+            image_array,
+            crit,
+            scale,
+            bottom_left_corner,
+            criterion,
+            min_size,
+            max_size,
+            root_size,
+        )
+        if balancing:
+            tree.balancing()
+        self._store(path, tree._to_arrays())
+
+        return tree
+
+    def mesh(
+        self,
+        image_array,
+        crit=1,
+        scale=1.0,
+        bottom_left_corner=Point((0.0, 0.0)),
+        criterion="range",
+        min_size=1,
+        max_size=None,
+        root_size=None,
+        balancing=True,
+        drop_outside=False,
+        compact=True,
+    ):
+        """
+        Return the QTreeMesh of an image from the cache, or build it from a
+        LinearQTree and add it to the cache.
+
+        The parameters are those of LinearQTree.from_array, QTreeMesh and
+        QTreeMesh.create_elements. The criterion has to be the name of a
+        registered criterion, which is hashed by name only. A mesh loaded
+        from the cache has its elements created, and its tree has no
+        image_stats.
+
+        Returns
+        -------
+        mesh : QTreeMesh object
+        """
+        parameters = _parameters(
+            "mesh",
+            crit,
+            scale,
+            bottom_left_corner,
+            criterion,
+            min_size,
+            max_size,
+            root_size,
+            balancing=balancing,
+            drop_outside=drop_outside,
+        )
+        path = self._path(self.key(image_array, **parameters))
+        arrays = self._load(path)
+        if arrays is not None:
+            tree = LinearQTree._from_arrays(_split(arrays, "tree_"))
+            arrays["compact"] = np.array(compact)
+            return QTreeMesh._from_arrays(tree, arrays)
+
+        tree = LinearQTree.from_array(
+            image_array,
+            crit,
+            scale,
+            bottom_left_corner,
+            criterion,
+            min_size,
+            max_size,
+            root_size,
+        )
+        mesh = QTreeMesh(tree, balancing, drop_outside)
+        mesh.create_elements(compact)
+        arrays = mesh._to_arrays()
+        arrays.update(
+            ("tree_" + name, array) for name, array in tree._to_arrays().items()
+        )
+        self._store(path, arrays)
+
+        return mesh
+
+    def clear(self):
+        """
+        Remove all files of the cache.
+        """
+        for path, _, _ in self._entries():
+            _remove(path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _load(self, path):
+        try:
+            with np.load(path) as data:
+                arrays = dict(data)
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            pass  # Evicted by another process after it was read
+        self.hits += 1
+
+        return arrays
+
+    def _store(self, path, arrays):
+        # Write to a temporary file first, so other processes never read
+        # an incomplete file
+        handle, temporary = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(handle, "wb") as file_open:
+                np.savez_compressed(file_open, **arrays)
+            os.replace(temporary, path)
+        except BaseException:
+            _remove(temporary)
+            raise
+        self._evict(keep=path)
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith(".npz"):
+                    continue
+                try:
+                    status = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, status.st_mtime, status.st_size))
+
+        return entries
+
+    def _evict(self, keep):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                _remove(path)
+                total -= size
+
+
+def _parameters(
+    kind,
+    crit,
+    scale,
+    bottom_left_corner,
+    criterion,
+    min_size,
+    max_size,
+    root_size,
+    **options,
+):
+    if not isinstance(criterion, str):
+        raise TypeError(
+            "Only criteria given by name can be cached, see register_criterion."
+        )
+
+    return dict(
+        kind=kind,
+        crit=float(crit),
+        scale=float(scale),
+        bottom_left_corner=[float(value) for value in bottom_left_corner.xy_coord],
+        criterion=criterion,
+        min_size=int(min_size),
+        max_size=None if max_size is None else int(max_size),
+        root_size=None if root_size is None else int(root_size),
+        **{name: bool(value) for name, value in options.items()},
+    )
+
+
+def _split(arrays, prefix):
+    return {
+        name[len(prefix) :]: array
+        for name, array in arrays.items()
+        if name.startswith(prefix)
+    }
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
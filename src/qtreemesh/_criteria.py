@@ -0,0 +1,136 @@
+"""
+Splitting criteria of quadtree blocks.
+
+A criterion is a function criterion(pyramid, depth, crit) that returns a
+boolean array of shape (2^depth, 2^depth) which indicates whether each
+block of a level of an ImagePyramid has to be divided. All blocks of a
+level are evaluated at once.
+
+Author : Sadjad Abedi
+"""
+
+import numpy as np
+
+_CRITERIA = {}
+_BUILT_IN = ("range", "std", "entropy", "gradient")
+
+
+def register_criterion(name, function):
+    """
+    Register a splitting criterion so that it can be chosen by name.
+
+    Parameters
+    ----------
+    name : str
+        Name of the criterion. An existing criterion with the same name
+        is replaced, except the built-in criteria ("range", "std",
+        "entropy" and "gradient"), which MeshCache identifies by name.
+    function : callable
+        A function criterion(pyramid, depth, crit) that returns a boolean
+        array of shape (2^depth, 2^depth). The reductions of the pyramid
+        (minimum, maximum, total, block_sums() and block_histograms()) can
+        be used to evaluate the blocks.
+
+    Returns
+    -------
+    function : callable
+        The registered function.
+    """
+    if not callable(function):
+        raise TypeError("A splitting criterion must be callable.")
+    if name in _BUILT_IN and _CRITERIA.get(name, function) is not function:
+        raise ValueError(f"The built-in criterion {name!r} can not be replaced.")
+    _CRITERIA[name] = function
+
+    return function
+
+
+def get_criterion(criterion):
+    """
+    Return the function of a splitting criterion.
+
+    Parameters
+    ----------
+    criterion : str or callable
+        Name of a registered criterion, or a criterion function.
+
+    Returns
+    -------
+    function : callable
+    """
+    if callable(criterion):
+        return criterion
+    if criterion not in _CRITERIA:
+        raise ValueError(
+            f"Unknown splitting criterion {criterion!r}, "
+            f"available criteria are {', '.join(sorted(_CRITERIA))}."
+        )
+
+    return _CRITERIA[criterion]
+
+
+def range_criterion(pyramid, depth, crit):
+    """
+    Divide blocks whose maximum and minimum intensities differ by more
+    than crit.
+    """
+    return (pyramid.maximum[depth] - pyramid.minimum[depth]) > crit
+
+
+def std_criterion(pyramid, depth, crit):
+    """
+    Divide blocks whose standard deviation of intensities is more than crit.
+    """
+    area = pyramid.block_size(depth) ** 2
+    mean = pyramid.total[depth] / area
+    squares = pyramid.block_sums("squares", np.square)[depth] / area
+
+    return np.sqrt(np.maximum(squares - mean * mean, 0.0)) > crit
+
+
+def entropy_criterion(pyramid, depth, crit, bins=16):
+    """
+    Divide blocks whose Shannon entropy (in bits) of intensities is more
+    than crit. Intensities are grouped in 16 bins of equal width between
+    the minimum and maximum intensities of the image. The histograms of the
+    blocks are reduced up the levels (see ImagePyramid.block_histograms).
+    """
+    low, high = float(pyramid.minimum[0][0, 0]), float(pyramid.maximum[0][0, 0])
+    if high == low:
+        return np.zeros(pyramid.minimum[depth].shape, dtype=bool)
+    histogram = pyramid.block_histograms(bins)[depth]
+    area = pyramid.block_size(depth) ** 2
+    probability = histogram / area
+    void = area - histogram.sum(axis=2)  # Pixels of a virtual padding
+    if void.any():
+        fill = int((pyramid.fill_value - low) * (bins / (high - low)))
+        probability[:, :, min(fill, bins - 1)] += void / area
+    logarithm = np.log2(
+        probability, where=probability > 0, out=np.zeros_like(probability)
+    )
+
+    return -(probability * logarithm).sum(axis=2) > crit
+
+
+def gradient_criterion(pyramid, depth, crit):
+    """
+    Divide blocks whose average gradient magnitude of intensities (an
+    indicator of the density of edges) is more than crit.
+    """
+    area = pyramid.block_size(depth) ** 2
+
+    return pyramid.block_sums("gradient", _gradient_magnitude)[depth] / area > crit
+
+
+def _gradient_magnitude(image):
+    if min(image.shape) < 2:
+        return np.zeros(image.shape)
+    gradient_y, gradient_x = np.gradient(image)
+
+    return np.hypot(gradient_x, gradient_y)
+
+
+register_criterion("range", range_criterion)
+register_criterion("std", std_criterion)
+register_criterion("entropy", entropy_criterion)
+register_criterion("gradient", gradient_criterion)
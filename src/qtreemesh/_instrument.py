@@ -0,0 +1,262 @@
+"""
+Opt-in instrumentation of the stages of the meshing pipeline.
+
+Author : Sadjad Abedi
+"""
+
+import contextvars
+import functools
+import logging
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Statistics collected by the innermost instrument() block of the context
+_STATS = contextvars.ContextVar("qtreemesh_stats", default=None)
+
+
+class PipelineStats:
+    """
+    A class used to represent statistics of the meshing pipeline collected
+    by instrument().
+
+    ...
+
+    Attributes
+    ----------
+    stages : dict
+        Number of calls and wall time in seconds of each stage ("tree",
+        "balancing", "mesh", "labeling", "refactor_edge", "create_elements",
+        "adjust_mesh_for_FEM", "fem_arrays", "vtk_export", "vtu_export",
+        "tree_update" and "update"). Times include the stages called by a
+        stage, e.g. "mesh" includes "balancing" when QTreeMesh balances the
+        tree.
+    counters : dict
+        Numbers added up over the block: "nodes_created" (nodes of QTree
+        objects, or leaves of LinearQTree objects, created by building and
+        balancing trees), "balancing_splits" and "neighbor_lookups" (neighbors
+        of leaves checked by balancing). Sizes of the last tree or mesh:
+        "leaves", "cells", "nodes", "edge_points", "elements" and
+        "fem_elements".
+    leaves_per_depth : dict
+        Number of leaves of each depth of the last tree or mesh.
+    elements_per_mode : dict
+        Number of cells of each basic mode (see QTreeMesh.mode_detection)
+        of the last mesh.
+
+    Methods
+    -------
+    count(name, value=1)
+        Add a value to a counter.
+    as_dict()
+        Return the statistics as a dict.
+    log(logger="qtreemesh", level=logging.INFO)
+        Emit the statistics as one log record.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.leaves_per_depth = {}
+        self.elements_per_mode = {}
+        self._running = set()
+
+    def count(self, name, value=1):
+        """
+        Add a value to a counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def as_dict(self):
+        """
+        Return the statistics as a dict of plain Python numbers, which can
+        be serialized with json.dumps.
+        """
+        return {
+            "stages": {name: dict(stage) for name, stage in self.stages.items()},
+            "counters": dict(self.counters),
+            "leaves_per_depth": dict(self.leaves_per_depth),
+            "elements_per_mode": dict(self.elements_per_mode),
+        }
+
+    def log(self, logger="qtreemesh", level=logging.INFO):
+        """
+        Emit the statistics as one log record.
+
+        The record has a short summary of the stage times as message, and
+        the output of as_dict() as its qtreemesh_stats attribute, for
+        handlers that send structured records to monitoring.
+
+        Parameters
+        ----------
+        logger : str or logging.Logger, optional
+            The logger or its name. Default is "qtreemesh".
+        level : int, optional
+            Level of the record. Default is logging.INFO.
+        """
+        if isinstance(logger, str):
+            logger = logging.getLogger(logger)
+        summary = " ".join(
+            f"{name}={stage['seconds']:.3f}s" for name, stage in self.stages.items()
+        )
+        logger.log(
+            level,
+            "qtreemesh stats: %s",
+            summary,
+            extra={"qtreemesh_stats": self.as_dict()},
+        )
+
+    def _add_stage(self, name, seconds):
+        stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+        stage["calls"] += 1
+        stage["seconds"] += seconds
+
+    def _set_depths(self, sizes, root_size):
+        depths = int(root_size).bit_length() - 1 - np.log2(sizes).astype(np.int64)
+        values, counts = np.unique(depths, return_counts=True)
+        self.leaves_per_depth = dict(zip(values.tolist(), counts.tolist()))
+
+
+@contextmanager
+def instrument(callback=None, logger=None):
+    """
+    Collect statistics of the meshing pipeline run in a with block.
+
+    The statistics are collected in the current thread or task (see
+    contextvars), and the work done in the pools of build_parallel and
+    mesh_batch is only timed as a whole. Outside of a block, the stages
+    are not timed.
+
+    Parameters
+    ----------
+    callback : None or callable, optional
+        Called with the PipelineStats object at the end of the block, also
+        when the block raises an exception.
+    logger : None, str or logging.Logger, optional
+        If given, the statistics are emitted as a log record at the end of
+        the block (see PipelineStats.log).
+
+    Yields
+    ------
+    stats : PipelineStats object
+
+    Examples
+    --------
+    >>> with instrument() as stats:
+    ...     mesh = QTreeMesh(LinearQTree.from_array(image_array, 40))
+    ...     mesh.create_elements()
+    >>> stats.as_dict()["stages"]["balancing"]["seconds"]
+    """
+    stats = PipelineStats()
+    token = _STATS.set(stats)
+    try:
+        yield stats
+    finally:
+        _STATS.reset(token)
+        if callback is not None:
+            callback(stats)
+        if logger is not None:
+            stats.log(logger)
+
+
+def _instrumented(stage, record=None):
+    """
+    Decorate a function to be timed as a stage inside instrument() blocks.
+
+    A stage called by itself, e.g. by recursion, is timed once. record is
+    called with the stats, the result and the arguments of the function.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = _STATS.get()
+            if stats is None or stage in stats._running:
+                return function(*args, **kwargs)
+            stats._running.add(stage)
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                stats._running.discard(stage)
+                stats._add_stage(stage, time.perf_counter() - start)
+            if record is not None:
+                record(stats, result, *args, **kwargs)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _count(name, value=1):
+    """
+    Add a value to a counter inside instrument() blocks.
+    """
+    stats = _STATS.get()
+    if stats is not None:
+        stats.count(name, value)
+
+
+def _record_tree(stats, result, *args, **kwargs):
+    # Constructors return the tree, methods of the root get it as self
+    tree = args[0] if result is None else result
+    _record_leaves(stats, tree)
+    leaves = stats.counters["leaves"]
+    if hasattr(tree, "levels"):  # LinearQTree
+        stats.count("nodes_created", leaves)
+    else:
+        # Each split adds 4 nodes and 3 leaves to the root
+        stats.count("nodes_created", (4 * leaves - 1) // 3)
+
+
+def _record_leaves(stats, tree):
+    if hasattr(tree, "levels"):
+        sizes, root_size = tree.sizes, tree.root_size
+    else:
+        sizes, root_size = tree.leaf_arrays()[1], tree.array.shape[0]
+    stats.counters["leaves"] = int(sizes.shape[0])
+    stats._set_depths(sizes, root_size)
+
+
+def _record_balancing(stats, splits, tree, *args, **kwargs):
+    stats.count("balancing_splits", splits)
+    stats.count("nodes_created", 4 * splits)
+    _record_leaves(stats, tree)
+
+
+def _record_tree_update(stats, result, tree, *args, **kwargs):
+    _record_leaves(stats, tree)
+
+
+def _record_mesh(stats, result, mesh, *args, **kwargs):
+    quad_tree = mesh.quad_tree
+    root_size = getattr(quad_tree, "root_size", None) or quad_tree.array.shape[0]
+    stats.counters["cells"] = int(mesh.leaf_sizes.shape[0])
+    stats._set_depths(mesh.leaf_sizes, root_size)
+
+
+def _record_nodes(stats, result, mesh, *args, **kwargs):
+    stats.counters["nodes"] = int(mesh.nodes.shape[0])
+
+
+def _record_modes(stats, result, mesh, *args, **kwargs):
+    _record_nodes(stats, result, mesh)
+    _record_mesh(stats, result, mesh)
+    stats.counters["edge_points"] = int(np.count_nonzero(mesh.hanging_nodes))
+    values, counts = np.unique(mesh.cell_modes[:, 0], return_counts=True)
+    stats.elements_per_mode = dict(zip(values.tolist(), counts.tolist()))
+
+
+def _record_elements(stats, result, mesh, *args, **kwargs):
+    stats.counters["elements"] = len(mesh.elements)
+
+
+def _record_fem_elements(stats, result, *args, **kwargs):
+    stats.counters["fem_elements"] = len(result[1])
+
+
+def _record_fem_arrays(stats, result, *args, **kwargs):
+    stats.counters["fem_elements"] = len(result[1]) + len(result[3])
@@ -0,0 +1,841 @@
+"""
+A linear (Morton-code) representation of quadtrees.
+
+Author : Sadjad Abedi
+"""
+
+import numpy as np
+
+from ._instrument import (
+    _count,
+    _instrumented,
+    _record_balancing,
+    _record_tree,
+    _record_tree_update,
+)
+from ._progress import _BATCH, _check, _step
+from ._qtreemesh import (
+    ImagePyramid,
+    PaddedImage,
+    Point,
+    QTree,
+    _load_arrays,
+    _save_arrays,
+)
+
+
+def morton_encode(rows, cols):
+    """
+    Interleave the bits of rows and columns into Morton (Z-order) keys.
+
+    Parameters
+    ----------
+    rows : numpy array
+        Integer rows (at most 32 bits).
+    cols : numpy array
+        Integer columns (at most 32 bits).
+
+    Returns
+    -------
+    keys : numpy array
+        Morton keys as uint64. Bits of rows occupy odd positions.
+    """
+    return (_spread_bits(rows) << np.uint64(1)) | _spread_bits(cols)
+
+
+def morton_decode(keys):
+    """
+    Split Morton (Z-order) keys into rows and columns.
+
+    Parameters
+    ----------
+    keys : numpy array
+        Morton keys as created by morton_encode.
+
+    Returns
+    -------
+    rows, cols : numpy array
+        Integer rows and columns as int64.
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    rows = _compact_bits(keys >> np.uint64(1))
+    cols = _compact_bits(keys)
+
+    return rows.astype(np.int64), cols.astype(np.int64)
+
+
+_SPREAD_MASKS = (
+    (16, 0x0000FFFF0000FFFF),
+    (8, 0x00FF00FF00FF00FF),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+)
+
+
+def _spread_bits(values):
+    values = np.asarray(values).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in _SPREAD_MASKS:
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+
+    return values
+
+
+def _morton_key(row, col):
+    # morton_encode of a single pixel with Python integers
+    row, col = row & 0xFFFFFFFF, col & 0xFFFFFFFF
+    for shift, mask in _SPREAD_MASKS:
+        row = (row | (row << shift)) & mask
+        col = (col | (col << shift)) & mask
+
+    return (row << 1) | col
+
+
+def _compact_bits(values):
+    values = values & np.uint64(0x5555555555555555)
+    for shift, mask in (
+        (1, 0x3333333333333333),
+        (2, 0x0F0F0F0F0F0F0F0F),
+        (4, 0x00FF00FF00FF00FF),
+        (8, 0x0000FFFF0000FFFF),
+        (16, 0x00000000FFFFFFFF),
+    ):
+        values = (values | (values >> np.uint64(shift))) & np.uint64(mask)
+
+    return values
+
+
+class LinearQTree:
+    """
+    A class used to represent a linear quadtree.
+
+    Only the leaves are stored, as NumPy arrays sorted by the Morton (Z-order)
+    key of their top left pixel. There is no object per node, so the memory
+    use is a few bytes per leaf.
+
+    The tree can also be a forest of square root cells of root_size pixels
+    that tile a rectangular image (see from_array). The keys of all roots
+    share one Morton order, so the leaves of the forest are balanced and
+    meshed together with conforming nodes between the roots.
+
+    ...
+
+    Attributes
+    ----------
+    keys : numpy array
+        Sorted uint64 Morton keys of the top left pixel of the leaves.
+    levels : numpy array
+        Depth of each leaf in the tree (0 for the root) as uint8.
+    properties : numpy array
+        An indicator for material properties of each leaf calculated by
+        averaging the pixels intensities.
+    max_level : int
+        Depth of single pixel cells, i.e. log2 of the image dimension.
+    scale : float, optional
+        The ratio between pixels units and real units. Default value is 1.
+    bottom_left_corner : Point, optional
+        Coordinate of the bottom left corner of the image.
+        Default position is (0.0,0.0).
+    image_stats : None or ImagePyramid object, optional
+        Statistics of the image used to calculate the property of leaves
+        created by balancing. When None, new leaves inherit the property of
+        the leaf they are split from.
+    extent : tuple (int, int), optional
+        Number of rows and columns of the domain covered by the image.
+        Default is the whole domain.
+    root_size : None or int, optional
+        Number of pixels in each direction of the root cells of a forest.
+        Default is 2^max_level, i.e. a single root.
+    domain : tuple (int, int)
+        Number of rows and columns of pixels covered by the root cells.
+    origins : numpy array
+        Row and column of the top left pixel of each leaf.
+    sizes : numpy array
+        Number of pixels in each direction of each leaf.
+    count_leaves : int
+        Total number of leaves.
+
+    Methods
+    -------
+    from_array(array, crit=1, scale=1.0, ...)
+        Build a linear quadtree from an image array.
+    from_qtree(quad_tree)
+        Convert a QTree into a linear quadtree.
+    to_qtree(array)
+        Convert the linear quadtree into a QTree.
+    leaf_arrays()
+        Return integer positions, sizes and properties of the leaves
+        as NumPy arrays.
+    balancing()
+        Balance the linear quadtree for 2:1 ratio.
+    update(image_array, region, balance=False)
+        Update the leaves after a region of the image has changed.
+    save(path)
+        Save the leaves in a directory of NumPy files.
+    load(path, mmap_mode="r")
+        Load a linear quadtree saved by save().
+    """
+
+    def __init__(
+        self,
+        keys,
+        levels,
+        properties,
+        max_level,
+        scale=1.0,
+        bottom_left_corner=Point((0.0, 0.0)),
+        image_stats=None,
+        extent=None,
+        root_size=None,
+    ):
+        keys = np.asarray(keys, dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.levels = np.asarray(levels, dtype=np.uint8)[order]
+        self.properties = np.asarray(properties, dtype=np.float64)[order]
+        self.max_level = int(max_level)
+        self.scale = scale
+        self.bottom_left_corner = bottom_left_corner
+        self.image_stats = image_stats
+        if extent is None:
+            extent = (1 << self.max_level, 1 << self.max_level)
+        self.extent = tuple(extent)
+        self.root_size = 1 << self.max_level if root_size is None else int(root_size)
+
+    def _to_arrays(self):
+        """
+        Return the leaves and the settings of the tree as a dict of arrays,
+        from which _from_arrays builds the tree again.
+        """
+        return {
+            "keys": self.keys,
+            "levels": self.levels,
+            "properties": self.properties,
+            "max_level": np.array(self.max_level),
+            "scale": np.array(self.scale, dtype=np.float64),
+            "bottom_left_corner": np.array(
+                self.bottom_left_corner.xy_coord, dtype=np.float64
+            ),
+            "extent": np.array(self.extent),
+            "root_size": np.array(self.root_size),
+        }
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        """
+        Build a tree from the arrays returned by _to_arrays. The arrays are
+        used as they are (e.g. memory maps), and the tree has no image_stats.
+        """
+        tree = cls.__new__(cls)
+        tree.keys = arrays["keys"]
+        tree.levels = arrays["levels"]
+        tree.properties = arrays["properties"]
+        tree.max_level = int(arrays["max_level"])
+        tree.scale = float(arrays["scale"])
+        tree.bottom_left_corner = Point(tuple(arrays["bottom_left_corner"].tolist()))
+        tree.image_stats = None
+        tree.extent = tuple(arrays["extent"].tolist())
+        tree.root_size = int(arrays["root_size"])
+
+        return tree
+
+    def save(self, path):
+        """
+        Save the leaves and the settings of the tree in a directory of NumPy
+        (.npy) files that load() maps into memory. The image statistics
+        are not saved.
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory. It is created if needed.
+        """
+        _save_arrays(path, "LinearQTree", self._to_arrays())
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Load a linear quadtree saved by save() or QTree.save().
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory.
+        mmap_mode : None or str, optional
+            Mode of np.load, "r" (default) for read-only memory maps or None
+            to read the arrays into memory.
+
+        Returns
+        -------
+        tree : LinearQTree object
+            The tree without image_stats, so balancing() gives new leaves
+            the property of the leaf they are split from.
+        """
+        return cls._from_arrays(_load_arrays(path, "LinearQTree", mmap_mode))
+
+    @classmethod
+    @_instrumented("tree", _record_tree)
+    def from_array(
+        cls,
+        array,
+        crit=1,
+        scale=1.0,
+        bottom_left_corner=Point((0.0, 0.0)),
+        criterion="range",
+        min_size=1,
+        max_size=None,
+        root_size=None,
+    ):
+        """
+        Build a linear quadtree from an image array.
+
+        The splitting decisions are taken from the ImagePyramid of the array
+        level by level, so no QTree object is created. With the default
+        criterion, the leaves are the same as the leaves of
+        QTree(None, array, crit, scale).
+
+        With root_size, the image can be rectangular and of any dimensions.
+        It is tiled by a forest of square root cells of root_size pixels,
+        virtually padded up to a multiple of root_size only, so the work and
+        the number of leaves scale with the area of the image instead of
+        the area of the square of order 2^n that contains it.
+
+        Parameters
+        ----------
+        array : numpy array or PaddedImage
+            Square image array of order 2^n. Blocks in the virtual padding
+            of a PaddedImage become leaves of the fill value.
+        crit : int, optional
+            The criteria used for partitioning. Default value is 1.
+        scale : float, optional
+            The ratio between pixels units and real units. Default value is 1.
+        bottom_left_corner : Point, optional
+            Coordinate of the bottom left corner of the image.
+        criterion : str or callable, optional
+            The splitting criterion (see ImagePyramid). Default is "range".
+        min_size : int, optional
+            Minimum dimension of cells in pixels. Default value is 1.
+        max_size : None or int, optional
+            Maximum dimension of cells in pixels.
+        root_size : None or int, optional
+            Number of pixels in each direction of the root cells of a forest,
+            a power of 2. Default is None (a single root).
+
+        Returns
+        -------
+        tree : LinearQTree object
+        """
+        if root_size is not None:
+            if root_size < 1 or root_size & (root_size - 1):
+                raise ValueError("root_size has to be a power of 2.")
+            if min_size > root_size:
+                raise ValueError("min_size can not be larger than root_size.")
+            if not isinstance(array, PaddedImage):
+                array = PaddedImage(array)
+            root_size = min(root_size, array.shape[0])
+            max_size = root_size if max_size is None else min(max_size, root_size)
+        pyramid = ImagePyramid(array, crit, criterion, min_size, max_size)
+        # Blocks above the roots are divided or outside of the forest
+        root_depth = (
+            0 if root_size is None else pyramid.levels - root_size.bit_length() + 1
+        )
+
+        return cls(
+            *_pyramid_leaves(pyramid, root_depth),
+            pyramid.levels,
+            scale,
+            bottom_left_corner,
+            pyramid,
+            getattr(array, "extent", None),
+            root_size,
+        )
+
+    @classmethod
+    def from_qtree(cls, quad_tree):
+        """
+        Convert a QTree into a linear quadtree.
+
+        Parameters
+        ----------
+        quad_tree : QTree object
+            Root of a quadtree of a square image of order 2^n.
+
+        Returns
+        -------
+        tree : LinearQTree object
+        """
+        dimension = quad_tree.array.shape[0]
+        if quad_tree.array.shape[1] != dimension or dimension & (dimension - 1):
+            raise ValueError(
+                "LinearQTree requires a square image of order 2^n, "
+                "use image_preprocess() first."
+            )
+        max_level = dimension.bit_length() - 1
+        leaves = quad_tree.save_leaves()
+        origins = np.array([leaf.origin for leaf in leaves], dtype=np.int64)
+        origins = origins.reshape(-1, 2) - quad_tree.origin
+        sizes = np.array([leaf.array.shape[0] for leaf in leaves], dtype=np.int64)
+        levels = max_level - (np.log2(sizes) + 0.5).astype(np.int64)
+        image_stats = quad_tree.image_stats
+        if not isinstance(image_stats, ImagePyramid):
+            image_stats = None
+
+        return cls(
+            morton_encode(origins[:, 0], origins[:, 1]),
+            levels,
+            [leaf.property for leaf in leaves],
+            max_level,
+            quad_tree.scale,
+            quad_tree.bottom_left_corner,
+            image_stats,
+            quad_tree.extent,
+        )
+
+    def to_qtree(self, array):
+        """
+        Convert the linear quadtree into a QTree.
+
+        Parameters
+        ----------
+        array : numpy array
+            The image array the tree was built from. QTree nodes keep a view
+            of their partition of it.
+
+        Returns
+        -------
+        root : QTree object
+            Root of a QTree with the same leaves and properties.
+        """
+        return QTree.from_leaves(
+            array,
+            self.origins,
+            self.sizes,
+            self.properties,
+            self.scale,
+            self.bottom_left_corner,
+        )
+
+    @property
+    def origins(self):
+        """
+        Row and column of the top left pixel of each leaf.
+        """
+        rows, cols = morton_decode(self.keys)
+
+        return np.column_stack((rows, cols))
+
+    @property
+    def sizes(self):
+        """
+        Number of pixels in each direction of each leaf.
+        """
+        return np.left_shift(1, self.max_level - self.levels.astype(np.int64))
+
+    @property
+    def domain(self):
+        """
+        Number of rows and columns of pixels covered by the root cells.
+        """
+        return tuple(
+            -(-length // self.root_size) * self.root_size for length in self.extent
+        )
+
+    @property
+    def count_leaves(self):
+        """
+        Total number of leaves.
+        """
+        return self.keys.shape[0]
+
+    def leaf_arrays(self, box=None):
+        """
+        Return integer positions, sizes and properties of the leaves
+        as NumPy arrays.
+
+        Positions are measured in pixels from the bottom left corner of
+        the domain, with the vertical axis pointing upward (the same
+        orientation as bottom_left_corner). Leaves are in Morton order.
+
+        Parameters
+        ----------
+        box : None or tuple (int, int, int, int), optional
+            If given, only the leaves whose top left pixel is in the box
+            (first row, first column, last row + 1 and last column + 1) are
+            returned, e.g. the box returned by update.
+
+        Returns
+        -------
+        positions : numpy array
+            An (n, 2) integer array of horizontal and vertical pixel
+            coordinates of the bottom left corner of each leaf.
+        sizes : numpy array
+            An (n,) integer array of the number of pixels in each
+            direction of each leaf.
+        properties : numpy array
+            An (n,) array of the property of each leaf.
+        """
+        keys, levels, properties = self.keys, self.levels, self.properties
+        if box is not None:
+            # Morton order is increasing in both directions, so the leaves
+            # in the box are between the keys of its corners
+            corners = morton_encode(
+                np.array([box[0], box[2] - 1]), np.array([box[1], box[3] - 1])
+            )
+            first = np.searchsorted(keys, corners[0])
+            last = np.searchsorted(keys, corners[1], side="right")
+            keys, levels = keys[first:last], levels[first:last]
+            properties = properties[first:last]
+            rows, cols = morton_decode(keys)
+            inside = (
+                (rows >= box[0]) & (rows < box[2]) & (cols >= box[1]) & (cols < box[3])
+            )
+            keys, levels, properties = keys[inside], levels[inside], properties[inside]
+        rows, cols = morton_decode(keys)
+        sizes = np.left_shift(1, self.max_level - levels.astype(np.int64))
+        positions = np.column_stack((cols, self.domain[0] - rows - sizes))
+
+        return positions, sizes, properties.copy()
+
+    @_instrumented("balancing", _record_balancing)
+    def balancing(self):
+        """
+        Balance the linear quadtree for 2:1 ratio.
+
+        Leaves are processed from the finest level to the coarsest one. A
+        leaf splits any neighbor (on its 4 sides) that is more than one
+        level coarser, and the new leaves are processed with their own
+        level, so every leaf is visited once.
+
+        Returns
+        -------
+        splits : int
+            Number of leaves that were divided.
+        """
+        cells = {}  # (level, row, col) in units of the level -> property
+        buckets = [[] for _ in range(self.max_level + 1)]
+        levels = self.levels.tolist()
+        rows, cols = morton_decode(self.keys)
+        sizes = self.sizes
+        for level, row, col, size, value in zip(
+            levels,
+            (rows // sizes).tolist(),
+            (cols // sizes).tolist(),
+            sizes.tolist(),
+            self.properties.tolist(),
+        ):
+            cells[(level, row, col)] = value
+            buckets[level].append((row, col))
+
+        _check()
+        splits = self._balance(cells, buckets)
+        _check()
+        self._set_leaves(*self._cell_arrays(cells))
+
+        return splits
+
+    def _balance(self, cells, buckets):
+        splits = 0
+        lookups = 0
+        checked = 0
+        for level in range(self.max_level, 1, -1):
+            count = 1 << level
+            for row, col in buckets[level]:
+                if (level, row, col) not in cells:
+                    continue
+                checked += 1
+                if checked % _BATCH == 0:
+                    _step("balancing", _BATCH)
+                for n_row, n_col in (
+                    (row + 1, col),
+                    (row, col + 1),
+                    (row - 1, col),
+                    (row, col - 1),
+                ):
+                    if not (0 <= n_row < count and 0 <= n_col < count):
+                        continue
+                    lookups += 1
+                    coarse = level
+                    while (
+                        coarse >= 0
+                        and (
+                            coarse,
+                            n_row >> (level - coarse),
+                            n_col >> (level - coarse),
+                        )
+                        not in cells
+                    ):
+                        coarse -= 1
+                    # Divide the covering leaf until it is one level coarser
+                    while 0 <= coarse < level - 1:
+                        shift = level - coarse
+                        self._split_cell(
+                            cells, buckets, coarse, n_row >> shift, n_col >> shift
+                        )
+                        splits += 1
+                        coarse += 1
+        _step("balancing", checked % _BATCH)
+        _count("neighbor_lookups", lookups)
+
+        return splits
+
+    def _cell_arrays(self, cells):
+        keys, levels, properties = [], [], []
+        for (level, row, col), value in cells.items():
+            size = 1 << (self.max_level - level)
+            keys.append((row * size, col * size))
+            levels.append(level)
+            properties.append(value)
+        keys = np.array(keys, dtype=np.int64).reshape(-1, 2)
+
+        return (
+            morton_encode(keys[:, 0], keys[:, 1]),
+            np.array(levels, dtype=np.uint8),
+            np.array(properties, dtype=np.float64),
+        )
+
+    def _set_leaves(self, keys, levels, properties):
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.levels = levels[order]
+        self.properties = properties[order]
+
+    @_instrumented("tree_update", _record_tree_update)
+    def update(self, image_array, region, balance=False):
+        """
+        Update the leaves after a region of the image has changed.
+
+        The ImagePyramid of the tree (see from_array) is updated, and only
+        the leaves in a box around the region are replaced: the box covers
+        the blocks whose splitting decision changed and is grown until it
+        is made of whole leaves of the old and the new tree. Without
+        balancing, the result is the same as building the tree from the
+        changed image again.
+
+        Parameters
+        ----------
+        image_array : numpy array or PaddedImage
+            The changed image, with the same shape as the original one.
+        region : tuple (slice, slice)
+            Rows and columns of the changed pixels, e.g. np.s_[10:20, 30:45].
+        balance : bool, optional
+            If True, the tree is assumed to be balanced for 2:1 ratio, and
+            it is balanced again starting from the new leaves and the
+            leaves next to the box. Leaves outside of the box that were
+            divided by an earlier balancing are kept, so the tree can be
+            finer around the box than a new balanced tree, but it is
+            balanced. Default value is False.
+
+        Returns
+        -------
+        box : None or tuple (int, int, int, int)
+            First row, first column, last row + 1 and last column + 1 of the
+            pixels whose leaves were replaced. None if the region is empty.
+        """
+        pyramid = self.image_stats
+        if not isinstance(pyramid, ImagePyramid) or pyramid.image is None:
+            raise ValueError("Only a tree built by from_array can be updated.")
+        box = pyramid.update(image_array, region)
+        if box is None:
+            return None
+        root_depth = self.max_level - self.root_size.bit_length() + 1
+        rows, cols = morton_decode(self.keys)
+        sizes = self.sizes
+
+        while True:
+            leaves = _pyramid_leaves(pyramid, root_depth, box)
+            new_rows, new_cols = morton_decode(leaves[0])
+            new_sizes = np.left_shift(1, self.max_level - leaves[1].astype(np.int64))
+            old = _overlap(rows, cols, sizes, box)
+            grown = _bounds(
+                box,
+                (rows[old], cols[old], sizes[old]),
+                (new_rows, new_cols, new_sizes),
+            )
+            if grown == box:
+                break
+            box = grown
+
+        keep = ~old
+        ring = _overlap(rows, cols, sizes, _grow(box, 1)) & keep
+        if not balance:
+            self._set_leaves(
+                np.concatenate((self.keys[keep], leaves[0])),
+                np.concatenate((self.levels[keep], leaves[1])),
+                np.concatenate((self.properties[keep], leaves[2])),
+            )
+            return box
+
+        # Balance the new leaves and their neighbors, other leaves are only
+        # looked up in the arrays when they are reached
+        cells = _LeafCells(
+            self.keys[keep], self.levels[keep], self.properties[keep], self.max_level
+        )
+        buckets = [[] for _ in range(self.max_level + 1)]
+        for level, row, col, value in zip(
+            leaves[1].tolist(),
+            (new_rows // new_sizes).tolist(),
+            (new_cols // new_sizes).tolist(),
+            leaves[2].tolist(),
+        ):
+            cells[(level, row, col)] = value
+            buckets[level].append((row, col))
+        for level, row, col in zip(
+            self.levels[ring].tolist(),
+            (rows[ring] // sizes[ring]).tolist(),
+            (cols[ring] // sizes[ring]).tolist(),
+        ):
+            buckets[level].append((row, col))
+        self._balance(cells, buckets)
+
+        removed = np.zeros(cells.leaf_keys.shape[0], dtype=bool)
+        removed[list(cells.removed)] = True
+        divided = np.flatnonzero(keep)[removed]
+        box = _bounds(box, (rows[divided], cols[divided], sizes[divided]))
+        while True:  # The box is made of whole leaves again
+            inside = _overlap(rows, cols, sizes, box)
+            grown = _bounds(box, (rows[inside], cols[inside], sizes[inside]))
+            if grown == box:
+                break
+            box = grown
+        keys, levels, properties = self._cell_arrays(cells)
+        self._set_leaves(
+            np.concatenate((cells.leaf_keys[~removed], keys)),
+            np.concatenate((cells.levels[~removed], levels)),
+            np.concatenate((cells.properties[~removed], properties)),
+        )
+
+        return box
+
+    def _split_cell(self, cells, buckets, level, row, col):
+        value = cells.pop((level, row, col))
+        size = 1 << (self.max_level - level - 1)
+        for child_row, child_col in (
+            (2 * row, 2 * col),
+            (2 * row, 2 * col + 1),
+            (2 * row + 1, 2 * col),
+            (2 * row + 1, 2 * col + 1),
+        ):
+            if self.image_stats is not None:
+                value, _ = self.image_stats.node_stats(
+                    (child_row * size, child_col * size), size
+                )
+            cells[(level + 1, child_row, child_col)] = value
+            buckets[level + 1].append((child_row, child_col))
+
+
+class _LeafCells(dict):
+    """
+    Leaves by (level, row, col) in units of their level, as used to balance
+    a LinearQTree. Leaves that are not in the dictionary are looked up in
+    the sorted arrays of the leaves that were not changed.
+    """
+
+    def __init__(self, keys, levels, properties, max_level):
+        super().__init__()
+        self.leaf_keys = keys
+        self.levels = levels
+        self.properties = properties
+        self.max_level = max_level
+        self.removed = set()
+
+    def _find(self, key):
+        level, row, col = key
+        size = 1 << (self.max_level - level)
+        code = _morton_key(row * size, col * size)
+        index = int(np.searchsorted(self.leaf_keys, np.uint64(code)))
+        if (
+            index < self.leaf_keys.shape[0]
+            and int(self.leaf_keys[index]) == code
+            and self.levels[index] == level
+            and index not in self.removed
+        ):
+            return index
+
+        return None
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._find(key) is not None
+
+    def pop(self, key):
+        if dict.__contains__(self, key):
+            return dict.pop(self, key)
+        index = self._find(key)
+        if index is None:
+            raise KeyError(key)
+        self.removed.add(index)
+
+        return float(self.properties[index])
+
+
+def _pyramid_leaves(pyramid, root_depth=0, box=None):
+    """
+    Return the keys, levels and properties of the leaves given by the
+    splitting decisions of an ImagePyramid, traversed level by level from
+    the root or from the roots of a forest at root_depth. With a box
+    (first row, first column, last row + 1, last column + 1), only the
+    leaves that overlap it are returned.
+    """
+    rows = np.zeros(1, dtype=np.int64)
+    cols = np.zeros(1, dtype=np.int64)
+    keys, levels, properties = [], [], []
+
+    for depth in range(pyramid.levels + 1):
+        size = 2 ** (pyramid.levels - depth)
+        if box is not None:
+            near = _overlap(rows * size, cols * size, size, box)
+            rows, cols = rows[near], cols[near]
+        # Blocks outside of the levels are in the virtual padding
+        count_rows, count_cols = pyramid.split[depth].shape
+        inside = (rows < count_rows) & (cols < count_cols)
+        if inside.all():
+            split = pyramid.split[depth][rows, cols]
+        else:
+            split = np.zeros(rows.shape, dtype=bool)
+            split[inside] = pyramid.split[depth][rows[inside], cols[inside]]
+        _step("nodes", rows.shape[0])
+        leaf_rows, leaf_cols = rows[~split], cols[~split]
+        if depth >= root_depth:
+            keys.append(morton_encode(leaf_rows * size, leaf_cols * size))
+            levels.append(np.full(leaf_rows.shape[0], depth, dtype=np.uint8))
+            inside = inside[~split]
+            values = np.full(leaf_rows.shape[0], pyramid.fill_value, dtype=np.float64)
+            totals = pyramid.total[depth][leaf_rows[inside], leaf_cols[inside]]
+            values[inside] = totals / (size * size)
+            properties.append(values)
+        # Children of divided blocks at the next level
+        rows = (2 * rows[split][:, None] + [0, 0, 1, 1]).ravel()
+        cols = (2 * cols[split][:, None] + [0, 1, 0, 1]).ravel()
+        if depth + 1 == root_depth:  # Roots outside of the image
+            count_rows, count_cols = pyramid.split[root_depth].shape
+            inside = (rows < count_rows) & (cols < count_cols)
+            rows, cols = rows[inside], cols[inside]
+
+    return np.concatenate(keys), np.concatenate(levels), np.concatenate(properties)
+
+
+def _overlap(rows, cols, sizes, box):
+    # Blocks of pixels that overlap a box (row, col, row stop, col stop)
+    return (
+        (rows < box[2])
+        & (rows + sizes > box[0])
+        & (cols < box[3])
+        & (cols + sizes > box[1])
+    )
+
+
+def _grow(box, margin):
+    return (box[0] - margin, box[1] - margin, box[2] + margin, box[3] + margin)
+
+
+def _bounds(box, *blocks):
+    # The smallest box that contains a box and blocks (rows, cols, sizes)
+    box = list(box)
+    for rows, cols, sizes in blocks:
+        if len(rows) == 0:
+            continue
+        box[0] = min(box[0], int(rows.min()))
+        box[1] = min(box[1], int(cols.min()))
+        box[2] = max(box[2], int((rows + sizes).max()))
+        box[3] = max(box[3], int((cols + sizes).max()))
+
+    return tuple(box)
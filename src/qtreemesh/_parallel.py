@@ -0,0 +1,154 @@
+"""
+Parallel construction of linear quadtrees over tiles of an image.
+
+Author : Sadjad Abedi
+"""
+
+import os
+from itertools import repeat
+
+from ._instrument import _instrumented, _record_tree
+from ._linear import LinearQTree, morton_encode
+from ._progress import _reset_context, _step
+from ._qtreemesh import Point, _BlockMean
+from ._tiled import _join_tiles, _tile_reductions
+
+
+def _build_tile(tile, crit, criterion, min_size, max_size, balance):
+    tree = LinearQTree.from_array(
+        tile, crit, criterion=criterion, min_size=min_size, max_size=max_size
+    )
+    if balance:
+        tree.balancing()
+
+    return tree.keys, tree.levels, tree.properties, _tile_reductions(tree.image_stats)
+
+
+@_instrumented("tree", _record_tree)
+def build_parallel(
+    array,
+    crit=1,
+    scale=1.0,
+    bottom_left_corner=Point((0.0, 0.0)),
+    criterion="range",
+    min_size=1,
+    max_size=None,
+    tile_level=1,
+    workers=None,
+    executor="process",
+    balance=False,
+):
+    """
+    Build a linear quadtree by building the subtrees of 4^tile_level tiles
+    of the image in parallel.
+
+    The tiles are independent, so each one is built by
+    LinearQTree.from_array in a worker. The workers also return the
+    reductions of their tiles, from which the blocks coarser than the
+    tiles are decided (see ImagePyramid.from_blocks), and the subtrees of
+    the tiles inside divided blocks are joined under a common root.
+    "range" and "std" give the same leaves as LinearQTree.from_array, and
+    "gradient" does apart from tile borders. The "entropy" criterion needs
+    the whole image and is only supported with tile_level 0.
+
+    Parameters
+    ----------
+    array : numpy array
+        Square image array of order 2^n.
+    crit : int, optional
+        The criteria used for partitioning. Default value is 1.
+    scale : float, optional
+        The ratio between pixels units and real units. Default value is 1.
+    bottom_left_corner : Point, optional
+        Coordinate of the bottom left corner of the image.
+    criterion : str or callable, optional
+        The splitting criterion (see ImagePyramid). It has to be picklable
+        (e.g. the name of a registered criterion) for a process pool.
+        Default is "range".
+    min_size : int, optional
+        Minimum dimension of cells in pixels. Default value is 1.
+    max_size : None or int, optional
+        Maximum dimension of cells in pixels.
+    tile_level : int, optional
+        Depth of the tiles in the tree. The image is divided into
+        2^tile_level * 2^tile_level tiles, which are not made smaller than
+        2 * min_size pixels. Default value is 1.
+    workers : None or int, optional
+        Number of workers. Default is the number of processors.
+    executor : str, optional
+        "process" for a pool of processes or "thread" for a pool of
+        threads (NumPy releases the GIL in the reductions of the tiles).
+        Default is "process".
+    balance : bool, optional
+        If True, the tiles are balanced for 2:1 ratio by the workers and
+        the joined tree is balanced again to fix the seams between tiles.
+        Default value is False.
+
+    Returns
+    -------
+    tree : LinearQTree object
+    """
+    rows, cols = array.shape
+    if rows != cols or rows & (rows - 1) != 0:
+        raise ValueError(
+            "build_parallel requires a square image of order 2^n, "
+            "use image_preprocess() first."
+        )
+    max_level = rows.bit_length() - 1
+    if not 0 <= tile_level <= max_level:
+        raise ValueError(f"tile_level has to be between 0 and {max_level}.")
+    if executor not in ("process", "thread"):
+        raise ValueError('executor has to be "process" or "thread".')
+    # A tile smaller than 2 * min_size is not divided, so its worker would
+    # not evaluate the criterion for the blocks above the tiles
+    tile_level = min(tile_level, max(max_level - int(2 * min_size - 1).bit_length(), 0))
+    if criterion == "entropy" and tile_level > 0:
+        raise ValueError(
+            'The "entropy" criterion needs the whole image, use LinearQTree.from_array.'
+        )
+    # Imported here, worker processes do not need the pool machinery
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    count = 1 << tile_level
+    size = rows >> tile_level
+    tiles = (
+        array[row * size : (row + 1) * size, col * size : (col + 1) * size]
+        for row in range(count)
+        for col in range(count)
+    )
+    options = [repeat(crit), repeat(criterion), repeat(min_size), repeat(max_size)]
+    built, reductions = [], []
+    with pool_class(
+        max_workers=workers or os.cpu_count(), initializer=_reset_context
+    ) as pool:
+        results = pool.map(_build_tile, tiles, *options, repeat(balance))
+        for index, result in enumerate(results):
+            tile_keys, tile_levels, tile_properties, tile_reductions = result
+            row, col = divmod(index, count)
+            built.append(
+                (
+                    tile_keys | morton_encode(row * size, col * size),
+                    tile_levels + tile_level,
+                    tile_properties,
+                )
+            )
+            reductions.append(tile_reductions)
+            _step("tiles", 1, count * count)
+
+    keys, levels, properties = _join_tiles(
+        built, reductions, size, crit, criterion, min_size, max_size
+    )
+    tree = LinearQTree(
+        keys,
+        levels,
+        properties,
+        max_level,
+        scale,
+        bottom_left_corner,
+        _BlockMean(array),
+    )
+    if balance:
+        tree.balancing()
+
+    return tree
@@ -0,0 +1,199 @@
+"""
+Progress reports and cooperative cancellation of long-running meshing.
+
+Author : Sadjad Abedi
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+from ._instrument import _STATS
+
+# Progress of the innermost progress() block of the context
+_PROGRESS = contextvars.ContextVar("qtreemesh_progress", default=None)
+
+# Items of the loops over single items (or pixels of QTree subtrees) added
+# up between two reports
+_BATCH = 1024
+
+
+class MeshingCancelled(Exception):
+    """
+    Raised inside a progress() block when its CancellationToken is
+    cancelled or its time budget is exceeded.
+    """
+
+
+class CancellationToken:
+    """
+    A class used to represent a request to stop meshing.
+
+    The token is checked by the long loops of the pipeline run in a
+    progress() block, which then raise MeshingCancelled. It can be cancelled
+    from another thread, e.g. by a job scheduler.
+
+    ...
+
+    Attributes
+    ----------
+    timeout : None or float, optional
+        Time budget in seconds from the creation of the token, after which
+        it counts as cancelled. Default is no time budget.
+    deadline : None or float
+        time.monotonic() value at which the time budget ends.
+    cancelled : bool
+        Whether cancel() was called or the time budget is exceeded.
+
+    Methods
+    -------
+    cancel()
+        Request meshing to stop.
+    check()
+        Raise MeshingCancelled if the token is cancelled.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self._cancelled = False
+
+    def cancel(self):
+        """
+        Request meshing to stop.
+        """
+        self._cancelled = True
+
+    @property
+    def cancelled(self):
+        """
+        Whether cancel() was called or the time budget is exceeded.
+        """
+        return self._cancelled or (
+            self.deadline is not None and time.monotonic() >= self.deadline
+        )
+
+    def check(self):
+        """
+        Raise MeshingCancelled if the token is cancelled.
+        """
+        if self._cancelled:
+            raise MeshingCancelled("Meshing was cancelled.")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise MeshingCancelled(
+                f"Meshing exceeded its time budget of {self.timeout} s."
+            )
+
+
+class _Progress:
+    """
+    Counts of the items processed by each stage in a progress() block.
+    """
+
+    def __init__(self, callback, token, every):
+        self.callback = callback
+        self.token = token
+        self.every = every
+        self.done = {}
+        self.reported = {}
+
+    def step(self, stage, count, total):
+        self.token.check()
+        done = self.done.get(stage, 0) + count
+        if total is not None and done >= total:
+            # The stage is complete, a next call starts from 0
+            self.done[stage] = self.reported[stage] = 0
+        elif done - self.reported.get(stage, 0) < self.every:
+            self.done[stage] = done
+            return
+        else:
+            self.done[stage] = self.reported[stage] = done
+        if self.callback is not None:
+            self.callback(stage, done, total)
+
+
+@contextmanager
+def progress(callback=None, token=None, every=1000):
+    """
+    Report the progress of the meshing pipeline run in a with block, and
+    stop it when a token is cancelled.
+
+    The stages report the number of items they processed:
+
+    - "pixels": pixels of the image covered by the finished subtrees of a
+      QTree, reported by subtrees of 1024 pixels.
+    - "nodes": blocks of LinearQTree.from_array whose splitting was
+      decided, reported by depth.
+    - "balancing": leaves whose neighbors were checked by balancing.
+    - "labeling" and "refactor_edge": cells of a mesh.
+    - "elements": elements created by QTreeMesh.create_elements.
+    - "fem": cells converted by adjust_mesh_for_FEM and fem_arrays.
+    - "tiles": tiles of build_parallel and build_tiled.
+    - "images": images meshed by mesh_batch.
+
+    Loops over single items (leaves, elements) report them by batches of
+    1024. The token is checked for every report and between the phases of
+    the stages, and the meshing is stopped by raising MeshingCancelled. The
+    tree or mesh that was being built is then incomplete and has to be
+    discarded. Work in the worker processes or threads of build_parallel
+    and mesh_batch is only reported when it is collected.
+
+    Parameters
+    ----------
+    callback : None or callable, optional
+        Called as callback(stage, done, total) with the name of the stage,
+        the number of items processed and their total number, which is None
+        when it is not known in advance. done counts items of all calls of
+        a stage in the block, or of the current call if total is known.
+    token : None or CancellationToken, optional
+        Token checked by the loops of the pipeline. Default is a new token.
+    every : int, optional
+        Progress of each stage is reported after every this many items, and
+        when the stage is complete. Default is 1000.
+
+    Yields
+    ------
+    token : CancellationToken object
+
+    Examples
+    --------
+    >>> token = CancellationToken(timeout=600)
+    >>> with progress(lambda *report: print(*report), token):
+    ...     mesh = QTreeMesh(QTree(None, image_array, 40))
+    ...     mesh.create_elements()
+    """
+    if token is None:
+        token = CancellationToken()
+    reset = _PROGRESS.set(_Progress(callback, token, every))
+    try:
+        yield token
+    finally:
+        _PROGRESS.reset(reset)
+
+
+def _step(stage, count=1, total=None):
+    """
+    Add processed items of a stage inside progress() blocks.
+    """
+    current = _PROGRESS.get()
+    if current is not None:
+        current.step(stage, count, total)
+
+
+def _check():
+    """
+    Check the token inside progress() blocks, between the phases of a stage
+    that do not report progress.
+    """
+    current = _PROGRESS.get()
+    if current is not None:
+        current.token.check()
+
+
+def _reset_context():
+    """
+    Initializer of pool workers. Forked processes inherit the context of
+    the parent, whose progress() and instrument() blocks are not theirs.
+    """
+    _PROGRESS.set(None)
+    _STATS.set(None)
@@ -4,8 +4,29 @@ A module for generating quadtree mesh from an image.
 Author : Sadjad Abedi
 """
 
+import base64
+import json
+import os
+import zlib
+
 import numpy as np
-from matplotlib.pyplot import figure, fill, show, axis
+
+from ._criteria import get_criterion
+from ._instrument import (
+    _count,
+    _instrumented,
+    _record_balancing,
+    _record_elements,
+    _record_fem_arrays,
+    _record_fem_elements,
+    _record_mesh,
+    _record_modes,
+    _record_nodes,
+    _record_tree,
+)
+from ._progress import _BATCH, _check, _step
+
+_FORMAT_VERSION = 1  # Version of the directories written by save()
 
 
 class Point:
@@ -58,6 +79,701 @@ class Point:
         return new_point
 
 
+class ImagePyramid:
+    """
+    A class used to represent block reductions of an image at every level
+    of a quadtree.
+
+    The pyramid is built bottom-up: each level is obtained from the finer
+    one by reducing 2*2 blocks, so every pixel is read only once. Splitting
+    decisions of all blocks of a level are evaluated at once.
+
+    An image virtually padded by image_preprocess(image, virtual=True) is
+    reduced over the pixels of the image only. The levels then cover the
+    blocks that overlap the image, and blocks outside of it are uniform
+    blocks of the fill value that are never divided.
+
+    ...
+
+    Attributes
+    ----------
+    image : numpy array
+        The array of the image (without the virtual padding).
+    fill_value : scalar
+        Value of the pixels of the virtual padding. 0 for arrays.
+    crit : int, optional
+        The criteria used for partitioning. Default value is 1.
+    criterion : str or callable, optional
+        The splitting criterion, either the name of a registered criterion
+        ("range", "std", "entropy" or "gradient") or a function
+        criterion(pyramid, depth, crit) that returns the splitting
+        decisions of all blocks of a level (see register_criterion).
+        Default value is "range", i.e. the difference between maximum and
+        minimum intensities of a block is more than crit.
+    min_size : int, optional
+        Blocks are not divided into blocks smaller than min_size pixels.
+        Default value is 1.
+    max_size : None or int, optional
+        Blocks larger than max_size pixels are always divided.
+    max_depth : None or int, optional
+        The criterion is evaluated only for levels up to max_depth, deeper
+        blocks are not divided. Default is None (all levels).
+    levels : int
+        Number of levels below the root, i.e. log2 of the image dimension.
+    minimum : list(numpy array)
+        Minimum intensity of blocks. The array at index d has a shape of
+        (2^d, 2^d), or of the number of blocks that overlap the image for
+        a PaddedImage, and corresponds to the nodes at depth d.
+    maximum : list(numpy array)
+        Maximum intensity of blocks, indexed like minimum.
+    total : list(numpy array)
+        Summation of intensities of blocks, indexed like minimum.
+    split : list(numpy array)
+        Boolean arrays that indicate whether each block has to be divided,
+        indexed like minimum.
+
+    Methods
+    -------
+    from_blocks(minimum, maximum, total, block_sums, block_size, ...)
+        Build the levels of a pyramid above square blocks of an image.
+    block_size(depth)
+        Return the number of pixels in each direction of the blocks of a level.
+    block_sums(key, function)
+        Return the summations of a per-pixel quantity over the blocks of
+        all levels.
+    block_histograms(bins=16)
+        Return the histograms of intensities of the blocks of all levels.
+    node_stats(origin, size)
+        Return the property and the splitting decision of a block.
+    update(image_array, region)
+        Update the reductions and the splitting decisions after a region of
+        the image has changed.
+    """
+
+    def __init__(
+        self,
+        image_array,
+        crit=1,
+        criterion="range",
+        min_size=1,
+        max_size=None,
+        max_depth=None,
+    ):
+        rows, cols = image_array.shape
+        if rows != cols or rows & (rows - 1) != 0:
+            raise ValueError(
+                "ImagePyramid requires a square image of order 2^n, "
+                "use image_preprocess() first."
+            )
+        if isinstance(image_array, PaddedImage):
+            if image_array.offset != (0, 0):
+                raise ValueError("ImagePyramid requires a whole PaddedImage.")
+            self.image = image_array.image
+            self.fill_value = image_array.fill_value
+        else:
+            self.image = np.asarray(image_array)
+            self.fill_value = 0
+        self.crit = crit
+        self.criterion = criterion
+        self.levels = rows.bit_length() - 1
+        self._block_sums = {}
+        self._block_functions = {}
+        self._histograms = {}
+
+        self.minimum = self._reduce(self.image, np.min, self.fill_value)
+        self.maximum = self._reduce(self.image, np.max, self.fill_value)
+        self.total = self._reduce(
+            self.image.astype(np.float64), np.sum, self.fill_value, area=True
+        )
+        self._evaluate(min_size, max_size, max_depth)
+
+    @classmethod
+    def from_blocks(
+        cls,
+        minimum,
+        maximum,
+        total,
+        block_sums,
+        block_size,
+        crit=1,
+        criterion="range",
+        min_size=1,
+        max_size=None,
+    ):
+        """
+        Build the levels of a pyramid above square blocks of an image (e.g.
+        tiles that do not fit in memory together) from the reductions of
+        the blocks.
+
+        The image is not needed, so a criterion can only use the
+        reductions (minimum, maximum, total and the block_sums of the
+        given keys). Splitting decisions are evaluated for the levels above
+        the blocks.
+
+        Parameters
+        ----------
+        minimum, maximum, total : numpy array
+            Square arrays of order 2^n of the minimum, maximum and
+            summation of intensities of each block.
+        block_sums : dict
+            Summations of per-pixel quantities (see block_sums()) over each
+            block, as arrays of the same shape, by key.
+        block_size : int
+            Number of pixels in each direction of the blocks.
+        crit, criterion, min_size, max_size : optional
+            The splitting criterion, as for ImagePyramid.
+
+        Returns
+        -------
+        pyramid : ImagePyramid object
+        """
+        pyramid = cls.__new__(cls)
+        pyramid.image = None
+        pyramid.fill_value = 0
+        pyramid.crit = crit
+        pyramid.criterion = criterion
+        pyramid.levels = (minimum.shape[0] * block_size).bit_length() - 1
+        pyramid.minimum = _reduce_levels(np.asarray(minimum), np.min)
+        pyramid.maximum = _reduce_levels(np.asarray(maximum), np.max)
+        pyramid.total = _reduce_levels(np.asarray(total, dtype=np.float64), np.sum)
+        pyramid._block_sums = {
+            key: _reduce_levels(np.asarray(sums, dtype=np.float64), np.sum)
+            for key, sums in block_sums.items()
+        }
+        pyramid._block_functions = {}
+        pyramid._histograms = {}
+        pyramid._evaluate(min_size, max_size, len(pyramid.minimum) - 2)
+
+        return pyramid
+
+    def _reduce(self, finest, reduction, fill, area=False):
+        # Odd levels of a virtually padded image are padded with the fill
+        # value (times the area of the blocks for sums) to be reduced
+        return _reduce_levels(finest, reduction, self.levels, fill, area)
+
+    def _evaluate(self, min_size, max_size, max_depth):
+        function = get_criterion(self.criterion)
+        self._limits = (min_size, max_size, max_depth)
+        self.split = []
+        for depth in range(len(self.minimum)):
+            size = self.block_size(depth)
+            shape = self.minimum[depth].shape
+            if size < 2 * min_size:  # Children would be smaller than min_size
+                split = np.zeros(shape, dtype=bool)
+            elif max_depth is not None and depth > max_depth:
+                split = np.zeros(shape, dtype=bool)
+            elif max_size is not None and size > max_size:
+                split = np.ones(shape, dtype=bool)
+            else:
+                split = np.asarray(function(self, depth, self.crit), dtype=bool)
+            self.split.append(split)
+
+    def block_size(self, depth):
+        """
+        Return the number of pixels in each direction of the blocks of a level.
+        """
+        return 1 << (self.levels - depth)
+
+    def block_sums(self, key, function):
+        """
+        Return the summations of a per-pixel quantity over the blocks of
+        all levels. The result is calculated once for each key. Pixels of
+        the virtual padding take the quantity of a single pixel of the
+        fill value.
+
+        Parameters
+        ----------
+        key : str
+            Name of the quantity, used to cache the result.
+        function : callable
+            A function that takes the image as a float array and returns
+            an array of the quantity with the same shape.
+
+        Returns
+        -------
+        sums : list(numpy array)
+            Summations of the quantity over blocks, indexed like minimum.
+        """
+        if key not in self._block_sums:
+            if self.image is None:
+                raise ValueError(
+                    f"Block sums of {key!r} are not available in a pyramid "
+                    "built from blocks."
+                )
+            values = np.asarray(function(self.image.astype(np.float64)))
+            self._block_functions[key] = function
+            fill = np.full((1, 1), self.fill_value, dtype=np.float64)
+            fill = np.asarray(function(fill))[0, 0]
+            self._block_sums[key] = self._reduce(values, np.sum, fill, area=True)
+
+        return self._block_sums[key]
+
+    def block_histograms(self, bins=16):
+        """
+        Return the histograms of intensities of the blocks of all levels
+        but the finest one. Intensities are grouped in bins of equal width
+        between the minimum and maximum intensities of the image. The
+        pixels of 2*2 blocks are counted once for each number of bins, and
+        the counts are reduced up the levels like total. Pixels of the
+        virtual padding are not counted.
+
+        Parameters
+        ----------
+        bins : int, optional
+            Number of bins. Default value is 16.
+
+        Returns
+        -------
+        histograms : list(numpy array)
+            Arrays of shape (rows, cols, bins) of the number of pixels of
+            each block in each bin, indexed like minimum up to the blocks
+            of 2*2 pixels.
+        """
+        if bins not in self._histograms:
+            if self.image is None:
+                raise ValueError(
+                    "Histograms are not available in a pyramid built from blocks."
+                )
+            low, high = float(self.minimum[0][0, 0]), float(self.maximum[0][0, 0])
+            counts = _bin_counts(self.image, low, high, bins)
+            self._histograms[bins] = (
+                low,
+                high,
+                _reduce_levels(counts, np.sum, self.levels - 1),
+            )
+
+        return self._histograms[bins][2]
+
+    def node_stats(self, origin, size):
+        """
+        Return the property and the splitting decision of a block.
+
+        Parameters
+        ----------
+        origin : tuple (int, int)
+            Row and column of the top left pixel of the block.
+        size : int
+            Number of pixels of the block in each direction.
+
+        Returns
+        -------
+        property : float
+            Average of the pixels intensities of the block.
+        split : bool
+            Indicate whether the block has to be divided.
+        """
+        depth = self.levels - (size.bit_length() - 1)
+        row, col = origin[0] // size, origin[1] // size
+        rows, cols = self.total[depth].shape
+        if row >= rows or col >= cols:  # Outside of a virtually padded image
+            return self.fill_value, False
+
+        return self.total[depth][row, col] / (size * size), self.split[depth][row, col]
+
+    def update(self, image_array, region):
+        """
+        Update the reductions and the splitting decisions after a region of
+        the image has changed.
+
+        Only the blocks that overlap the region are reduced again, from the
+        pixels of the region up to the root. The criterion is evaluated
+        again for all blocks, as it may depend on the whole image (e.g. the
+        bins of "entropy").
+
+        Parameters
+        ----------
+        image_array : numpy array or PaddedImage
+            The changed image, with the same shape as the original one.
+        region : tuple (slice, slice)
+            Rows and columns of the changed pixels, e.g. np.s_[10:20, 30:45].
+
+        Returns
+        -------
+        box : None or tuple (int, int, int, int)
+            First row, first column, last row + 1 and last column + 1 of the
+            pixels of all blocks whose splitting decision changed, together
+            with the region. None if the region is empty.
+        """
+        if self.image is None:
+            raise ValueError("A pyramid built from blocks can not be updated.")
+        image = (
+            image_array.image if isinstance(image_array, PaddedImage) else image_array
+        )
+        image = np.asarray(image)
+        if image.shape != self.image.shape:
+            raise ValueError("The shape of the image can not change.")
+        (row_start, row_stop, _), (col_start, col_stop, _) = (
+            item.indices(length) for item, length in zip(region, image.shape)
+        )
+        if row_start >= row_stop or col_start >= col_stop:
+            return None
+        self.image = image
+        self.minimum[-1] = self.maximum[-1] = image
+        window = (slice(row_start, row_stop), slice(col_start, col_stop))
+        self.total[-1][window] = image[window]
+        for levels, reduction in ((self.minimum, np.min), (self.maximum, np.max)):
+            _update_levels(levels, reduction, window, self.fill_value)
+        _update_levels(self.total, np.sum, window, self.fill_value, area=True)
+        # Quantities like the gradient also change next to the region
+        margin = (
+            slice(max(row_start - 1, 0), min(row_stop + 1, image.shape[0])),
+            slice(max(col_start - 1, 0), min(col_stop + 1, image.shape[1])),
+        )
+        source = tuple(
+            slice(max(item.start - 1, 0), min(item.stop + 1, length))
+            for item, length in zip(margin, image.shape)
+        )
+        inner = tuple(
+            slice(item.start - outer.start, item.stop - outer.start)
+            for item, outer in zip(margin, source)
+        )
+        for key, function in self._block_functions.items():
+            values = np.asarray(function(image[source].astype(np.float64)))
+            self._block_sums[key][-1][margin] = values[inner]
+            fill = np.full((1, 1), self.fill_value, dtype=np.float64)
+            fill = np.asarray(function(fill))[0, 0]
+            _update_levels(self._block_sums[key], np.sum, margin, fill, area=True)
+        blocks = (
+            slice(row_start // 2, (row_stop + 1) // 2),
+            slice(col_start // 2, (col_stop + 1) // 2),
+        )
+        low, high = float(self.minimum[0][0, 0]), float(self.maximum[0][0, 0])
+        for bins, (old_low, old_high, levels) in list(self._histograms.items()):
+            if (old_low, old_high) != (low, high):
+                # The bins moved, the pixels are counted again when used
+                del self._histograms[bins]
+                continue
+            levels[-1][blocks] = _bin_counts(
+                image[
+                    2 * blocks[0].start : 2 * blocks[0].stop,
+                    2 * blocks[1].start : 2 * blocks[1].stop,
+                ],
+                low,
+                high,
+                bins,
+            )
+            _update_levels(levels, np.sum, blocks)
+
+        previous = self.split
+        self._evaluate(*self._limits)
+        box = [margin[0].start, margin[1].start, margin[0].stop, margin[1].stop]
+        for depth, (old, new) in enumerate(zip(previous, self.split)):
+            rows, cols = np.nonzero(old != new)
+            if rows.shape[0] == 0:
+                continue
+            size = self.block_size(depth)
+            box[0] = min(box[0], rows.min() * size)
+            box[1] = min(box[1], cols.min() * size)
+            box[2] = max(box[2], (rows.max() + 1) * size)
+            box[3] = max(box[3], (cols.max() + 1) * size)
+
+        return tuple(int(value) for value in box)
+
+
+class _BlockMean:
+    """
+    Average intensities of blocks of an image, used as image_stats of a
+    tree joined from tiles to find the property of leaves created by
+    balancing. Pixels outside of the image are 0, as in the padding of
+    image_preprocess().
+    """
+
+    def __init__(self, image):
+        self.image = image
+
+    def node_stats(self, origin, size):
+        """
+        Return the property and the splitting decision of a block.
+        """
+        row, col = origin
+        block = np.asarray(self.image[row : row + size, col : col + size])
+
+        return block.sum(dtype=np.float64) / (size * size), False
+
+
+class IntegralImage:
+    """
+    A class used to represent the summed-area tables (integral images) of
+    an image.
+
+    The sum of the pixels of any rectangle is found from 4 entries of a
+    table, so averages and variances of blocks cost the same for every
+    block size and the pixels are read only once, when the tables are
+    built. Queries accept arrays to evaluate many blocks at once.
+
+    ...
+
+    Attributes
+    ----------
+    image_array : numpy array
+        The array of the image.
+    crit : int, optional
+        The criteria used for partitioning. Default value is 1.
+    sums : numpy array
+        Summed-area table of the image with a leading row and column of
+        zeros. Integer images are summed exactly in int64.
+    squares : numpy array
+        Summed-area table of the squared intensities, calculated when it is
+        first used by variance().
+
+    Methods
+    -------
+    block_sum(rows, cols, heights, widths=None)
+        Return the summation of intensities of blocks.
+    mean(rows, cols, heights, widths=None)
+        Return the average of intensities of blocks.
+    variance(rows, cols, heights, widths=None)
+        Return the variance of intensities of blocks.
+    node_stats(origin, size)
+        Return the property and the splitting decision of a block.
+    """
+
+    def __init__(self, image_array, crit=1):
+        self.image_array = np.asarray(image_array)
+        self.crit = crit
+        self.sums = self._table(self.image_array)
+        self._squares = None
+
+    @property
+    def squares(self):
+        """
+        Summed-area table of the squared intensities.
+        """
+        if self._squares is None:
+            image = self.image_array
+            if image.dtype.kind in "biu":
+                image = image.astype(np.int64)
+            self._squares = self._table(image * image)
+
+        return self._squares
+
+    @staticmethod
+    def _table(image):
+        dtype = np.int64 if image.dtype.kind in "biu" else np.float64
+        table = np.zeros((image.shape[0] + 1, image.shape[1] + 1), dtype=dtype)
+        np.cumsum(image, axis=0, dtype=dtype, out=table[1:, 1:])
+        np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+
+        return table
+
+    @staticmethod
+    def _query(table, rows, cols, heights, widths):
+        if widths is None:
+            widths = heights
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        bottoms, rights = rows + heights, cols + widths
+
+        return (
+            table[bottoms, rights]
+            - table[rows, rights]
+            - table[bottoms, cols]
+            + table[rows, cols]
+        )
+
+    def block_sum(self, rows, cols, heights, widths=None):
+        """
+        Return the summation of intensities of blocks.
+
+        Parameters
+        ----------
+        rows, cols : int or numpy array
+            Row and column of the top left pixel of each block.
+        heights : int or numpy array
+            Number of rows of each block.
+        widths : None, int or numpy array, optional
+            Number of columns of each block. Same as heights when None.
+
+        Returns
+        -------
+        sums : numpy array
+            Summation of intensities of each block.
+        """
+        return self._query(self.sums, rows, cols, heights, widths)
+
+    def mean(self, rows, cols, heights, widths=None):
+        """
+        Return the average of intensities of blocks (see block_sum).
+        """
+        if widths is None:
+            widths = heights
+        area = np.multiply(heights, widths)
+
+        return self._query(self.sums, rows, cols, heights, widths) / area
+
+    def variance(self, rows, cols, heights, widths=None):
+        """
+        Return the variance of intensities of blocks (see block_sum).
+        """
+        if widths is None:
+            widths = heights
+        area = np.multiply(heights, widths)
+        mean = self._query(self.sums, rows, cols, heights, widths) / area
+        squares = self._query(self.squares, rows, cols, heights, widths) / area
+
+        return np.maximum(squares - mean * mean, 0.0)
+
+    def node_stats(self, origin, size):
+        """
+        Return the property and the splitting decision of a block.
+
+        The property is found from the summed-area table. Minimum and
+        maximum can not be found from sums, so the splitting decision
+        reads the pixels of the block.
+
+        Parameters
+        ----------
+        origin : tuple (int, int)
+            Row and column of the top left pixel of the block.
+        size : int
+            Number of pixels of the block in each direction.
+
+        Returns
+        -------
+        property : float
+            Average of the pixels intensities of the block.
+        split : bool
+            Indicate whether the block has to be divided.
+        """
+        row, col = origin
+        block = self.image_array[row : row + size, col : col + size]
+
+        return float(self.mean(row, col, size)), np.ptp(block) > self.crit
+
+
+def _reduce_levels(finest, reduction, count=None, fill=0, area=False):
+    """
+    Reduce 2*2 blocks of an array count times (log2 of the dimension of a
+    square array of order 2^n by default). Return the list of reductions
+    from the root (1*1) to the finest array. Axes after the first two
+    (e.g. bins of histograms) are kept.
+
+    Arrays with an odd number of rows or columns are padded with fill,
+    multiplied by the number of pixels of a block when area is True.
+    """
+    if count is None:
+        count = int(max(finest.shape[:2]) - 1).bit_length()
+    levels = [finest]
+    for level in range(count):
+        array = levels[-1]
+        rows, cols = array.shape[:2]
+        if rows % 2 or cols % 2:
+            value = fill * 4**level if area else fill
+            array = np.pad(
+                array,
+                ((0, rows % 2), (0, cols % 2)) + ((0, 0),) * (array.ndim - 2),
+                constant_values=value,
+            )
+            rows, cols = array.shape[:2]
+        levels.append(
+            reduction(
+                array.reshape((rows // 2, 2, cols // 2, 2) + array.shape[2:]),
+                axis=(1, 3),
+            )
+        )
+
+    return levels[::-1]
+
+
+def _update_levels(levels, reduction, window, fill=0, area=False):
+    """
+    Reduce again the blocks of the levels returned by _reduce_levels that
+    overlap a window (rows, cols) of the finest array, after it changed.
+    """
+    (row_start, row_stop), (col_start, col_stop) = (
+        (item.start, item.stop) for item in window
+    )
+    for depth in range(len(levels) - 2, -1, -1):
+        finer = levels[depth + 1]
+        row_start, col_start = row_start // 2, col_start // 2
+        row_stop, col_stop = (row_stop + 1) // 2, (col_stop + 1) // 2
+        block = finer[2 * row_start : 2 * row_stop, 2 * col_start : 2 * col_stop]
+        rows, cols = 2 * (row_stop - row_start), 2 * (col_stop - col_start)
+        if block.shape[:2] != (rows, cols):
+            value = fill * 4 ** (len(levels) - depth - 2) if area else fill
+            block = np.pad(
+                block,
+                ((0, rows - block.shape[0]), (0, cols - block.shape[1]))
+                + ((0, 0),) * (block.ndim - 2),
+                constant_values=value,
+            )
+        levels[depth][row_start:row_stop, col_start:col_stop] = reduction(
+            block.reshape((rows // 2, 2, cols // 2, 2) + block.shape[2:]), axis=(1, 3)
+        )
+
+
+def _bin_counts(image, low, high, bins):
+    """
+    Count the pixels of the 2*2 blocks of an image in bins of equal width
+    between low and high. Return an array of shape (rows, cols, bins), of
+    the blocks that overlap the image.
+    """
+    scale = bins / (high - low) if high > low else 0.0
+    levels = np.minimum(((image - low) * scale).astype(np.intp), bins - 1)
+    rows, cols = levels.shape
+    if rows % 2 or cols % 2:
+        # Missing pixels go to an extra bin that is not counted
+        levels = np.pad(levels, ((0, rows % 2), (0, cols % 2)), constant_values=bins)
+    one_hot = np.eye(bins + 1, bins, dtype=np.uint8)
+
+    return (
+        one_hot[levels[0::2, 0::2]]
+        + one_hot[levels[0::2, 1::2]]
+        + one_hot[levels[1::2, 0::2]]
+        + one_hot[levels[1::2, 1::2]]
+    )
+
+
+class _LeafLayout:
+    """
+    Splitting decisions and properties of a quadtree with known leaves.
+
+    Used as image_stats of QTree to rebuild the tree structure from leaves
+    stored in arrays. Properties of inner nodes are the area-weighted average
+    of their leaves. Nodes that are not part of the layout (e.g. created by
+    balancing) are not divided and are averaged from the image array.
+    """
+
+    def __init__(self, array, origins, sizes, properties=None):
+        self.array = array
+        self.properties = {}  # (row, col, size) -> property of leaves
+        self.totals = {}  # (row, col, size) -> sum of intensities of inner nodes
+
+        if properties is None:
+            properties = [
+                np.mean(array[row : row + size, col : col + size])
+                for (row, col), size in zip(origins.tolist(), sizes.tolist())
+            ]
+        else:
+            properties = np.asarray(properties).tolist()
+
+        root_size = array.shape[0]
+        for (row, col), size, value in zip(
+            origins.tolist(), sizes.tolist(), properties
+        ):
+            self.properties[(row, col, size)] = value
+            total = value * size * size
+            while size < root_size:
+                size *= 2
+                row -= row % size
+                col -= col % size
+                key = (row, col, size)
+                self.totals[key] = self.totals.get(key, 0.0) + total
+
+    def node_stats(self, origin, size):
+        """
+        Return the property and the splitting decision of a node.
+        """
+        key = (origin[0], origin[1], size)
+        if key in self.totals:
+            return self.totals[key] / (size * size), True
+        value = self.properties.get(key)
+        if value is None:
+            row, col = origin
+            value = np.mean(self.array[row : row + size, col : col + size])
+
+        return value, False
+
+
 class QTree:
     """
     A class used to represent a quadtree.
@@ -87,6 +803,22 @@ class QTree:
         Dimension of the cell (number of pixels in each direction).
     depth : int, optional
         Depth of the node in tree. It's 0 for the root.
+    origin : tuple (int, int), optional
+        Row and column of the top left pixel of the partition in the image
+        array of the root. Default position is (0, 0).
+    image_stats : None or object, optional
+        Precomputed statistics of the image of the root (e.g. ImagePyramid)
+        that provide the property and the splitting decision of each node
+        through the method node_stats(origin, size). When None, they are
+        calculated from array, or from the ImagePyramid of a PaddedImage
+        given to the root, whose windows are then never allocated.
+    neighbors : None or list
+        North, south, west and east neighbors of the node, kept up to date
+        when nodes are divided. None until build_neighbor_index() is called
+        on the root.
+    extent : tuple (int, int)
+        Number of rows and columns of the partition covered by the image,
+        smaller than the shape of array for a PaddedImage.
     property : float
         An indicator for material properties calculated by averaging
         the pixels intensities.
@@ -106,10 +838,18 @@ class QTree:
 
     Methods
     -------
-    sectors()
+    from_pyramid(array, crit=1, scale=1.0, ...)
+        Build a quadtree from the ImagePyramid of the array.
+    from_integral_image(array, crit=1, scale=1.0, ...)
+        Build a quadtree from the IntegralImage of the array.
+    from_leaves(array, origins, sizes, properties=None, scale=1.0, ...)
+        Rebuild a quadtree from the description of its leaves.
+    sectors(root_area=None)
         A recursive function to partition the array and create subtrees.
     save_leaves()
         A method that returns a list of external nodes (leaves).
+    build_neighbor_index()
+        Store the neighbors of all nodes for constant time neighbor search.
     north_neighbor()
         A recursive function that return north neighbor of the cell.
         return none if the cell is on the top of the image.
@@ -127,6 +867,13 @@ class QTree:
         if the cell has to be splitted for 2:1 balancing.
     balancing():
         Balance QTree for 2:1 ratio.
+    leaf_arrays(leaves=None):
+        Return integer positions, sizes and properties of the leaves
+        as NumPy arrays.
+    save(path):
+        Save the leaves of the quadtree in a directory of NumPy files.
+    load(path, array):
+        Load a quadtree saved by save().
 
     """
 
@@ -138,6 +885,9 @@ class QTree:
         scale=1.0,
         bottom_left_corner=Point((0.0, 0.0)),
         depth=0,
+        origin=(0, 0),
+        image_stats=None,
+        root_area=None,
     ):
         self.north_west = None  # NorthWest Section Initiated Empty
         self.north_east = None  # NorthEast Section Initiated Empty
@@ -147,26 +897,204 @@ class QTree:
         self.array = array
         self.divided = False
         self.depth = depth
+        self.origin = origin
+        self.image_stats = image_stats
+        self.neighbors = None
         self.crit = crit
         self.scale = scale
-
-        self.property = np.mean(array)  # To define material properties by Averaging
         self.bottom_left_corner = bottom_left_corner  # BottomLeft Coordinates
         self.top_right_corner = bottom_left_corner.coord_sum(
             (array.shape[1] * scale, array.shape[0] * scale)
         )  # TopRight Coordinates
         self.dimension = np.sqrt(array.size)  # To define scale requirement
 
+        if parent is None:
+            self._build_root()
+        else:
+            # root_area is None when a leaf of a built tree is divided
+            self._build(root_area)
+
+    @_instrumented("tree", _record_tree)
+    def _build_root(self):
+        """
+        Build the tree below the root, timed once as the "tree" stage inside
+        instrument() blocks.
+        """
+        if self.image_stats is None and isinstance(self.array, PaddedImage):
+            # The padding is not allocated, the nodes look up the reductions
+            self.image_stats = ImagePyramid(self.array, self.crit)
+        self._build(self.array.shape[0] * self.array.shape[1])
+
+    def _build(self, root_area=None):
+        """
+        Find the property of the node and split it if needed.
+
+        While the tree is built, root_area is the number of pixels of the
+        root and the pixels of finished subtrees are reported as progress.
+        Nodes divided later, e.g. by balancing, get None and do not report
+        them.
+        """
+        array = self.array
+        if self.image_stats is None:
+            # To define material properties by Averaging
+            self.property = np.mean(array)
+            split = (np.max(array) - np.min(array)) > self.crit  # Splitting Criteria
+        else:
+            self.property, split = self.image_stats.node_stats(
+                self.origin, array.shape[0]
+            )
+
         # SPLITTING
-        if (np.max(array) - np.min(array)) > crit:  # Check Splitting Criteria
-            self.sectors()
+        if split:
+            self.sectors(root_area)
+        if root_area is None:
+            return
+
+        # Progress is reported by subtrees of at most _BATCH pixels
+        area = array.shape[0] * array.shape[1]
+        if (area > _BATCH and not split) or (
+            area <= _BATCH and (area == root_area or 4 * area > _BATCH)
+        ):
+            _step("pixels", area, root_area)
+
+    @classmethod
+    @_instrumented("tree", _record_tree)
+    def from_pyramid(
+        cls,
+        array,
+        crit=1,
+        scale=1.0,
+        bottom_left_corner=Point((0.0, 0.0)),
+        criterion="range",
+        min_size=1,
+        max_size=None,
+    ):
+        """
+        Build a quadtree from the ImagePyramid of the array.
+
+        The reductions of the image are calculated once for all levels and
+        the nodes only look them up, instead of reading their pixels. With
+        the default criterion, the result has the same leaves as
+        QTree(None, array, crit, scale).
+
+        Parameters
+        ----------
+        array : numpy array
+            Square image array of order 2^n.
+        crit : int, optional
+            The criteria used for partitioning. Default value is 1.
+        scale : float, optional
+            The ratio between pixels units and real units. Default value is 1.
+        bottom_left_corner : Point, optional
+            Coordinate of the bottom left corner of the image.
+        criterion : str or callable, optional
+            The splitting criterion (see ImagePyramid). Default is "range".
+        min_size : int, optional
+            Minimum dimension of cells in pixels. Default value is 1.
+        max_size : None or int, optional
+            Maximum dimension of cells in pixels.
+
+        Returns
+        -------
+        root : QTree object
+            Root of the tree.
+        """
+        return cls(
+            None,
+            array,
+            crit,
+            scale,
+            bottom_left_corner,
+            image_stats=ImagePyramid(array, crit, criterion, min_size, max_size),
+        )
+
+    @classmethod
+    @_instrumented("tree", _record_tree)
+    def from_integral_image(
+        cls, array, crit=1, scale=1.0, bottom_left_corner=Point((0.0, 0.0))
+    ):
+        """
+        Build a quadtree from the IntegralImage of the array.
+
+        The properties of the nodes are found in constant time from the
+        summed-area table instead of averaging their pixels, which also
+        holds for nodes created by balancing. The result has the same
+        leaves as QTree(None, array, crit, scale).
+
+        Parameters
+        ----------
+        array : numpy array
+            Square image array of order 2^n.
+        crit : int, optional
+            The criteria used for partitioning. Default value is 1.
+        scale : float, optional
+            The ratio between pixels units and real units. Default value is 1.
+        bottom_left_corner : Point, optional
+            Coordinate of the bottom left corner of the image.
+
+        Returns
+        -------
+        root : QTree object
+            Root of the tree.
+        """
+        return cls(
+            None,
+            array,
+            crit,
+            scale,
+            bottom_left_corner,
+            image_stats=IntegralImage(array, crit),
+        )
+
+    @classmethod
+    def from_leaves(
+        cls,
+        array,
+        origins,
+        sizes,
+        properties=None,
+        scale=1.0,
+        bottom_left_corner=Point((0.0, 0.0)),
+    ):
+        """
+        Rebuild a quadtree from the description of its leaves.
+
+        Parameters
+        ----------
+        array : numpy array
+            Square image array of order 2^n.
+        origins : numpy array
+            An (n, 2) integer array of row and column of the top left pixel
+            of each leaf.
+        sizes : numpy array
+            An (n,) integer array of the number of pixels in each direction
+            of each leaf.
+        properties : None or numpy array, optional
+            Property of each leaf. When None, it is calculated from array.
+        scale : float, optional
+            The ratio between pixels units and real units. Default value is 1.
+        bottom_left_corner : Point, optional
+            Coordinate of the bottom left corner of the image.
+
+        Returns
+        -------
+        root : QTree object
+            Root of the tree.
+        """
+        layout = _LeafLayout(array, np.asarray(origins), np.asarray(sizes), properties)
+
+        return cls(None, array, 1, scale, bottom_left_corner, image_stats=layout)
 
-    def sectors(self):
+    def sectors(self, root_area=None):
         """
         A recursive function to create subtrees.
 
         Parameters
         ----------
+        root_area : None or int, optional
+            Number of pixels of the root while the tree is built, to report
+            the progress of the subtrees. None when a leaf of a built tree
+            is divided, e.g. by balancing.
 
         Returns
         -------
@@ -186,6 +1114,9 @@ class QTree:
             self.scale,
             bottom_left_north_west,
             self.depth,
+            self.origin,
+            self.image_stats,
+            root_area,
         )
         bottom_left_north_east = self.bottom_left_corner.coord_sum(
             ((size[1] / 2) * self.scale, (size[0] / 2) * self.scale)
@@ -197,6 +1128,9 @@ class QTree:
             self.scale,
             bottom_left_north_east,
             self.depth,
+            (self.origin[0], self.origin[1] + size[1] // 2),
+            self.image_stats,
+            root_area,
         )
         bottom_left_south_west = self.bottom_left_corner
         self.south_west = QTree(
@@ -206,6 +1140,9 @@ class QTree:
             self.scale,
             bottom_left_south_west,
             self.depth,
+            (self.origin[0] + size[0] // 2, self.origin[1]),
+            self.image_stats,
+            root_area,
         )
         bottom_left_south_east = self.bottom_left_corner.coord_sum(
             ((size[1] / 2) * self.scale, 0)
@@ -217,7 +1154,20 @@ class QTree:
             self.scale,
             bottom_left_south_east,
             self.depth,
+            (self.origin[0] + size[0] // 2, self.origin[1] + size[1] // 2),
+            self.image_stats,
+            root_area,
         )
+        if self.neighbors is not None:  # Keep stored neighbors up to date
+            self._link_subtree()
+            self._relink_neighbors()
+
+    @property
+    def extent(self):
+        """
+        Number of rows and columns of the partition covered by the image.
+        """
+        return getattr(self.array, "extent", self.array.shape)
 
     @property
     def count_leaves(self):
@@ -294,14 +1244,109 @@ class QTree:
 
         return leaves_list
 
+    def build_neighbor_index(self):
+        """
+        Store the neighbors of all nodes for constant time neighbor search.
+
+        The neighbors of each node are derived from the neighbors of its
+        parent in one pass from the root, and they are updated by sectors()
+        whenever a node is divided afterwards.
+
+        Returns
+        -------
+        None.
+        """
+        self.neighbors = [None, None, None, None]
+        self._link_subtree()
+
+    def _link_subtree(self):
+        """
+        Set the neighbors of all descendants from the neighbors of the node.
+        """
+        node_list = [self]
+        while len(node_list) != 0:
+            curr = node_list.pop()
+            if not curr.divided:
+                continue
+            north, south, west, east = curr.neighbors
+            size = curr.array.shape[0]
+            # Neighbors of the same size that are divided face two children
+            if north is not None and north.divided and north.array.shape[0] == size:
+                north = north.south_west, north.south_east
+            else:
+                north = north, north
+            if south is not None and south.divided and south.array.shape[0] == size:
+                south = south.north_west, south.north_east
+            else:
+                south = south, south
+            if west is not None and west.divided and west.array.shape[0] == size:
+                west = west.north_east, west.south_east
+            else:
+                west = west, west
+            if east is not None and east.divided and east.array.shape[0] == size:
+                east = east.north_west, east.south_west
+            else:
+                east = east, east
+            north_west, north_east = curr.north_west, curr.north_east
+            south_west, south_east = curr.south_west, curr.south_east
+            north_west.neighbors = [north[0], south_west, west[0], north_east]
+            north_east.neighbors = [north[1], south_east, north_west, east[0]]
+            south_west.neighbors = [north_west, south[0], west[1], south_east]
+            south_east.neighbors = [north_east, south[1], south_west, east[1]]
+            node_list.extend([north_west, north_east, south_west, south_east])
+
+    def _relink_neighbors(self):
+        """
+        Point the smaller nodes next to a newly divided node to its children.
+        """
+        size = self.array.shape[0]
+        half = self.origin[0] + size // 2, self.origin[1] + size // 2
+        for side, (facing, children, axis) in enumerate(
+            (
+                (("south_west", "south_east"), ("north_west", "north_east"), 1),
+                (("north_west", "north_east"), ("south_west", "south_east"), 1),
+                (("north_east", "south_east"), ("north_west", "south_west"), 0),
+                (("north_west", "south_west"), ("north_east", "south_east"), 0),
+            )
+        ):
+            neighbor = self.neighbors[side]
+            if (
+                neighbor is None
+                or not neighbor.divided
+                or neighbor.array.shape[0] != size
+            ):
+                continue
+            opposite = side ^ 1
+            node_list = [getattr(neighbor, facing[0]), getattr(neighbor, facing[1])]
+            while len(node_list) != 0:
+                curr = node_list.pop()
+                target = getattr(
+                    self, children[0 if curr.origin[axis] < half[axis] else 1]
+                )
+                curr_size = curr.array.shape[0]
+                while target.divided and target.array.shape[0] > curr_size:
+                    middle = target.origin[axis] + target.array.shape[0] // 2
+                    target = getattr(
+                        target, children[0 if curr.origin[axis] < middle else 1]
+                    )
+                curr.neighbors[opposite] = target
+                if curr.divided:
+                    node_list.extend(
+                        [getattr(curr, facing[0]), getattr(curr, facing[1])]
+                    )
+
     def north_neighbor(self):
         """
         Find north neighbor of Node.
 
+        The stored neighbors are used if build_neighbor_index() was called.
+
         Returns
         -------
             Qtree object of north neighbor of Node.
         """
+        if self.neighbors is not None:
+            return self.neighbors[0]
         if self.parent is None:
             return None
         if self == self.parent.south_west:
@@ -322,10 +1367,14 @@ class QTree:
         """
         Find south neighbor of Node.
 
+        The stored neighbors are used if build_neighbor_index() was called.
+
         Returns
         -------
             Qtree object of south neighbor of Node.
         """
+        if self.neighbors is not None:
+            return self.neighbors[1]
         if self.parent is None:
             return None
         if self == self.parent.north_west:
@@ -346,10 +1395,14 @@ class QTree:
         """
         Find west neighbor of Node.
 
+        The stored neighbors are used if build_neighbor_index() was called.
+
         Returns
         -------
             Qtree object of west neighbor of Node.
         """
+        if self.neighbors is not None:
+            return self.neighbors[2]
         if self.parent is None:
             return None
         if self == self.parent.north_east:
@@ -371,10 +1424,14 @@ class QTree:
         """
         Find east neighbor of Node.
 
+        The stored neighbors are used if build_neighbor_index() was called.
+
         Returns
         -------
             Qtree object of east neighbor of Node.
         """
+        if self.neighbors is not None:
+            return self.neighbors[3]
         if self.parent is None:
             return None
         if self == self.parent.north_west:
@@ -404,66 +1461,212 @@ class QTree:
         """
         if node is None:
             return False
-        if node.north_neighbor() is not None:
-            if node.north_neighbor().divided:
-                if (
-                    node.north_neighbor().south_west.divided
-                    or node.north_neighbor().south_east.divided
-                ):
-                    return True
-        if node.south_neighbor() is not None:
-            if node.south_neighbor().divided:
-                if (
-                    node.south_neighbor().north_west.divided
-                    or node.south_neighbor().north_east.divided
-                ):
-                    return True
-        if node.west_neighbor() is not None:
-            if node.west_neighbor().divided:
-                if (
-                    node.west_neighbor().north_east.divided
-                    or node.west_neighbor().south_east.divided
-                ):
-                    return True
-        if node.east_neighbor() is not None:
-            if node.east_neighbor().divided:
-                if (
-                    node.east_neighbor().north_west.divided
-                    or node.east_neighbor().south_west.divided
-                ):
-                    return True
+        neighbor = node.north_neighbor()
+        if neighbor is not None and neighbor.divided:
+            if neighbor.south_west.divided or neighbor.south_east.divided:
+                return True
+        neighbor = node.south_neighbor()
+        if neighbor is not None and neighbor.divided:
+            if neighbor.north_west.divided or neighbor.north_east.divided:
+                return True
+        neighbor = node.west_neighbor()
+        if neighbor is not None and neighbor.divided:
+            if neighbor.north_east.divided or neighbor.south_east.divided:
+                return True
+        neighbor = node.east_neighbor()
+        if neighbor is not None and neighbor.divided:
+            if neighbor.north_west.divided or neighbor.south_west.divided:
+                return True
 
         return False
 
+    @_instrumented("balancing", _record_balancing)
     def balancing(self):
         """
         Balance QTree for 2:1 ratio.
 
+        Leaves are processed from the smallest to the largest. A leaf divides
+        its neighbors (on 4 sides) until they are at most twice its size, and
+        the new leaves are processed with the leaves of their own size, so
+        every leaf is checked once. Neighbors of all nodes are stored first
+        (see build_neighbor_index), so that they are found in constant time.
+
         Returns
         -------
+        splits : int
+            Number of nodes that were divided.
         """
-        leaves = self.save_leaves()
-        while len(leaves) != 0:
-            node = leaves.pop()
-            if not node.divided:
-                if self.need_split(node):
-                    node.sectors()
-                    leaves.extend(
-                        [
-                            node.south_west,
-                            node.south_east,
-                            node.north_west,
-                            node.north_east,
-                        ]
-                    )
-                    if self.need_split(node.north_neighbor()):
-                        leaves.append(node.north_neighbor())
-                    if self.need_split(node.south_neighbor()):
-                        leaves.append(node.south_neighbor())
-                    if self.need_split(node.west_neighbor()):
-                        leaves.append(node.west_neighbor())
-                    if self.need_split(node.east_neighbor()):
-                        leaves.append(node.east_neighbor())
+        if self.neighbors is None:
+            self.build_neighbor_index()
+        _check()
+        levels = {}  # size -> leaves
+        for leaf in self.save_leaves():
+            levels.setdefault(leaf.array.shape[0], []).append(leaf)
+
+        splits = 0
+        lookups = 0
+        size = 1
+        while size <= self.array.shape[0]:
+            for node in levels.pop(size, []):
+                if node.divided:
+                    continue
+                lookups += 4
+                if lookups % (4 * _BATCH) == 0:
+                    _step("balancing", _BATCH)
+                for side in range(4):
+                    neighbor = node.neighbors[side]
+                    while (
+                        neighbor is not None
+                        and not neighbor.divided
+                        and neighbor.array.shape[0] > 2 * size
+                    ):
+                        neighbor.sectors()
+                        splits += 1
+                        levels.setdefault(neighbor.array.shape[0] // 2, []).extend(
+                            [
+                                neighbor.south_west,
+                                neighbor.south_east,
+                                neighbor.north_west,
+                                neighbor.north_east,
+                            ]
+                        )
+                        neighbor = node.neighbors[side]
+            size *= 2
+        _step("balancing", lookups // 4 % _BATCH)
+        _count("neighbor_lookups", lookups)
+
+        return splits
+
+    def leaf_arrays(self, leaves=None):
+        """
+        Return integer positions, sizes and properties of the leaves
+        as NumPy arrays.
+
+        Positions are measured in pixels from the bottom left corner of
+        the current node, with the vertical axis pointing upward (the
+        same orientation as bottom_left_corner).
+
+        Parameters
+        ----------
+        leaves : None or list, optional
+            Leaves of the tree in the desired order. Default is the
+            output of save_leaves().
+
+        Returns
+        -------
+        positions : numpy array
+            An (n, 2) integer array of horizontal and vertical pixel
+            coordinates of the bottom left corner of each leaf.
+        sizes : numpy array
+            An (n,) integer array of the number of pixels in each
+            direction of each leaf.
+        properties : numpy array
+            An (n,) array of the property of each leaf.
+        """
+        if leaves is None:
+            leaves = self.save_leaves()
+        origins = np.array([leaf.origin for leaf in leaves], dtype=np.int64)
+        sizes = np.array([leaf.array.shape[0] for leaf in leaves], dtype=np.int64)
+        properties = np.array([leaf.property for leaf in leaves], dtype=float)
+        origins = origins.reshape(-1, 2)
+
+        positions = np.empty_like(origins)
+        positions[:, 0] = origins[:, 1] - self.origin[1]
+        positions[:, 1] = self.origin[0] + self.array.shape[0] - origins[:, 0] - sizes
+
+        return positions, sizes, properties
+
+    def save(self, path):
+        """
+        Save the leaves of the quadtree in a directory of NumPy (.npy)
+        files, in the format of LinearQTree.save(). The image array is not
+        saved.
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory. It is created if needed.
+        """
+        from ._linear import LinearQTree
+
+        LinearQTree.from_qtree(self).save(path)
+
+    @classmethod
+    def load(cls, path, array):
+        """
+        Load a quadtree saved by save() or LinearQTree.save().
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory.
+        array : numpy array
+            The image array the tree was built from. QTree nodes keep a view
+            of their partition of it.
+
+        Returns
+        -------
+        root : QTree object
+        """
+        from ._linear import LinearQTree
+
+        return LinearQTree.load(path, mmap_mode=None).to_qtree(array)
+
+
+def _save_arrays(path, kind, arrays):
+    """
+    Save a dict of arrays in a directory, one .npy file per array, with the
+    0-d arrays (settings) and the kind of object in metadata.json.
+    """
+    os.makedirs(path, exist_ok=True)
+    metadata_path = os.path.join(path, "metadata.json")
+    if os.path.exists(metadata_path):  # Not valid until it is written again
+        os.remove(metadata_path)
+    settings, names = {}, []
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        if array.ndim == 0:
+            settings[name] = array.item()
+            continue
+        np.save(os.path.join(path, name + ".npy"), array)
+        names.append(name)
+    metadata = {
+        "format": "qtreemesh",
+        "version": _FORMAT_VERSION,
+        "kind": kind,
+        "arrays": names,
+        "settings": settings,
+    }
+    with open(metadata_path, "w", encoding="utf-8") as file_open:
+        json.dump(metadata, file_open, indent=2)
+
+
+def _load_arrays(path, kind, mmap_mode="r"):
+    """
+    Load a dict of arrays saved by _save_arrays, checking the kind of
+    object and the version of the format.
+    """
+    try:
+        with open(os.path.join(path, "metadata.json"), encoding="utf-8") as file_open:
+            metadata = json.load(file_open)
+    except FileNotFoundError:
+        raise ValueError(f"{path} is not a saved {kind}.") from None
+    if metadata.get("format") != "qtreemesh" or metadata.get("kind") != kind:
+        raise ValueError(f"{path} is not a saved {kind}.")
+    if metadata["version"] > _FORMAT_VERSION:
+        raise ValueError(
+            f"{path} was saved by a newer version of qtreemesh "
+            f"(format {metadata['version']})."
+        )
+    arrays = {
+        name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+        for name in metadata["arrays"]
+    }
+    arrays.update(
+        (name, np.array(value)) for name, value in metadata["settings"].items()
+    )
+
+    return arrays
 
 
 class QTreeElement:
@@ -627,6 +1830,71 @@ class QTreeElement:
         return new_nodes_numbers
 
 
+class QTreeElementStore:
+    """
+    A class used to store all elements of a quadtree mesh in arrays.
+
+    Node numbers of all elements are concatenated in node_numbers, and the
+    nodes of element i are node_numbers[offsets[i]:offsets[i + 1]]. Indexing
+    or iterating the store returns QTreeElement objects that are created on
+    demand and are not kept.
+
+    ...
+
+    Attributes
+    ----------
+    offsets : numpy array
+        An (n + 1,) array of the positions of the first node of each element
+        in node_numbers, followed by the total number of nodes.
+    node_numbers : numpy array
+        Node numbers of all elements. The order of nodes of each element is
+        counterclockwise.
+    modes : numpy array
+        Basic mode (1 to 6) of each element.
+    rotations : numpy array
+        Angle of rotation that each element needs to convert to basic modes.
+    sizes : numpy array
+        Scale parameter (dimension) of each element.
+    properties : numpy array
+        Indicator of material properties of each element.
+    nodes : numpy array
+        Array of coordinates of mesh nodes.
+    """
+
+    def __init__(
+        self, offsets, node_numbers, modes, rotations, sizes, properties, nodes
+    ) -> None:
+        self.offsets = offsets
+        self.node_numbers = node_numbers
+        self.modes = modes
+        self.rotations = rotations
+        self.sizes = sizes
+        self.properties = properties
+        self.nodes = nodes
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("element index out of range")
+        numbers = self.node_numbers[self.offsets[index] : self.offsets[index + 1]]
+
+        return QTreeElement(
+            index + 1,
+            numbers.tolist(),
+            list(self.nodes[numbers - 1]),
+            [int(self.modes[index]), int(self.rotations[index]), self.sizes[index]],
+            self.properties[index],
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
 class QTreeMesh:
     """
     A class used to represent a quadtree mesh.
@@ -635,22 +1903,41 @@ class QTreeMesh:
 
     Attributes
     ----------
-    quad_tree : QTree object
+    quad_tree : QTree or LinearQTree object
         The main quad-tree structure from which initial mesh is generated.
     balancing : bool, optional
         Indicate whether the quad-tree is balanced for 2:1 ratio or not.
-    leaves : list
-        Outer nodes of the quad-tree.
-    elements : list
-        List of mesh elements as QTreeElement objects.
-    nodes : list
-        List of coordinates of mesh nodes.
+    drop_outside : bool, optional
+        If True, leaves outside of the extent of the image (i.e. in the
+        padding of image_preprocess) are not meshed. Default value is False.
+    leaves : None or list
+        Outer nodes of the quad-tree. None for a LinearQTree.
+    leaf_positions, leaf_sizes, leaf_properties : numpy array
+        Integer positions, sizes and properties of the leaves as returned
+        by the leaf_arrays() method of the quad-tree.
+    elements : list or QTreeElementStore
+        List of mesh elements as QTreeElement objects, or a QTreeElementStore
+        when create_elements(compact=True) is used.
+    nodes : numpy array
+        Array of coordinates of mesh nodes.
+    connectivity : numpy array
+        An (n, 4) array of corner node numbers of each cell, counterclockwise
+        from the bottom left corner.
+    hanging_nodes : numpy array
+        An (n, 4) array of the numbers of edge points on the bottom, right,
+        top and left sides of each cell. 0 where there is no edge point.
+    edge_points_numbers : list(list(int))
+        Node numbers of each cell including edge points, counterclockwise.
+    cell_types : list(list)
+        Mode, rotation and dimension of each cell (see mode_detection).
+    cell_modes : numpy array
+        An (n, 2) array of mode and rotation of each cell.
 
 
 
     Methods
     -------
-    create_elements()
+    create_elements(compact=False)
         Generate elements from cells in quad-tree.
     labeling()
         Labeling cells and their corner points.
@@ -659,152 +1946,198 @@ class QTreeMesh:
         based on the presence and location of edge points.
     mode_detection()
         Detect cell modes based on the presence and location of edge points.
-    draw()
+    modes_detection(edge_points)
+        Detect the modes of many cells at once with a lookup table.
+    draw(fill_inside=True, edge_color=None, save_name=None, ...)
         Draw the generated mesh.
-    vtk_export()
+    rasterize(edge_value=None)
+        Paint the cells into an image of their properties.
+    vtk_export(filename="output.vtk", binary=False)
         Export mesh as unstructured grid in vtk file.
+    vtu_export(filename="output.vtu", appended=True, compress=False)
+        Export mesh as unstructured grid in vtu (VTK XML) file.
     adjust_mesh_for_FEM()
         Adjust the quadtree mesh for Finite Element Method (FEM) simulations.
+    fem_arrays()
+        Convert the quadtree mesh into arrays of triangles and quadrilaterals
+        for FEM simulations.
+    update(image_array, region)
+        Update the mesh after a region of the image has changed.
+    save(path)
+        Save the mesh in a directory of NumPy files.
+    load(path, mmap_mode="r")
+        Load a mesh saved by save().
     """
 
-    def __init__(self, quad_tree: QTree, balancing=True) -> None:
+    @_instrumented("mesh", _record_mesh)
+    def __init__(self, quad_tree: QTree, balancing=True, drop_outside=False) -> None:
         self.quad_tree = quad_tree
+        self.balancing = balancing
+        self.drop_outside = drop_outside
         if balancing:
             self.quad_tree.balancing()
-        self.leaves = self.quad_tree.save_leaves()
+        if isinstance(quad_tree, QTree):
+            self.leaves = self.quad_tree.save_leaves()
+            leaf_arrays = self.quad_tree.leaf_arrays(self.leaves)
+        else:
+            self.leaves = None
+            leaf_arrays = self.quad_tree.leaf_arrays()
+        if drop_outside:
+            inside = _inside_extent(*leaf_arrays[:2], self.quad_tree.extent)
+            leaf_arrays = [array[inside] for array in leaf_arrays]
+            if self.leaves is not None:
+                self.leaves = [leaf for leaf, kept in zip(self.leaves, inside) if kept]
+        self.leaf_positions, self.leaf_sizes, self.leaf_properties = leaf_arrays
 
         self.elements = []
         self.nodes = None
+        self.connectivity = None
+        self.hanging_nodes = None
+        self._edge_points_numbers = None
+        self._cell_types = None
+        self.cell_modes = None
+        self._node_table = None
+
+    @property
+    def edge_points_numbers(self):
+        """
+        Node numbers of each cell including edge points, counterclockwise.
+        The lists are made from the arrays of the mesh when first used.
+        """
+        if self._edge_points_numbers is None and self.cell_modes is not None:
+            self._make_cell_lists()
+
+        return self._edge_points_numbers
 
-    def create_elements(self):
+    @edge_points_numbers.setter
+    def edge_points_numbers(self, value):
+        self._edge_points_numbers = value
+
+    @property
+    def cell_types(self):
+        """
+        Mode, rotation and dimension of each cell (see mode_detection).
+        The lists are made from the arrays of the mesh when first used.
+        """
+        if self._cell_types is None and self.cell_modes is not None:
+            self._make_cell_lists()
+
+        return self._cell_types
+
+    @cell_types.setter
+    def cell_types(self, value):
+        self._cell_types = value
+
+    def _make_cell_lists(self):
+        self._edge_points_numbers, self._cell_types = _cell_lists(
+            self.connectivity, self.hanging_nodes, self.cell_modes, self.leaf_sizes
+        )
+
+    @_instrumented("create_elements", _record_elements)
+    def create_elements(self, compact=False):
         """
         The main function of class that generate elements from quad-tree cells.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            If True, elements are stored in arrays of a QTreeElementStore
+            instead of a list of QTreeElement objects, which saves memory for
+            large meshes. Default value is False.
         """
         self.labeling()
         self.refactor_edge()
-        for leaf in self.leaves:
-            label = leaf.cell_number
-            node_number = leaf.edge_points_numbers
+        self._store_elements(compact)
+
+    def _store_elements(self, compact):
+        self.elements = []
+        total = self.leaf_sizes.shape[0]
+        if compact:
+            offsets, node_numbers = _edge_point_arrays(
+                self.connectivity, self.hanging_nodes
+            )
+            self.elements = QTreeElementStore(
+                offsets,
+                node_numbers,
+                self.cell_modes[:, 0],
+                self.cell_modes[:, 1],
+                self.leaf_sizes.astype(np.float64),
+                self.leaf_properties,
+                self.nodes,
+            )
+            _step("elements", total, total)
+            return
+        for label, node_number in enumerate(self.edge_points_numbers, start=1):
             node_coordinate = [self.nodes[n - 1, :] for n in node_number]
-            element_type = leaf.cell_type
-            element_property = leaf.property
+            element_type = self.cell_types[label - 1]
+            element_property = self.leaf_properties[label - 1]
             self.elements.append(
                 QTreeElement(
                     label, node_number, node_coordinate, element_type, element_property
                 )
             )
+            if label % _BATCH == 0:
+                _step("elements", _BATCH, total)
+        _step("elements", total % _BATCH, total)
 
+    @_instrumented("labeling", _record_nodes)
     def labeling(self):
         """
         A function that labels all cells and their corresponding corner
         points and add corner points to mesh nodes.
-        """
-        self.nodes = np.array([[+np.inf, -np.inf]])
-        label = 1
-
-        for leaf in self.leaves:
-            leaf.edge_points_numbers = []
-            leaf.nodes_coordinate = []
-            leaf.nodes_coordinate.append(np.array(leaf.bottom_left_corner.xy_coord))
-            leaf.nodes_coordinate.append(
-                np.array(
-                    (leaf.top_right_corner.x_coord, leaf.bottom_left_corner.y_coord)
-                )
-            )
-            leaf.nodes_coordinate.append(np.array(leaf.top_right_corner.xy_coord))
 
-            leaf.nodes_coordinate.append(
-                np.array(
-                    (leaf.bottom_left_corner.x_coord, leaf.top_right_corner.y_coord)
-                )
-            )
-            for node in leaf.nodes_coordinate:  # Creating Element node list
-                if any(np.equal(self.nodes, node).all(1)):
-                    leaf.edge_points_numbers.append(
-                        np.where(np.equal(self.nodes, node).all(1) == True)[0][0]
-                    )
-                else:
-                    self.nodes = np.r_[self.nodes, [node]]
-                    leaf.edge_points_numbers.append(self.nodes.shape[0] - 1)
-
-            leaf.cell_number = label
-            label += 1
-        self.nodes = self.nodes[1:, :]
+        Corners of all cells are generated at once from the integer pixel
+        positions and sizes of the leaves, and deduplicated with np.unique.
+        Nodes are numbered from 1 in order of first appearance, and the
+        corner node numbers of each cell are stored counterclockwise from
+        the bottom left corner in connectivity. Leaves of a QTree also keep
+        the coordinates of their corners in nodes_coordinate.
+        """
+        grid_nodes, self.connectivity, self._node_table = _number_corners(
+            self.leaf_positions, self.leaf_sizes
+        )
+        self.nodes = (
+            np.array(self.quad_tree.bottom_left_corner.xy_coord, dtype=float)
+            + grid_nodes * self.quad_tree.scale
+        )
 
+        if self.leaves is not None:
+            coordinates = self.nodes[self.connectivity - 1]
+            for label, (leaf, corners, corner_coordinates) in enumerate(
+                zip(self.leaves, self.connectivity.tolist(), coordinates), start=1
+            ):
+                leaf.edge_points_numbers = corners
+                leaf.nodes_coordinate = list(corner_coordinates)
+                leaf.cell_number = label
+        _step("labeling", self.leaf_sizes.shape[0], self.leaf_sizes.shape[0])
+
+    @_instrumented("refactor_edge", _record_modes)
     def refactor_edge(self):
         """
         A function that consider edge points, add them to
         cells attributes, and detect cell modes based on the
         presence and location of edge points
-        """
-
-        def top_right_finder(edge_nums):
-            node_numbers = [n - 1 for n in edge_nums]
-            top_right_node_index = np.lexsort(
-                (self.nodes[node_numbers][:, 0], self.nodes[node_numbers][:, 1])
-            )
-            return edge_nums[top_right_node_index[-1]]
-
-        for leaf in self.leaves:
-            newedge = list()
-            mode = list()
-
-            newedge.append(leaf.edge_points_numbers[0])
-            if leaf.south_neighbor() is not None:
-                if leaf.south_neighbor().divided:
-                    newedge.append(
-                        top_right_finder(
-                            leaf.south_neighbor().north_west.edge_points_numbers
-                        )
-                    )
-                    mode.append(True)
-                else:
-                    mode.append(False)
-            else:
-                mode.append(False)
-
-            newedge.append(leaf.edge_points_numbers[1])
-            if leaf.east_neighbor() is not None:
-                if leaf.east_neighbor().divided:
-                    newedge.append(
-                        leaf.east_neighbor().north_west.edge_points_numbers[0]
-                    )
-                    mode.append(True)
-                else:
-                    mode.append(False)
-            else:
-                mode.append(False)
-
-            newedge.append(leaf.edge_points_numbers[2])
-            if leaf.north_neighbor() is not None:
-                if leaf.north_neighbor().divided:
-                    newedge.append(
-                        leaf.north_neighbor().south_east.edge_points_numbers[0]
-                    )
-                    mode.append(True)
-                else:
-                    mode.append(False)
-            else:
-                mode.append(False)
-
-            newedge.append(leaf.edge_points_numbers[3])
-            if leaf.west_neighbor() is not None:
-                if leaf.west_neighbor().divided:
-                    newedge.append(
-                        top_right_finder(
-                            leaf.west_neighbor().south_east.edge_points_numbers
-                        )
-                    )
-                    mode.append(True)
-                else:
-                    mode.append(False)
-            else:
-                mode.append(False)
 
-            cell_type = self.mode_detection(mode)
-            cell_type.append(leaf.dimension)
-            leaf.edge_points_numbers = newedge
-            leaf.cell_type = cell_type
+        A cell has an edge point on one of its sides when the midpoint of
+        that side is a corner of the neighboring cells, i.e. the neighbor
+        on that side is divided. Midpoints of all cells are looked up at
+        once in the labeled corners, and the numbers of the edge points are
+        stored in hanging_nodes (0 where there is no edge point).
+        """
+        self.hanging_nodes = _find_edge_points(
+            self._node_table, self.leaf_positions, self.leaf_sizes
+        )
+        self.cell_modes = self.modes_detection(self.hanging_nodes != 0)
+        # Lists of node numbers and cell types are made when they are used
+        self._edge_points_numbers = self._cell_types = None
+
+        if self.leaves is not None:
+            for leaf, newedge, cell_type in zip(
+                self.leaves, self.edge_points_numbers, self.cell_types
+            ):
+                leaf.edge_points_numbers = newedge
+                leaf.cell_type = cell_type
+        _step("refactor_edge", self.leaf_sizes.shape[0], self.leaf_sizes.shape[0])
 
     @staticmethod
     def mode_detection(mode):
@@ -863,10 +2196,351 @@ class QTreeMesh:
         elif number_edge_points == 4:
             return [6, 0]
 
-    def draw(self, fill_inside=True, edge_color=None, save_name=None):
+    @staticmethod
+    def modes_detection(edge_points):
+        """
+        Detect the modes of many cells at once (see mode_detection).
+
+        The presence of edge points on the 4 sides of each cell is encoded
+        as a 4-bit number which indexes a table of the 16 possible modes.
+
+        Parameters
+        ----------
+        edge_points : numpy array
+            An (n, 4) boolean array that indicates the presence of the edge
+            node on each edge of each cell, starting from bottom edge and
+            rotating counter-clockwise.
+
+        Returns
+        -------
+        _ : numpy array
+            An (n, 2) integer array of basic mode numbers and the angles of
+            rotation needed to acquire the basic modes.
+        """
+        bits = np.asarray(edge_points, dtype=np.int64) @ np.array([1, 2, 4, 8])
+
+        return _MODE_TABLE[bits]
+
+    @_instrumented("update", _record_modes)
+    def update(self, image_array, region):
+        """
+        Update the mesh after a region of the image has changed.
+
+        The quad-tree (a LinearQTree built by from_array) is updated by its
+        update method, and only the cells in the returned box are replaced.
+        The new cells are appended to the cells, the nodes that are no
+        longer used are replaced by the new nodes or by the last nodes, and
+        the edge points and modes of the cells around the box are found
+        again. Other cells keep their nodes, so the mesh can be exported
+        again (e.g. by vtk_export) without building it from scratch.
+
+        Parameters
+        ----------
+        image_array : numpy array or PaddedImage
+            The changed image, with the same shape as the original one.
+        region : tuple (slice, slice)
+            Rows and columns of the changed pixels, e.g. np.s_[10:20, 30:45].
+
+        Returns
+        -------
+        box : None or tuple (int, int, int, int)
+            First row, first column, last row + 1 and last column + 1 of the
+            pixels whose cells were replaced. None if the region is empty.
+        """
+        tree = self.quad_tree
+        if self.leaves is not None or not hasattr(tree, "update"):
+            raise ValueError("Only the mesh of a LinearQTree can be updated.")
+        box = tree.update(image_array, region, self.balancing)
+        if box is None:
+            return None
+
+        # The box in the coordinates of leaf positions
+        height = tree.domain[0]
+        bounds = (box[1], height - box[2], box[3], height - box[0])
+        positions, sizes, properties = tree.leaf_arrays(box)
+        if self.drop_outside:
+            inside = _inside_extent(positions, sizes, tree.extent, height)
+            positions, sizes, properties = (
+                positions[inside],
+                sizes[inside],
+                properties[inside],
+            )
+        kept = ~_overlap_bounds(self.leaf_positions, self.leaf_sizes, bounds)
+        near = kept & _overlap_bounds(
+            self.leaf_positions, self.leaf_sizes, bounds, touch=True
+        )
+        removed = np.flatnonzero(~kept)
+        changed = None
+        if self.connectivity is not None:
+            changed = self._replace_nodes(kept, near, positions, sizes)
+        self.leaf_positions = np.concatenate((self.leaf_positions[kept], positions))
+        self.leaf_sizes = np.concatenate((self.leaf_sizes[kept], sizes))
+        self.leaf_properties = np.concatenate((self.leaf_properties[kept], properties))
+        if changed is None:
+            return box
+
+        # Cells around the box may have new edge points
+        changed[: np.count_nonzero(kept)] |= near[kept]
+        self.cell_modes = np.concatenate(
+            (self.cell_modes[kept], np.zeros((sizes.shape[0], 2), dtype=int))
+        )
+        rows = np.flatnonzero(changed)
+        self.hanging_nodes[rows] = _find_edge_points(
+            self._node_table, self.leaf_positions[rows], self.leaf_sizes[rows]
+        )
+        self.cell_modes[rows] = self.modes_detection(self.hanging_nodes[rows] != 0)
+
+        if self._edge_points_numbers is not None:
+            edge_points_numbers = _drop_items(self._edge_points_numbers, removed)
+            cell_types = _drop_items(self._cell_types, removed)
+            edge_points_numbers.extend([None] * sizes.shape[0])
+            cell_types.extend([None] * sizes.shape[0])
+            for row, numbers, cell_type in zip(
+                rows.tolist(),
+                *_cell_lists(
+                    self.connectivity[rows],
+                    self.hanging_nodes[rows],
+                    self.cell_modes[rows],
+                    self.leaf_sizes[rows],
+                ),
+            ):
+                edge_points_numbers[row] = numbers
+                cell_types[row] = cell_type
+            self._edge_points_numbers = edge_points_numbers
+            self._cell_types = cell_types
+        if len(self.elements):
+            self._store_elements(isinstance(self.elements, QTreeElementStore))
+
+        return box
+
+    def _replace_nodes(self, kept, near, positions, sizes):
+        """
+        Remove the cells that are not kept from the node arrays and add the
+        corners of new cells (positions and sizes). The nodes are renumbered
+        by one map of old to new numbers: nodes that are no longer used give
+        their numbers to the new nodes, and then to the last nodes. near marks
+        the kept cells that touch the box, whose edge points are found again.
+        Return a boolean array of the cells whose node numbers changed.
+        """
+        count = self.nodes.shape[0]
+        keys, numbers, width = self._node_table
+        offsets = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.int64)
+        corners = (positions[:, None, :] + sizes[:, None, None] * offsets).reshape(
+            -1, 2
+        )
+        if corners.shape[0] and corners[:, 0].max() >= width:
+            new_width = corners[:, 0].max() + 1
+            keys = keys // width * new_width + keys % width
+            order = np.argsort(keys)
+            keys, numbers, width = keys[order], numbers[order], new_width
+
+        # Old nodes used by the kept cells or by the corners of new cells.
+        # Only corners of removed cells can become unused, and only the
+        # near cells touch them (their edge points are found again).
+        corner_numbers = _find_nodes((keys, numbers, width), corners)
+        used = np.ones(count + 1, dtype=bool)
+        used[self.connectivity[~kept].ravel()] = False
+        used[self.connectivity[near].ravel()] = True
+        used[corner_numbers] = True
+        used[0] = False
+        holes = np.flatnonzero(~used[1:]) + 1
+
+        missing = corner_numbers == 0
+        new_keys, first, inverse = np.unique(
+            corners[missing, 1] * width + corners[missing, 0],
+            return_index=True,
+            return_inverse=True,
+        )
+        order = np.argsort(first)  # New nodes in order of first appearance
+        added = new_keys.shape[0]
+        total = count + added - holes.shape[0]
+        slots = np.concatenate((holes, np.arange(count + 1, total + 1)))[:added]
+        new_numbers = np.empty(added, dtype=np.int64)
+        new_numbers[order] = slots
+
+        # Old to new numbers, 0 for the nodes that are no longer used
+        remap = np.where(used, np.arange(count + 1), 0)
+        movers = np.flatnonzero(used[total + 1 :]) + total + 1
+        remap[movers] = holes[added : added + movers.shape[0]]
+        corner_numbers = remap[corner_numbers]
+        corner_numbers[missing] = new_numbers[inverse.ravel()]
+
+        nodes = np.empty((total, 2))
+        nodes[: min(count, total)] = self.nodes[: min(count, total)]
+        nodes[remap[movers] - 1] = self.nodes[movers - 1]
+        nodes[new_numbers - 1] = (
+            np.array(self.quad_tree.bottom_left_corner.xy_coord, dtype=float)
+            + corners[missing][first] * self.quad_tree.scale
+        )
+        # The map only changes the movers, and the edge points of near cells
+        connectivity = self.connectivity[kept]
+        hanging_nodes = self.hanging_nodes[kept]
+        changed = np.zeros(connectivity.shape[0] + sizes.shape[0], dtype=bool)
+        changed[: connectivity.shape[0]] = near[kept]
+        changed[: connectivity.shape[0]] |= (connectivity.max(axis=1) > total) | (
+            hanging_nodes.max(axis=1) > total
+        )
+        changed[connectivity.shape[0] :] = True
+        rows = np.flatnonzero(changed[: connectivity.shape[0]])
+        connectivity[rows] = remap[connectivity[rows]]
+        hanging_nodes[rows] = remap[hanging_nodes[rows]]
+
+        keep = used[numbers]
+        keys, numbers = keys[keep], remap[numbers[keep]]
+        index = np.searchsorted(keys, new_keys)
+        self._node_table = (
+            np.insert(keys, index, new_keys),
+            np.insert(numbers, index, new_numbers),
+            width,
+        )
+        self.nodes = nodes
+        self.connectivity = np.concatenate(
+            (connectivity, corner_numbers.reshape(-1, 4))
+        )
+        self.hanging_nodes = np.concatenate(
+            (hanging_nodes, np.zeros((sizes.shape[0], 4), dtype=np.int64))
+        )
+
+        return changed
+
+    def _to_arrays(self):
+        """
+        Return the cells, nodes and settings of the mesh as a dict of
+        arrays, from which _from_arrays builds the mesh again. The elements
+        have to be created first.
+        """
+        if self.connectivity is None:
+            raise ValueError("Elements have to be created first.")
+        node_keys, node_numbers, width = self._node_table
+        if isinstance(self.elements, QTreeElementStore):
+            offsets, numbers = self.elements.offsets, self.elements.node_numbers
+        else:
+            offsets, numbers = _edge_point_arrays(self.connectivity, self.hanging_nodes)
+
+        return {
+            "leaf_positions": self.leaf_positions,
+            "leaf_sizes": self.leaf_sizes,
+            "leaf_properties": self.leaf_properties,
+            "nodes": self.nodes,
+            "connectivity": self.connectivity,
+            "hanging_nodes": self.hanging_nodes,
+            "cell_modes": self.cell_modes,
+            "node_keys": node_keys,
+            "node_numbers": node_numbers,
+            "node_width": np.array(width),
+            "balancing": np.array(bool(self.balancing)),
+            "drop_outside": np.array(bool(self.drop_outside)),
+            "element_offsets": offsets,
+            "element_node_numbers": numbers,
+            "compact": np.array(isinstance(self.elements, QTreeElementStore)),
+        }
+
+    @classmethod
+    def _from_arrays(cls, quad_tree, arrays):
+        """
+        Build a mesh of a quad-tree from the arrays returned by _to_arrays,
+        without generating its cells and nodes again.
+        """
+        mesh = cls.__new__(cls)
+        mesh.quad_tree = quad_tree
+        mesh.balancing = bool(arrays["balancing"])
+        mesh.drop_outside = bool(arrays["drop_outside"])
+        mesh.leaves = None
+        mesh.leaf_positions = arrays["leaf_positions"]
+        mesh.leaf_sizes = arrays["leaf_sizes"]
+        mesh.leaf_properties = arrays["leaf_properties"]
+        mesh.nodes = arrays["nodes"]
+        mesh.connectivity = arrays["connectivity"]
+        mesh.hanging_nodes = arrays["hanging_nodes"]
+        mesh.cell_modes = arrays["cell_modes"]
+        mesh._node_table = (
+            arrays["node_keys"],
+            arrays["node_numbers"],
+            int(arrays["node_width"]),
+        )
+        mesh._edge_points_numbers = mesh._cell_types = None
+        if not bool(arrays["compact"]):
+            mesh._store_elements(False)
+        elif "element_offsets" in arrays:
+            mesh.elements = QTreeElementStore(
+                arrays["element_offsets"],
+                arrays["element_node_numbers"],
+                mesh.cell_modes[:, 0],
+                mesh.cell_modes[:, 1],
+                mesh.leaf_sizes.astype(np.float64),
+                mesh.leaf_properties,
+                mesh.nodes,
+            )
+        else:
+            mesh._store_elements(True)
+
+        return mesh
+
+    def save(self, path):
+        """
+        Save the mesh and its quad-tree in a directory of NumPy (.npy) files
+        that load() maps into memory.
+
+        The cells, nodes, edge points and modes are saved with the leaves of
+        the tree (a QTree is saved as the equivalent LinearQTree) in the
+        "tree" subdirectory, and the settings in metadata.json files. The
+        elements have to be created first.
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory. It is created if needed.
+        """
+        from ._linear import LinearQTree
+
+        tree = self.quad_tree
+        if self.leaves is not None:
+            tree = LinearQTree.from_qtree(tree)
+        _save_arrays(path, "QTreeMesh", self._to_arrays())
+        tree.save(os.path.join(path, "tree"))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Load a mesh saved by save().
+
+        The arrays are memory maps of the files by default, so loading takes
+        the same time for any size of mesh and pages of the files are read
+        when they are used.
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory.
+        mmap_mode : None or str, optional
+            Mode of np.load, "r" (default) for read-only memory maps or None
+            to read the arrays into memory.
+
+        Returns
+        -------
+        mesh : QTreeMesh object
+            The mesh with its elements, and a LinearQTree without
+            image_stats as quad_tree.
+        """
+        from ._linear import LinearQTree
+
+        arrays = _load_arrays(path, "QTreeMesh", mmap_mode)
+        tree = LinearQTree.load(os.path.join(path, "tree"), mmap_mode)
+
+        return cls._from_arrays(tree, arrays)
+
+    def draw(
+        self, fill_inside=True, edge_color=None, save_name=None, show=None, raster=False
+    ):
         """
         Draw elements with filling inside.
 
+        All cells are drawn at once as a PolyCollection of their corners,
+        with gray levels of their properties (see draw_mesh in the
+        _visualization module, which imports matplotlib when it is first
+        used). When the figure is only saved, it is drawn by the Agg backend
+        without pyplot, so no window is opened and no display is needed.
+
         Parameters
         ----------
         fill_inside : bool, optional
@@ -876,29 +2550,78 @@ class QTreeMesh:
             The color for element edges.
         save_name : None/str, optional
             name of file to save figure.
+        show : None/bool, optional
+            Show the figure in a window with pyplot. Default is True when
+            there is no save_name.
+        raster : bool, optional
+            Draw the image of rasterize() instead of polygons, which is much
+            faster for large meshes. Default value is False.
 
         Returns
         -------
-            None.
+        fig : matplotlib Figure
 
         """
-        fig = figure(figsize=(10, 10), frameon=False)
-        axis("off")
-        for element in self.elements:
-            fill(
-                [p[0] for p in element.nodes_coordinates],
-                [p[1] for p in element.nodes_coordinates],
-                facecolor=str(element.element_property / 255)
-                if fill_inside
-                else "white",
-                edgecolor=edge_color,
-            )
-        fig.tight_layout()
-        show()
-        if save_name:
-            fig.savefig(save_name)
+        # matplotlib is only imported when a mesh is drawn
+        from ._visualization import draw_mesh
+
+        return draw_mesh(self, fill_inside, edge_color, save_name, show, raster)
+
+    def rasterize(self, edge_value=None, zoom=1):
+        """
+        Paint the cells into an image of their properties, e.g. for a quick
+        preview of a large mesh.
 
-    def vtk_export(self, filename="output.vtk"):
+        Cells of the same size are painted together, so the cost depends on
+        the number of pixels, not on the number of cells.
+
+        Parameters
+        ----------
+        edge_value : None or float, optional
+            If given, the top and left pixels of each cell are set to this
+            value, which outlines the cells.
+        zoom : int, optional
+            Number of pixels of the result in each direction for a pixel of
+            the image. Default value is 1.
+
+        Returns
+        -------
+        image : numpy array
+            A float array of the (padded) image magnified by zoom. Pixels
+            without cells (see drop_outside) are NaN.
+        """
+        positions, sizes = self.leaf_positions * zoom, self.leaf_sizes * zoom
+        height = int((positions[:, 1] + sizes).max(initial=0))
+        width = int((positions[:, 0] + sizes).max(initial=0))
+        image = np.full((height, width), np.nan)
+        rows = height - positions[:, 1] - sizes
+        for size in np.unique(sizes).tolist():
+            chosen = np.flatnonzero(sizes == size)
+            pixels = np.arange(size)
+            # Blocks of cells are painted by fancy indexing in batches of a
+            # few million pixels, and the largest cells one by one
+            batch = max(1, (1 << 22) // (size * size))
+            for start in range(0, chosen.shape[0], batch):
+                cells = chosen[start : start + batch]
+                top, left = rows[cells], positions[cells, 0]
+                if size * size >= 1 << 16:
+                    for row, col, value in zip(
+                        top.tolist(), left.tolist(), self.leaf_properties[cells]
+                    ):
+                        image[row : row + size, col : col + size] = value
+                else:
+                    image[
+                        top[:, None, None] + pixels[None, :, None],
+                        left[:, None, None] + pixels[None, None, :],
+                    ] = self.leaf_properties[cells][:, None, None]
+                if edge_value is not None:
+                    image[top[:, None], left[:, None] + pixels] = edge_value
+                    image[top[:, None] + pixels, left[:, None]] = edge_value
+
+        return image
+
+    @_instrumented("vtk_export")
+    def vtk_export(self, filename="output.vtk", binary=False):
         """
         Export mesh as unstructured grid to .vtk file.
         Creating the file is done manually, and no library is used.
@@ -907,47 +2630,191 @@ class QTreeMesh:
         ----------
         filename : str, optional
             Output file name.
+        binary : bool, optional
+            If True, data is written in the BINARY format of legacy vtk
+            files (big endian) with bulk writes of arrays, which is much
+            faster and smaller than ASCII. Default value is False.
 
         Returns
         -------
             None.
 
         """
-        file_open = open(filename, "w", encoding="utf-8")
-        file_open.write("# vtk DataFile Version 2.0\nOutput Data\nASCII\n")
-        file_open.write("DATASET UNSTRUCTURED_GRID\n")
+        offsets, connectivity, material = self._cell_arrays()
         total_points = self.nodes.shape[0]
-        file_open.write(f"POINTS {total_points} float\n")
-        for each in self.nodes:
-            file_open.write(f"{each[0]} {each[1]} 0.0\n")
-        total_cells = len(self.elements)
-        new_connectivity = [np.array(each.nodes_numbers) - 1 for each in self.elements]
-        total_data = sum([i.shape[0] for i in new_connectivity]) + len(new_connectivity)
-        file_open.write(f"CELLS {total_cells} {total_data}\n")
-
-        for each in new_connectivity:
-            file_open.write(f"{each.shape[0]} ")
-            file_open.writelines(str(np.flip(each))[1:-1])
-            file_open.write("\n")
-
-        file_open.write(f"CELL_TYPES {total_cells}\n")
-        for i in range(total_cells):
-            file_open.write("7\n")
-
-        material = [each.element_property for each in self.elements]
-        file_open.write(f"CELL_DATA {total_cells}\n")
-        file_open.write("SCALARS Average-Intensity float 1 \nLOOKUP_TABLE default \n")
-        for item in material:
-            file_open.write(f"{item}\n")
-
-        file_open.close()
+        total_cells = offsets.shape[0] - 1
+        counts = np.diff(offsets)
+        # Each cell is written as its number of nodes followed by the nodes
+        cells = np.empty(connectivity.shape[0] + total_cells, dtype=np.int64)
+        starts = offsets[:-1] + np.arange(total_cells)
+        cells[starts] = counts
+        cells[np.delete(np.arange(cells.shape[0]), starts)] = connectivity
+
+        with open(filename, "wb") as file_open:
+            file_open.write(
+                b"# vtk DataFile Version 2.0\nOutput Data\n"
+                + (b"BINARY\n" if binary else b"ASCII\n")
+                + b"DATASET UNSTRUCTURED_GRID\n"
+                + f"POINTS {total_points} float\n".encode()
+            )
+            if binary:
+                points = np.zeros((total_points, 3), dtype=">f4")
+                points[:, :2] = self.nodes
+                points.tofile(file_open)
+                file_open.write(b"\n")
+            else:
+                text = "%r %r 0.0\n" * total_points
+                file_open.write((text % tuple(self.nodes.ravel().tolist())).encode())
+
+            file_open.write(f"CELLS {total_cells} {cells.shape[0]}\n".encode())
+            if binary:
+                cells.astype(">i4").tofile(file_open)
+                file_open.write(b"\n")
+            else:
+                # Cells with the same number of nodes are formatted at once
+                lines = np.empty(total_cells, dtype=object)
+                for count in np.unique(counts).tolist():
+                    index = np.flatnonzero(counts == count)
+                    rows = cells[starts[index, None] + np.arange(count + 1)]
+                    text = ("%d " * count + "%d\n") * index.shape[0]
+                    lines[index] = (text % tuple(rows.ravel().tolist())).splitlines()
+                file_open.write(("\n".join(lines.tolist()) + "\n").encode())
+
+            file_open.write(f"CELL_TYPES {total_cells}\n".encode())
+            if binary:
+                np.full(total_cells, 7, dtype=">i4").tofile(file_open)
+                file_open.write(b"\n")
+            else:
+                file_open.write(b"7\n" * total_cells)
+
+            file_open.write(f"CELL_DATA {total_cells}\n".encode())
+            file_open.write(
+                b"SCALARS Average-Intensity float 1 \nLOOKUP_TABLE default \n"
+            )
+            if binary:
+                material.astype(">f4").tofile(file_open)
+                file_open.write(b"\n")
+            else:
+                text = "%r\n" * total_cells
+                file_open.write((text % tuple(material.tolist())).encode())
+
+    @_instrumented("vtu_export")
+    def vtu_export(self, filename="output.vtu", appended=True, compress=False):
+        """
+        Export mesh as unstructured grid to .vtu file (VTK XML format).
+        Creating the file is done manually, and no library is used.
+
+        Parameters
+        ----------
+        filename : str, optional
+            Output file name.
+        appended : bool, optional
+            If True, data arrays are written as raw bytes in the appended
+            data section of the file. Otherwise they are written inline,
+            encoded in base64. Default value is True.
+        compress : bool, optional
+            If True, data arrays are compressed with zlib.
+            Default value is False.
+
+        Returns
+        -------
+            None.
+
+        """
+        offsets, connectivity, material = self._cell_arrays()
+        total_cells = offsets.shape[0] - 1
+        points = np.zeros((self.nodes.shape[0], 3), dtype="<f8")
+        points[:, :2] = self.nodes
+        arrays = [
+            ("Points", 'NumberOfComponents="3"', points),
+            ("Cells", 'Name="connectivity"', connectivity.astype("<i8")),
+            ("Cells", 'Name="offsets"', offsets[1:].astype("<i8")),
+            ("Cells", 'Name="types"', np.full(total_cells, 7, dtype="u1")),
+            ("CellData", 'Name="Average-Intensity"', material.astype("<f8")),
+        ]
+        vtk_types = {"f8": "Float64", "i8": "Int64", "u1": "UInt8"}
+
+        blocks = [_vtu_block(array, compress) for _, _, array in arrays]
+        position = 0
+        sections = {"Points": [], "Cells": [], "CellData": []}
+        for (section, attributes, array), block in zip(arrays, blocks):
+            data_array = (
+                f'        <DataArray type="{vtk_types[array.dtype.str[1:]]}" '
+                f"{attributes} "
+            )
+            if appended:
+                data_array += f'format="appended" offset="{position}"/>\n'
+                position += sum(len(part) for part in block)
+            else:
+                # The header is encoded separately only for compressed data
+                if not compress:
+                    block = [b"".join(block)]
+                encoded = b"".join(base64.b64encode(part) for part in block)
+                data_array += f'format="binary">\n          {encoded.decode()}\n'
+                data_array += "        </DataArray>\n"
+            sections[section].append(data_array)
+
+        header = (
+            '<?xml version="1.0"?>\n'
+            '<VTKFile type="UnstructuredGrid" version="1.0" '
+            'byte_order="LittleEndian" header_type="UInt64"'
+            + (' compressor="vtkZLibDataCompressor"' if compress else "")
+            + ">\n  <UnstructuredGrid>\n"
+            f'    <Piece NumberOfPoints="{points.shape[0]}" '
+            f'NumberOfCells="{total_cells}">\n'
+            "      <Points>\n" + "".join(sections["Points"]) + "      </Points>\n"
+            "      <Cells>\n" + "".join(sections["Cells"]) + "      </Cells>\n"
+            '      <CellData Scalars="Average-Intensity">\n'
+            + "".join(sections["CellData"])
+            + "      </CellData>\n    </Piece>\n  </UnstructuredGrid>\n"
+        )
+        with open(filename, "wb") as file_open:
+            file_open.write(header.encode())
+            if appended:
+                file_open.write(b'  <AppendedData encoding="raw">\n   _')
+                for block in blocks:
+                    for part in block:
+                        file_open.write(part)
+                file_open.write(b"\n  </AppendedData>\n")
+            file_open.write(b"</VTKFile>\n")
+
+    def _cell_arrays(self):
+        """
+        Return the offsets, the 0-based node numbers (in the reversed order
+        used by vtk files) and the properties of the elements as arrays.
+        """
+        if isinstance(self.elements, QTreeElementStore):
+            offsets = self.elements.offsets
+            node_numbers = self.elements.node_numbers
+            material = np.asarray(self.elements.properties, dtype=np.float64)
+        else:
+            counts = [len(each.nodes_numbers) for each in self.elements]
+            offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            node_numbers = np.fromiter(
+                (n for each in self.elements for n in each.nodes_numbers),
+                dtype=np.int64,
+                count=offsets[-1],
+            )
+            material = np.array(
+                [each.element_property for each in self.elements], dtype=np.float64
+            )
+        # Position of the node of each cell read in the reversed order
+        cell_of_node = np.repeat(np.arange(offsets.shape[0] - 1), np.diff(offsets))
+        reverse = offsets[cell_of_node] * 2 + np.diff(offsets)[cell_of_node] - 1
+        reverse -= np.arange(node_numbers.shape[0])
 
+        return offsets, node_numbers[reverse] - 1, material
+
+    @_instrumented("adjust_mesh_for_FEM", _record_fem_elements)
     def adjust_mesh_for_FEM(self, force_triangulation=True):
         """
         Adjust the quadtree mesh for Finite Element Method (FEM) simulations.
 
         This method processes the quadtree mesh to make it suitable for FEM simulations by
-        handling hanging nodes.
+        handling hanging nodes. The templates of QTreeElement.quad_treatment are
+        applied to all elements with the same mode and rotation at once (see
+        fem_arrays).
 
         Args:
             force_triangulation (bool, optional): If True, forces triangulation when applicable.
@@ -958,17 +2825,204 @@ class QTreeMesh:
             - fem_elements (list of lists of int): List of modified element node numbers.
             - fem_properties (list of float): List of element properties calculated by averaging pixel intensities.
         """
-        fem_elements = []
-        fem_properties = []
-        for element in self.elements:
-            new_elements = element.quad_treatment(force_triangulation)
-            fem_elements += new_elements
-            fem_properties += [element.element_property] * len(new_elements)
+        if len(self.elements) == 0:
+            return self.nodes, [], []
+        triangles, quads = self._apply_templates(force_triangulation)
+        cells = np.concatenate((triangles[1], quads[1]))
+        order = np.lexsort((np.concatenate((triangles[2], quads[2])), cells))
+        fem_elements = triangles[0].tolist() + quads[0].tolist()
+        fem_elements = [fem_elements[i] for i in order.tolist()]
+        fem_properties = list(self.leaf_properties[cells[order]])
 
         return self.nodes, fem_elements, fem_properties
 
+    @_instrumented("fem_arrays", _record_fem_arrays)
+    def fem_arrays(self, force_triangulation=True):
+        """
+        Convert the quadtree mesh into triangles and quadrilaterals for
+        Finite Element Method (FEM) simulations.
+
+        The same templates as adjust_mesh_for_FEM() are used, but all cells
+        with the same mode and rotation are converted at once and the
+        result is returned as arrays.
 
-def image_preprocess(image_array):
+        Parameters
+        ----------
+        force_triangulation : bool, optional
+            If True, forces triangulation when applicable.
+
+        Returns
+        -------
+        nodes : numpy array
+            Array of coordinates of mesh nodes.
+        triangles : numpy array
+            A (t, 3) array of node numbers (starting from 1) of triangles.
+        triangle_properties : numpy array
+            A (t,) array of the property of the cell of each triangle.
+        quads : numpy array
+            A (q, 4) array of node numbers (starting from 1) of quadrilaterals.
+        quad_properties : numpy array
+            A (q,) array of the property of the cell of each quadrilateral.
+        """
+        if self.cell_modes is None:
+            self.labeling()
+            self.refactor_edge()
+        triangles, quads = self._apply_templates(force_triangulation)
+
+        return (
+            self.nodes,
+            triangles[0],
+            self.leaf_properties[triangles[1]],
+            quads[0],
+            self.leaf_properties[quads[1]],
+        )
+
+    def _apply_templates(self, force_triangulation):
+        """
+        Apply the templates of quad_treatment to groups of cells with the
+        same mode and rotation. Return the connectivity, cell index and
+        position in the template of triangles and of quadrilaterals, in
+        order of cells.
+        """
+        offsets, numbers = _edge_point_arrays(self.connectivity, self.hanging_nodes)
+        codes = self.cell_modes[:, 0] * 360 + self.cell_modes[:, 1]
+        parts = {3: [], 4: []}
+        for code in np.unique(codes).tolist():
+            cells = np.flatnonzero(codes == code)
+            count = offsets[cells[0] + 1] - offsets[cells[0]]
+            cell_nodes = numbers[offsets[cells][:, None] + np.arange(count)]
+            # Templates in terms of the local node indices of the cells
+            template = QTreeElement(
+                0, list(range(count)), None, list(divmod(code, 360)), 0
+            ).quad_treatment(force_triangulation)
+            for position, local_nodes in enumerate(template):
+                parts[len(local_nodes)].append(
+                    (cell_nodes[:, local_nodes], cells, position)
+                )
+            _step("fem", cells.shape[0], codes.shape[0])
+
+        result = []
+        for corners in (3, 4):
+            connectivity = [np.empty((0, corners), dtype=np.int64)]
+            cells = [np.empty(0, dtype=np.int64)]
+            positions = [np.empty(0, dtype=np.int64)]
+            for part_nodes, part_cells, position in parts[corners]:
+                connectivity.append(part_nodes)
+                cells.append(part_cells)
+                positions.append(np.full(part_cells.shape[0], position))
+            connectivity = np.concatenate(connectivity)
+            cells = np.concatenate(cells)
+            positions = np.concatenate(positions)
+            order = np.lexsort((positions, cells))
+            result.append((connectivity[order], cells[order], positions[order]))
+
+        return result
+
+
+_MODE_TABLE = np.array(
+    [
+        QTreeMesh.mode_detection([bool(bits >> side & 1) for side in range(4)])
+        for bits in range(16)
+    ]
+)
+
+
+class PaddedImage:
+    """
+    A class used to represent an image virtually padded to a square of
+    order 2^n.
+
+    Pixels outside of the image have a constant fill value and are not
+    stored. Slicing returns a PaddedImage window without reading pixels,
+    and np.asarray() of a window allocates its pixels with the dtype of
+    the image.
+
+    ...
+
+    Attributes
+    ----------
+    image : numpy array
+        The array of the image.
+    fill_value : scalar, optional
+        Value of the pixels outside of the image. Default value is 0.
+    shape : tuple (int, int)
+        Number of rows and columns of the window. Default is the square of
+        order 2^n that contains the image.
+    offset : tuple (int, int)
+        Row and column of the top left pixel of the window in the padded
+        image. Default position is (0, 0).
+    dtype : numpy dtype
+        Data type of the image.
+    size : int
+        Number of pixels of the window.
+    extent : tuple (int, int)
+        Number of rows and columns of the window covered by the image.
+    """
+
+    ndim = 2
+
+    def __init__(self, image, fill_value=0, shape=None, offset=(0, 0)):
+        self.image = np.asarray(image)
+        if self.image.ndim != 2:
+            raise ValueError("PaddedImage requires a 2-D image array.")
+        self.fill_value = fill_value
+        if shape is None:
+            dimension = 1 << max(int(max(self.image.shape) - 1).bit_length(), 1)
+            shape = (dimension, dimension)
+        self.shape = tuple(shape)
+        self.offset = tuple(offset)
+
+    @property
+    def dtype(self):
+        """
+        Data type of the image.
+        """
+        return self.image.dtype
+
+    @property
+    def size(self):
+        """
+        Number of pixels of the window.
+        """
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def extent(self):
+        """
+        Number of rows and columns of the window covered by the image.
+        """
+        return tuple(
+            min(max(length - offset, 0), window)
+            for length, offset, window in zip(self.image.shape, self.offset, self.shape)
+        )
+
+    def __getitem__(self, key):
+        if not (
+            isinstance(key, tuple)
+            and len(key) == 2
+            and all(isinstance(item, slice) and item.step in (None, 1) for item in key)
+        ):
+            return np.asarray(self)[key]
+        (row_start, row_stop, _), (col_start, col_stop, _) = (
+            item.indices(length) for item, length in zip(key, self.shape)
+        )
+
+        return PaddedImage(
+            self.image,
+            self.fill_value,
+            (max(row_stop - row_start, 0), max(col_stop - col_start, 0)),
+            (self.offset[0] + row_start, self.offset[1] + col_start),
+        )
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.full(self.shape, self.fill_value, dtype=self.image.dtype)
+        (row, col), (rows, cols) = self.offset, self.extent
+        array[:rows, :cols] = self.image[row : row + rows, col : col + cols]
+
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+
+def image_preprocess(image_array, virtual=False, fill_value=0):
     """
     A function to make image square and of order 2^n.
 
@@ -976,19 +3030,39 @@ def image_preprocess(image_array):
     ----------
     image_array : numpy array
         The array of the image.
+    virtual : bool, optional
+        If True, the image is not copied but wrapped in a PaddedImage,
+        which keeps its dtype and treats the padding as pixels of
+        fill_value. ImagePyramid (and so QTree.from_pyramid() and
+        LinearQTree.from_array()) only reads the pixels of the image.
+        Default value is False.
+    fill_value : scalar, optional
+        Value of the pixels of the padding. Default value is 0.
 
     Returns
     -------
-    image_array : numpy array
+    image_array : numpy array or PaddedImage
         The modified array of the image.
     """
+    if virtual:
+        return PaddedImage(image_array, fill_value)
 
     if image_array.shape[0] > image_array.shape[1]:
         diff = image_array.shape[0] - image_array.shape[1]
-        image_array = np.hstack((image_array, np.zeros((image_array.shape[0], diff))))
+        image_array = np.hstack(
+            (
+                image_array,
+                np.full((image_array.shape[0], diff), fill_value, dtype=float),
+            )
+        )
     elif image_array.shape[0] < image_array.shape[1]:
         diff = image_array.shape[1] - image_array.shape[0]
-        image_array = np.vstack((image_array, np.zeros((diff, image_array.shape[1]))))
+        image_array = np.vstack(
+            (
+                image_array,
+                np.full((diff, image_array.shape[1]), fill_value, dtype=float),
+            )
+        )
 
     base = 2
     order_y = 2
@@ -1000,7 +3074,12 @@ def image_preprocess(image_array):
     diffy = base - image_array.shape[0]
 
     if diffy != 0:
-        image_array = np.vstack((image_array, np.zeros((diffy, image_array.shape[1]))))
+        image_array = np.vstack(
+            (
+                image_array,
+                np.full((diffy, image_array.shape[1]), fill_value, dtype=float),
+            )
+        )
 
     base = 2
     order_x = 2
@@ -1012,6 +3091,212 @@ def image_preprocess(image_array):
     diffx = base - image_array.shape[1]
 
     if diffx != 0:
-        image_array = np.hstack((image_array, np.zeros((image_array.shape[0], diffx))))
+        image_array = np.hstack(
+            (
+                image_array,
+                np.full((image_array.shape[0], diffx), fill_value, dtype=float),
+            )
+        )
 
     return image_array
+
+
+def _inside_extent(positions, sizes, extent, height=None):
+    """
+    Return a boolean array that indicates whether each leaf overlaps the
+    image, which covers the top left extent (rows, cols) of the domain.
+    The height of the domain is found from the leaves if it is not given.
+    """
+    rows, cols = extent
+    if height is None:
+        height = (positions[:, 1] + sizes).max(initial=0)
+
+    return (positions[:, 0] < cols) & (positions[:, 1] + sizes > height - rows)
+
+
+def _overlap_bounds(positions, sizes, bounds, touch=False):
+    """
+    Return a boolean array that indicates whether each leaf overlaps the
+    bounds (left, bottom, right, top) given in pixel coordinates, or
+    touches them if touch is True.
+    """
+    left, bottom, right, top = bounds
+    if touch:
+        left, bottom, right, top = left - 1, bottom - 1, right + 1, top + 1
+
+    return (
+        (positions[:, 0] < right)
+        & (positions[:, 0] + sizes > left)
+        & (positions[:, 1] < top)
+        & (positions[:, 1] + sizes > bottom)
+    )
+
+
+def _number_corners(positions, sizes):
+    """
+    Generate the four corners of all cells and number the unique ones.
+
+    Parameters
+    ----------
+    positions : numpy array
+        An (n, 2) integer array of pixel coordinates of the bottom left
+        corner of each cell.
+    sizes : numpy array
+        An (n,) integer array of the number of pixels in each direction
+        of each cell.
+
+    Returns
+    -------
+    grid_nodes : numpy array
+        An (m, 2) integer array of pixel coordinates of unique corners,
+        ordered by first appearance.
+    connectivity : numpy array
+        An (n, 4) array of node numbers (starting from 1) of the corners of
+        each cell, counterclockwise from the bottom left corner.
+    node_table : tuple
+        Sorted keys of the unique corners, their node numbers and the width
+        of the key grid, used by _find_nodes.
+    """
+    offsets = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.int64)
+    corners = positions[:, None, :] + sizes[:, None, None] * offsets
+    corners = corners.reshape(-1, 2)
+    width = corners[:, 0].max(initial=0) + 1
+    keys = corners[:, 1] * width + corners[:, 0]
+
+    unique_keys, first, inverse = np.unique(
+        keys, return_index=True, return_inverse=True
+    )
+    order = np.argsort(first)  # Unique corners in order of first appearance
+    numbers = np.empty(order.shape[0], dtype=np.int64)
+    numbers[order] = np.arange(1, order.shape[0] + 1)
+    connectivity = numbers[inverse.ravel()].reshape(-1, 4)
+
+    return corners[first[order]], connectivity, (unique_keys, numbers, width)
+
+
+def _find_edge_points(node_table, positions, sizes):
+    """
+    Return an (n, 4) array of the numbers of edge points on the bottom,
+    right, top and left sides of cells, i.e. the midpoints of the sides
+    that are nodes. 0 where there is no edge point.
+    """
+    half = sizes // 2
+    midpoints = np.stack(
+        [
+            np.column_stack((positions[:, 0] + half, positions[:, 1])),
+            np.column_stack((positions[:, 0] + sizes, positions[:, 1] + half)),
+            np.column_stack((positions[:, 0] + half, positions[:, 1] + sizes)),
+            np.column_stack((positions[:, 0], positions[:, 1] + half)),
+        ],
+        axis=1,
+    )
+    hanging_nodes = _find_nodes(node_table, midpoints)
+    hanging_nodes[sizes < 2] = 0  # A single pixel has no edge points
+
+    return hanging_nodes
+
+
+def _drop_items(items, indices):
+    """
+    Return a copy of a list without the items at the sorted indices.
+    """
+    result = []
+    start = 0
+    for index in indices.tolist():
+        result.extend(items[start:index])
+        start = index + 1
+    result.extend(items[start:])
+
+    return result
+
+
+def _cell_lists(connectivity, hanging_nodes, cell_modes, sizes):
+    """
+    Return the node numbers including edge points and the types (mode,
+    rotation and dimension) of cells as lists.
+    """
+    offsets, numbers = _edge_point_arrays(connectivity, hanging_nodes)
+    offsets, numbers = offsets.tolist(), numbers.tolist()
+    edge_points_numbers = [
+        numbers[start:end] for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+    cell_types = [
+        [mode, rotation, size]
+        for (mode, rotation), size in zip(cell_modes.tolist(), sizes.astype(np.float64))
+    ]
+
+    return edge_points_numbers, cell_types
+
+
+def _edge_point_arrays(connectivity, hanging_nodes):
+    """
+    Merge corners and edge points of cells into node lists in CSR layout.
+
+    Parameters
+    ----------
+    connectivity : numpy array
+        An (n, 4) array of corner node numbers of each cell.
+    hanging_nodes : numpy array
+        An (n, 4) array of edge point numbers of each cell, 0 where there
+        is no edge point.
+
+    Returns
+    -------
+    offsets : numpy array
+        An (n + 1,) array of the positions of the first node of each cell
+        in node_numbers.
+    node_numbers : numpy array
+        Node numbers of all cells, each corner followed by the edge point
+        of the next side (counterclockwise).
+    """
+    numbers = np.stack((connectivity, hanging_nodes), axis=2).reshape(-1, 8)
+    offsets = np.zeros(numbers.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.count_nonzero(numbers, axis=1), out=offsets[1:])
+
+    return offsets, numbers[numbers != 0]
+
+
+def _vtu_block(array, compress):
+    """
+    Return the parts of the binary representation of an array in a vtu
+    file: a UInt64 header followed by the (compressed) data.
+    """
+    data = np.ascontiguousarray(array).tobytes()
+    if not compress:
+        return [np.array([len(data)], dtype="<u8").tobytes(), data]
+    block_size = 32768
+    chunks = [
+        zlib.compress(data[start : start + block_size])
+        for start in range(0, len(data), block_size)
+    ]
+    last_size = len(data) - (len(chunks) - 1) * block_size if chunks else 0
+    header = [len(chunks), block_size, last_size] + [len(chunk) for chunk in chunks]
+
+    return [np.array(header, dtype="<u8").tobytes(), b"".join(chunks)]
+
+
+def _find_nodes(node_table, points):
+    """
+    Return the node numbers of points given in integer pixel coordinates.
+
+    Parameters
+    ----------
+    node_table : tuple
+        The node table returned by _number_corners.
+    points : numpy array
+        An (..., 2) integer array of pixel coordinates.
+
+    Returns
+    -------
+    numbers : numpy array
+        Node number of each point. 0 where the point is not a node.
+    """
+    unique_keys, numbers, width = node_table
+    if unique_keys.shape[0] == 0:
+        return np.zeros(points.shape[:-1], dtype=np.int64)
+    inside = (points[..., 0] >= 0) & (points[..., 0] < width) & (points[..., 1] >= 0)
+    keys = points[..., 1] * width + points[..., 0]
+    index = np.minimum(np.searchsorted(unique_keys, keys), unique_keys.shape[0] - 1)
+    found = inside & (unique_keys[index] == keys)
+
+    return np.where(found, numbers[index], 0)
@@ -0,0 +1,227 @@
+"""
+Out-of-core construction of linear quadtrees from memory-mapped or tiled
+images.
+
+Author : Sadjad Abedi
+"""
+
+import numpy as np
+
+from ._instrument import _instrumented, _record_tree
+from ._linear import LinearQTree, morton_encode
+from ._progress import _step
+from ._qtreemesh import ImagePyramid, Point, _BlockMean
+
+
+def open_image(path, shape=None, dtype=np.uint8, offset=0):
+    """
+    Open an image file as a read-only memory map, so that only the parts
+    that are used are read from disk.
+
+    Parameters
+    ----------
+    path : str
+        Path of a NumPy (.npy) file, or of a raw file of pixels in row
+        major order.
+    shape : None or tuple (int, int), optional
+        Number of rows and columns of a raw file.
+    dtype : data-type, optional
+        Type of the pixels of a raw file. Default is uint8.
+    offset : int, optional
+        Number of bytes before the first pixel of a raw file.
+
+    Returns
+    -------
+    image : numpy memmap
+    """
+    if str(path).lower().endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    if shape is None:
+        raise ValueError("The shape of a raw image file is required.")
+
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=tuple(shape))
+
+
+def read_block(image, row, col, size):
+    """
+    Read a square block of an image. Pixels outside of the image are 0,
+    as if the image was padded by image_preprocess().
+
+    Parameters
+    ----------
+    image : array-like
+        An object with a shape attribute that supports 2-D slicing, e.g. a
+        NumPy array or memmap, or an HDF5 or Zarr dataset.
+    row, col : int
+        Row and column of the top left pixel of the block.
+    size : int
+        Number of pixels of the block in each direction.
+
+    Returns
+    -------
+    block : numpy array
+    """
+    rows, cols = image.shape
+    inside = np.asarray(image[row : min(row + size, rows), col : min(col + size, cols)])
+    if inside.shape == (size, size):
+        return inside
+    block = np.zeros((size, size), dtype=inside.dtype)
+    block[: inside.shape[0], : inside.shape[1]] = inside
+
+    return block
+
+
+@_instrumented("tree", _record_tree)
+def build_tiled(
+    image,
+    crit=1,
+    scale=1.0,
+    bottom_left_corner=Point((0.0, 0.0)),
+    criterion="range",
+    min_size=1,
+    max_size=None,
+    tile_size=2048,
+):
+    """
+    Build a linear quadtree from an image that does not fit in memory.
+
+    The image is read one tile at a time and the subtree of each tile is
+    built by LinearQTree.from_array, so the memory use depends on the tile
+    size and the number of leaves, not on the image size. The levels above
+    the tiles are decided by an ImagePyramid built from the reductions of
+    the tiles (see ImagePyramid.from_blocks), which gives the same leaves
+    as LinearQTree.from_array(image_preprocess(image)) for criteria that
+    use the reductions of the pyramid ("range", "std" and, apart from tile
+    borders, "gradient"). The "entropy" criterion is not supported.
+
+    Parameters
+    ----------
+    image : array-like
+        An object with a shape attribute that supports 2-D slicing, e.g. a
+        memmap returned by open_image(). It does not have to be square or
+        of order 2^n, the missing pixels are taken as 0.
+    crit : int, optional
+        The criteria used for partitioning. Default value is 1.
+    scale : float, optional
+        The ratio between pixels units and real units. Default value is 1.
+    bottom_left_corner : Point, optional
+        Coordinate of the bottom left corner of the (padded) image.
+    criterion : str or callable, optional
+        The splitting criterion (see ImagePyramid). Default is "range".
+    min_size : int, optional
+        Minimum dimension of cells in pixels. Default value is 1.
+    max_size : None or int, optional
+        Maximum dimension of cells in pixels.
+    tile_size : int, optional
+        Number of pixels in each direction of the tiles, a power of 2.
+        Default value is 2048.
+
+    Returns
+    -------
+    tree : LinearQTree object
+    """
+    if tile_size < 1 or tile_size & (tile_size - 1):
+        raise ValueError("tile_size has to be a power of 2.")
+    if criterion == "entropy":
+        raise ValueError(
+            'The "entropy" criterion needs the whole image, use LinearQTree.from_array.'
+        )
+    rows, cols = image.shape
+    size = 1 << max(int(max(rows, cols, 1) - 1).bit_length(), 1)
+    tile_size = min(max(tile_size, 2 * min_size), size)
+    count = size // tile_size
+    tile_level = count.bit_length() - 1
+
+    tiles, reductions = [], []
+    for row in range(count):
+        for col in range(count):
+            tile = read_block(image, row * tile_size, col * tile_size, tile_size)
+            tree = LinearQTree.from_array(
+                tile, crit, criterion=criterion, min_size=min_size, max_size=max_size
+            )
+            tiles.append(
+                (
+                    tree.keys | morton_encode(row * tile_size, col * tile_size),
+                    tree.levels + tile_level,
+                    tree.properties,
+                )
+            )
+            reductions.append(_tile_reductions(tree.image_stats))
+            _step("tiles", 1, count * count)
+
+    keys, levels, properties = _join_tiles(
+        tiles, reductions, tile_size, crit, criterion, min_size, max_size
+    )
+
+    return LinearQTree(
+        keys,
+        levels,
+        properties,
+        size.bit_length() - 1,
+        scale,
+        bottom_left_corner,
+        _BlockMean(image),
+        (rows, cols),
+    )
+
+
+def _tile_reductions(pyramid):
+    """
+    Return the minimum, maximum and summation of intensities of the image
+    of a pyramid, and its block_sums by key, as used by _join_tiles.
+    """
+    return (
+        pyramid.minimum[0][0, 0],
+        pyramid.maximum[0][0, 0],
+        pyramid.total[0][0, 0],
+        {key: sums[0][0, 0] for key, sums in pyramid._block_sums.items()},
+    )
+
+
+def _join_tiles(tiles, reductions, tile_size, crit, criterion, min_size, max_size):
+    """
+    Join the leaves of the 4^k tiles of an image under a common root.
+
+    The blocks above the tiles are decided by an ImagePyramid built from
+    the reductions of the tiles (see ImagePyramid.from_blocks), and only
+    the leaves of tiles inside divided blocks are kept. tiles holds the
+    keys (in the whole image), levels and properties of the leaves of each
+    tile, and reductions the output of _tile_reductions for each tile, both
+    in row major order of the tiles. Return the keys, levels and
+    properties of the leaves.
+    """
+    count = 1 << ((len(tiles).bit_length() - 1) // 2)
+    minimum, maximum, total, block_sums = zip(*reductions)
+    coarse = ImagePyramid.from_blocks(
+        np.reshape(minimum, (count, count)),
+        np.reshape(maximum, (count, count)),
+        np.reshape(total, (count, count)),
+        {
+            key: np.reshape([sums[key] for sums in block_sums], (count, count))
+            for key in block_sums[0]
+        },
+        tile_size,
+        crit,
+        criterion,
+        min_size,
+        max_size,
+    )
+    # Blocks above the tiles are leaves where they are not divided but
+    # all of their ancestors are
+    keys, levels, properties = [], [], []
+    alive = np.ones((1, 1), dtype=bool)
+    for depth in range(count.bit_length() - 1):
+        leaves = alive & ~coarse.split[depth]
+        block_rows, block_cols = np.nonzero(leaves)
+        block_size = coarse.block_size(depth)
+        keys.append(morton_encode(block_rows * block_size, block_cols * block_size))
+        levels.append(np.full(block_rows.shape[0], depth, dtype=np.uint8))
+        properties.append(coarse.total[depth][block_rows, block_cols] / block_size**2)
+        alive = np.repeat(np.repeat(alive & coarse.split[depth], 2, 0), 2, 1)
+    for (tile_keys, tile_levels, tile_properties), inside in zip(tiles, alive.ravel()):
+        if inside:
+            keys.append(tile_keys)
+            levels.append(tile_levels)
+            properties.append(tile_properties)
+
+    return np.concatenate(keys), np.concatenate(levels), np.concatenate(properties)
@@ -0,0 +1,136 @@
+"""
+Drawing of quadtree meshes with matplotlib.
+
+This module is imported by QTreeMesh.draw when a mesh is first drawn, so
+importing qtreemesh does not import matplotlib.
+
+Author : Sadjad Abedi
+"""
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+
+
+def draw_mesh(
+    mesh, fill_inside=True, edge_color=None, save_name=None, show=None, raster=False
+):
+    """
+    Draw the elements of a mesh (see QTreeMesh.draw).
+
+    Parameters
+    ----------
+    mesh : QTreeMesh object
+        A mesh with created elements.
+    fill_inside : bool, optional
+        Fill elements with grayscale color based on element property.
+    edge_color : None/str, optional
+        The color for element edges.
+    save_name : None/str, optional
+        name of file to save figure.
+    show : None/bool, optional
+        Show the figure in a window with pyplot. Default is True when there
+        is no save_name.
+    raster : bool, optional
+        Draw the image of QTreeMesh.rasterize() instead of polygons.
+
+    Returns
+    -------
+    fig : matplotlib Figure
+    """
+    if mesh.connectivity is None:
+        raise ValueError("Elements have to be created first.")
+    if show is None:
+        show = save_name is None
+    if show:
+        from matplotlib import pyplot  # Selects an interactive backend
+
+        fig = pyplot.figure(figsize=(10, 10), frameon=False)
+    else:
+        fig = Figure(figsize=(10, 10), frameon=False)
+        FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.axis("off")
+    ax.set_aspect("equal")
+    if raster:
+        ax.imshow(
+            raster_colors(mesh, fill_inside, edge_color),
+            extent=_raster_extent(mesh),
+            interpolation="nearest",
+        )
+    else:
+        if fill_inside:
+            gray = np.clip(mesh.leaf_properties / 255, 0.0, 1.0)
+            face_colors = np.repeat(gray[:, None], 3, axis=1)
+        else:
+            face_colors = "white"
+        ax.add_collection(
+            PolyCollection(
+                mesh.nodes[mesh.connectivity - 1],
+                facecolors=face_colors,
+                edgecolors="face" if edge_color is None else edge_color,
+            )
+        )
+        ax.autoscale_view()
+    fig.tight_layout()
+    if show:
+        pyplot.show()
+    if save_name:
+        fig.savefig(save_name)
+
+    return fig
+
+
+def raster_colors(mesh, fill_inside=True, edge_color=None):
+    """
+    Return the RGBA image of the cells of a mesh painted by
+    QTreeMesh.rasterize(), magnified to about the size of the figure.
+
+    Parameters
+    ----------
+    mesh : QTreeMesh object
+    fill_inside : bool, optional
+        Fill cells with grayscale color based on their property, or white.
+    edge_color : None/str, optional
+        The color for cell edges. Default is no edges.
+
+    Returns
+    -------
+    colors : numpy array
+        A (rows, cols, 4) float array. Pixels without cells are transparent.
+    """
+    height, width = _raster_shape(mesh)
+    zoom = max(1, 1000 // max(height, width, 1))
+    image = mesh.rasterize(None if edge_color is None else np.inf, zoom)
+    colors = np.zeros(image.shape + (4,))
+    inside = np.isfinite(image)
+    if fill_inside:
+        colors[inside, :3] = np.clip(image[inside] / 255, 0.0, 1.0)[:, None]
+    else:
+        colors[inside, :3] = 1.0
+    colors[inside, 3] = 1.0
+    if edge_color is not None:
+        colors[np.isinf(image)] = to_rgba(edge_color)
+
+    return colors
+
+
+def _raster_shape(mesh):
+    height = int((mesh.leaf_positions[:, 1] + mesh.leaf_sizes).max(initial=0))
+    width = int((mesh.leaf_positions[:, 0] + mesh.leaf_sizes).max(initial=0))
+
+    return height, width
+
+
+def _raster_extent(mesh):
+    """
+    Return the left, right, bottom and top coordinates of the image of
+    QTreeMesh.rasterize().
+    """
+    height, width = _raster_shape(mesh)
+    left, bottom = mesh.quad_tree.bottom_left_corner.xy_coord
+    scale = mesh.quad_tree.scale
+
+    return (left, left + width * scale, bottom, bottom + height * scale)
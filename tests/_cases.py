@@ -0,0 +1,88 @@
+"""
+Images and parameters of the regression tests, shared with
+data/make_baseline.py which records the outputs of qtreemesh 0.1.3.
+"""
+
+import numpy as np
+
+
+def circle_image():
+    rows, cols = np.mgrid[0:64, 0:64]
+    return ((cols - 25) ** 2 + (rows - 35) ** 2 < 15**2) * 200.0
+
+
+def noise_image():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, (32, 20)).astype(np.float64)
+
+
+def steps_image():
+    rows, cols = np.mgrid[0:48, 0:64]
+    return (rows // 12 * 40 + cols // 16 * 15).astype(np.float64)
+
+
+# name: (image, crit, scale, balancing)
+CASES = {
+    "circle": (circle_image, 125, 1.0, True),
+    "noise": (noise_image, 125, 1.0, True),
+    "steps": (steps_image, 40, 0.5, False),
+}
+
+
+def flatten(lists):
+    """
+    Return the offsets and the concatenation of a list of lists of ints.
+    """
+    offsets = np.cumsum([0] + [len(item) for item in lists])
+
+    return offsets, np.array([int(n) for item in lists for n in item], dtype=np.int64)
+
+
+def mesh_outputs(mesh, vtk_path):
+    """
+    Return the outputs of the list based API of a mesh after
+    create_elements(), as a dict of arrays.
+    """
+    offsets, numbers = flatten([element.nodes_numbers for element in mesh.elements])
+    outputs = {
+        "nodes": np.asarray(mesh.nodes, dtype=np.float64),
+        "element_offsets": offsets,
+        "element_nodes": numbers,
+        "element_types": np.array(
+            [list(element.element_type) for element in mesh.elements], dtype=np.int64
+        ),
+        "element_properties": np.array(
+            [element.element_property for element in mesh.elements], dtype=np.float64
+        ),
+    }
+    for force in (True, False):
+        _, fem_elements, fem_properties = mesh.adjust_mesh_for_FEM(force)
+        offsets, numbers = flatten(fem_elements)
+        outputs[f"fem_offsets_{force}"] = offsets
+        outputs[f"fem_nodes_{force}"] = numbers
+        outputs[f"fem_properties_{force}"] = np.array(fem_properties, dtype=np.float64)
+    mesh.vtk_export(vtk_path)
+    with open(vtk_path, encoding="utf-8") as vtk_file:
+        outputs["vtk"] = np.array(vtk_file.read())
+
+    return outputs
+
+
+def element_geometry(outputs):
+    """
+    Return the elements of mesh_outputs() as a sorted list of their node
+    coordinates, type and property, which does not depend on the order of
+    the leaves and the numbering of the nodes.
+    """
+    nodes = outputs["nodes"]
+    offsets = outputs["element_offsets"]
+    elements = np.split(outputs["element_nodes"], offsets[1:-1])
+
+    return sorted(
+        (tuple(map(tuple, nodes[numbers - 1].tolist())), tuple(types), prop)
+        for numbers, types, prop in zip(
+            elements,
+            outputs["element_types"].tolist(),
+            outputs["element_properties"].tolist(),
+        )
+    )
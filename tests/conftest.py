@@ -0,0 +1,25 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Test the sources of this checkout without installing them
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+)
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+@pytest.fixture
+def baseline():
+    """
+    Load the outputs of qtreemesh 0.1.3 for a case of _cases.CASES.
+    """
+
+    def load(name):
+        with np.load(os.path.join(DATA, f"baseline_{name}.npz")) as arrays:
+            return dict(arrays)
+
+    return load
@@ -0,0 +1,35 @@
+"""
+Record the outputs of the regression cases with qtreemesh 0.1.3, the
+release before the array based rewrite of the mesh.
+
+Run from a checkout of that release (PYTHONPATH=src) to regenerate the
+baseline_<case>.npz files of this directory.
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from qtreemesh import QTree, QTreeMesh, image_preprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from _cases import CASES, mesh_outputs  # noqa: E402
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (image, crit, scale, balancing) in CASES.items():
+            mesh = QTreeMesh(
+                QTree(None, image_preprocess(image()), crit, scale), balancing
+            )
+            mesh.create_elements()
+            outputs = mesh_outputs(mesh, os.path.join(directory, "mesh.vtk"))
+            np.savez_compressed(os.path.join(HERE, f"baseline_{name}.npz"), **outputs)
+
+
+if __name__ == "__main__":
+    main()
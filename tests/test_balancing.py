@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from _cases import CASES
+from qtreemesh import QTree, image_preprocess
+
+
+def all_nodes(tree):
+    nodes, stack = [], [tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        if node.divided:
+            stack.extend(
+                [node.north_west, node.north_east, node.south_west, node.south_east]
+            )
+
+    return nodes
+
+
+def recursive_neighbors(nodes):
+    """
+    Return the neighbors of the nodes found by walking the tree, as the
+    methods do without a neighbor index.
+    """
+    stored = [node.neighbors for node in nodes]
+    for node in nodes:
+        node.neighbors = None
+    neighbors = [
+        [
+            node.north_neighbor(),
+            node.south_neighbor(),
+            node.west_neighbor(),
+            node.east_neighbor(),
+        ]
+        for node in nodes
+    ]
+    for node, node_neighbors in zip(nodes, stored):
+        node.neighbors = node_neighbors
+
+    return neighbors
+
+
+def assert_index_matches_recursion(tree):
+    nodes = all_nodes(tree)
+    expected = recursive_neighbors(nodes)
+    for node, node_neighbors in zip(nodes, expected):
+        assert all(a is b for a, b in zip(node.neighbors, node_neighbors)), (
+            node.origin,
+            node.array.shape[0],
+        )
+
+
+def random_tree(seed, size=64):
+    rng = np.random.default_rng(seed)
+    # Sparse spikes give deep leaves next to large ones
+    image = np.zeros((size, size))
+    image.flat[rng.choice(size * size, 12, replace=False)] = 255
+
+    return QTree(None, image, 100)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_neighbor_index_matches_recursive_lookup(seed):
+    tree = random_tree(seed)
+    tree.build_neighbor_index()
+
+    assert_index_matches_recursion(tree)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_neighbor_index_is_kept_up_to_date_by_balancing(seed):
+    tree = random_tree(seed)
+    tree.balancing()
+
+    assert_index_matches_recursion(tree)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_sectors_keeps_neighbor_index_up_to_date(seed):
+    tree = random_tree(seed)
+    tree.build_neighbor_index()
+    leaves = [leaf for leaf in tree.save_leaves() if leaf.array.shape[0] > 1]
+    rng = np.random.default_rng(seed)
+    for index in rng.choice(len(leaves), min(len(leaves), 10), replace=False):
+        leaves[index].sectors()
+
+    assert_index_matches_recursion(tree)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_balancing_is_two_to_one(seed):
+    tree = random_tree(seed)
+    splits = tree.balancing()
+    nodes = all_nodes(tree)
+    for node in nodes:
+        node.neighbors = None
+
+    assert splits > 0
+    assert not any(QTree.need_split(leaf) for leaf in tree.save_leaves())
+    assert tree.balancing() == 0
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_balancing_splits_as_many_nodes_as_recursive_balancing(name):
+    image, crit, scale, _ = CASES[name]
+    array = image_preprocess(image())
+    tree = QTree(None, array, crit, scale)
+    splits = tree.balancing()
+    expected = QTree(None, array, crit, scale)
+    # Divide leaves found by the recursive need_split until none is left
+    expected_splits = 0
+    while True:
+        leaves = [leaf for leaf in expected.save_leaves() if QTree.need_split(leaf)]
+        if not leaves:
+            break
+        for leaf in leaves:
+            leaf.sectors()
+        expected_splits += len(leaves)
+
+    assert splits == expected_splits
+    assert sorted(leaf.origin + leaf.array.shape for leaf in tree.save_leaves()) == (
+        sorted(leaf.origin + leaf.array.shape for leaf in expected.save_leaves())
+    )
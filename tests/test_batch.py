@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+from qtreemesh import mesh_batch
+from qtreemesh._batch import _output_names
+
+
+def write_image(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image = np.zeros((16, 12), dtype=np.uint8)
+    image[4:9, 3:7] = value
+    np.save(path, image)
+
+
+def test_output_names_are_distinct(tmp_path):
+    paths = [
+        os.path.join(tmp_path, "a", "scan.npy"),
+        os.path.join(tmp_path, "b", "scan.npy"),
+        os.path.join(tmp_path, "b", "scan.png"),
+        os.path.join(tmp_path, "b", "other.png"),
+    ]
+
+    assert _output_names(paths) == [
+        os.path.join("a", "scan"),
+        os.path.join("b", "scan.npy"),
+        os.path.join("b", "scan.png"),
+        os.path.join("b", "other"),
+    ]
+
+
+def test_output_names_of_one_directory_are_image_names(tmp_path):
+    paths = [os.path.join(tmp_path, name) for name in ("x.npy", "y.png")]
+
+    assert _output_names(paths) == ["x", "y"]
+
+
+def test_images_with_the_same_name_keep_their_meshes(tmp_path):
+    first = os.path.join(tmp_path, "in", "a", "scan.npy")
+    second = os.path.join(tmp_path, "in", "b", "scan.npy")
+    write_image(first, 100)
+    write_image(second, 200)
+    output_dir = os.path.join(tmp_path, "out")
+
+    summaries = mesh_batch(
+        [first, second], output_dir, workers=1, crit=10, output_format="vtk-ascii"
+    )
+
+    outputs = [summary["output"] for summary in summaries]
+    assert outputs == [
+        os.path.join(output_dir, "a", "scan.vtk"),
+        os.path.join(output_dir, "b", "scan.vtk"),
+    ]
+    texts = []
+    for output in outputs:
+        with open(output, encoding="utf-8") as vtk_file:
+            texts.append(vtk_file.read())
+    assert "100.0" in texts[0].split("LOOKUP_TABLE default")[1]
+    assert "200.0" in texts[1].split("LOOKUP_TABLE default")[1]
+
+
+def test_images_of_one_directory_are_meshed_next_to_each_other(tmp_path):
+    for name, value in (("x", 50), ("y", 60)):
+        write_image(os.path.join(tmp_path, "in", f"{name}.npy"), value)
+
+    summaries = mesh_batch(
+        os.path.join(tmp_path, "in"), tmp_path / "out", workers=1, crit=10
+    )
+
+    assert [os.path.basename(summary["output"]) for summary in summaries] == [
+        "x.vtk",
+        "y.vtk",
+    ]
+    assert sorted(os.listdir(tmp_path / "out")) == ["x.vtk", "y.vtk"]
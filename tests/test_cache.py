@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pytest
+
+from _cases import CASES, mesh_outputs
+from qtreemesh import LinearQTree, MeshCache, QTreeMesh, image_preprocess
+from qtreemesh import _cache
+from qtreemesh._criteria import range_criterion, register_criterion
+
+
+def image(value=200):
+    image = CASES["noise"][0]()
+    image[5:15, 3:9] = value
+
+    return image
+
+
+def cache_files(cache):
+    return {name for name in os.listdir(cache.directory) if name.endswith(".npz")}
+
+
+def test_mesh_is_loaded_after_a_miss(tmp_path):
+    cache = MeshCache(tmp_path)
+    array = image_preprocess(image(), virtual=True)
+
+    built = cache.mesh(array, 125)
+    loaded = cache.mesh(array, 125)
+
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert len(cache_files(cache)) == 1
+    expected = QTreeMesh(LinearQTree.from_array(array, 125))
+    expected.create_elements(compact=True)
+    for mesh in (built, loaded):
+        outputs = mesh_outputs(mesh, tmp_path / "mesh.vtk")
+        for key, value in mesh_outputs(expected, tmp_path / "expected.vtk").items():
+            np.testing.assert_array_equal(outputs[key], value, err_msg=key)
+
+
+def test_tree_is_loaded_after_a_miss(tmp_path):
+    cache = MeshCache(tmp_path)
+    array = image_preprocess(image())
+
+    built = cache.tree(array, 125, balancing=True)
+    loaded = cache.tree(array, 125, balancing=True)
+
+    assert (cache.misses, cache.hits) == (1, 1)
+    for tree in (built, loaded):
+        np.testing.assert_array_equal(tree.keys, built.keys)
+        np.testing.assert_array_equal(tree.levels, built.levels)
+        np.testing.assert_array_equal(tree.properties, built.properties)
+
+
+def test_key_depends_on_the_pixels_parameters_and_padding():
+    array = image()
+    key = MeshCache.key(array, crit=10.0)
+
+    assert MeshCache.key(array.copy(), crit=10.0) == key
+    assert MeshCache.key(image(100), crit=10.0) != key
+    assert MeshCache.key(array, crit=11.0) != key
+    assert MeshCache.key(array, crit=10.0, balancing=False) != key
+    padded = MeshCache.key(image_preprocess(array, virtual=True), crit=10.0)
+    assert padded not in (key, MeshCache.key(image_preprocess(array), crit=10.0))
+    assert padded != MeshCache.key(
+        image_preprocess(array, virtual=True, fill_value=90), crit=10.0
+    )
+
+
+def test_numpy_integer_parameters_give_the_key_of_ints(tmp_path):
+    cache = MeshCache(tmp_path)
+    array = image_preprocess(image())
+
+    cache.mesh(array, 10, min_size=np.int64(2), max_size=np.int32(8))
+    cache.mesh(array, 10, min_size=2, max_size=8)
+
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = MeshCache(tmp_path / "cache")
+    arrays = [image_preprocess(image(value)) for value in (50, 100, 150, 200)]
+    names, sizes = [], []
+    for array in arrays:
+        files = cache_files(cache)
+        cache.mesh(array, 125)
+        (name,) = cache_files(cache) - files
+        names.append(name)
+        sizes.append(os.path.getsize(os.path.join(cache.directory, name)))
+    cache.clear()
+    for time, (array, name) in enumerate(zip(arrays[:3], names)):
+        cache.mesh(array, 125)
+        os.utime(os.path.join(cache.directory, name), (1000 + time, 1000 + time))
+    cache.mesh(arrays[0], 125)  # A hit marks the oldest file as recently used
+
+    cache.max_bytes = sizes[0] + sizes[2] + sizes[3]
+    cache.mesh(arrays[3], 125)
+
+    assert cache_files(cache) == {names[0], names[2], names[3]}
+
+
+def test_files_removed_by_other_processes_are_tolerated(tmp_path, monkeypatch):
+    cache = MeshCache(tmp_path)
+    array = image_preprocess(image())
+    cache.mesh(array, 125)
+
+    def evicted(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+
+    # Removed between reading the file and marking it as used
+    monkeypatch.setattr(_cache.os, "utime", evicted)
+    cache.mesh(array, 125)
+    assert (cache.misses, cache.hits) == (1, 1)
+    monkeypatch.undo()
+    cache.clear()
+    cache.mesh(array, 125)
+    assert (cache.misses, cache.hits) == (2, 1)
+
+
+def test_built_in_criteria_can_not_be_replaced(tmp_path):
+    def other(pyramid, depth, crit):
+        return range_criterion(pyramid, depth, crit)
+
+    assert register_criterion("range", range_criterion) is range_criterion
+    with pytest.raises(ValueError, match="built-in"):
+        register_criterion("range", other)
+    with pytest.raises(TypeError, match="by name"):
+        MeshCache(tmp_path).mesh(image(), 10, criterion=other)
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from qtreemesh import ImagePyramid, LinearQTree, register_criterion, _criteria
+from qtreemesh._criteria import get_criterion
+
+
+def random_image(seed, size=32):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 3, (size, size)) * 40.0
+    # A uniform corner gives blocks that are not divided
+    image[rng.integers(0, size) :, rng.integers(0, size) :] = 70
+
+    return image
+
+
+def pixel_values(image, criterion):
+    """
+    Return the per-pixel values that the criterion reduces over each
+    block, and the reduction.
+    """
+    if criterion == "range":
+        return image, np.ptp
+    if criterion == "std":
+        return image, np.std
+    if criterion == "mean":
+        return image, np.mean
+    gradient_y, gradient_x = np.gradient(image)
+
+    return np.hypot(gradient_x, gradient_y), np.mean
+
+
+def brute_force_leaves(image, crit, criterion, min_size=1, max_size=None):
+    """
+    Return the (x, y, size) of the leaves found by evaluating the criterion
+    over the pixels of each block, from the root down.
+    """
+    values, reduction = pixel_values(image, criterion)
+    leaves = []
+
+    def divide(row, col, size):
+        block = values[row : row + size, col : col + size]
+        if size >= 2 * min_size and (
+            (max_size is not None and size > max_size) or reduction(block) > crit
+        ):
+            half = size // 2
+            for row_step, col_step in ((0, 0), (0, half), (half, 0), (half, half)):
+                divide(row + row_step, col + col_step, half)
+        else:
+            leaves.append((col, image.shape[0] - row - size, size))
+
+    divide(0, 0, image.shape[0])
+
+    return sorted(leaves)
+
+
+def tree_leaves(tree):
+    positions, sizes, _ = tree.leaf_arrays()
+
+    return sorted(zip(positions[:, 0].tolist(), positions[:, 1].tolist(), sizes))
+
+
+# Thresholds away from the values of the blocks of the test images
+CRITS = {"range": 50, "std": 21.3, "gradient": 17.9}
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("criterion", sorted(CRITS))
+def test_splits_match_pixels_of_blocks(criterion, seed):
+    image = random_image(seed)
+    values, reduction = pixel_values(image, criterion)
+    pyramid = ImagePyramid(image, CRITS[criterion], criterion)
+    for depth in range(pyramid.levels):
+        size = pyramid.block_size(depth)
+        count = 1 << depth
+        expected = [
+            [
+                reduction(
+                    values[row * size : (row + 1) * size, col * size : (col + 1) * size]
+                )
+                > CRITS[criterion]
+                for col in range(count)
+            ]
+            for row in range(count)
+        ]
+
+        np.testing.assert_array_equal(pyramid.split[depth], expected)
+
+
+@pytest.mark.parametrize("limits", [(1, None), (4, None), (1, 8), (2, 16)])
+@pytest.mark.parametrize("criterion", sorted(CRITS))
+def test_leaves_match_brute_force_with_size_limits(criterion, limits):
+    image = random_image(7, 64)
+    min_size, max_size = limits
+    tree = LinearQTree.from_array(
+        image,
+        CRITS[criterion],
+        criterion=criterion,
+        min_size=min_size,
+        max_size=max_size,
+    )
+
+    assert tree_leaves(tree) == brute_force_leaves(
+        image, CRITS[criterion], criterion, min_size, max_size
+    )
+    sizes = tree.leaf_arrays()[1]
+    assert sizes.min() >= min_size
+    assert max_size is None or sizes.max() <= max_size
+
+
+def test_registered_criterion_is_found_by_name(monkeypatch):
+    monkeypatch.setattr(_criteria, "_CRITERIA", dict(_criteria._CRITERIA))
+
+    def mean_criterion(pyramid, depth, crit):
+        return pyramid.total[depth] / pyramid.block_size(depth) ** 2 > crit
+
+    assert register_criterion("mean", mean_criterion) is mean_criterion
+    assert get_criterion("mean") is mean_criterion
+    assert get_criterion(mean_criterion) is mean_criterion
+    image = random_image(3)
+    by_name = LinearQTree.from_array(image, 45.5, criterion="mean")
+    by_function = LinearQTree.from_array(image, 45.5, criterion=mean_criterion)
+
+    assert (
+        tree_leaves(by_name)
+        == tree_leaves(by_function)
+        == (brute_force_leaves(image, 45.5, "mean"))
+    )
+
+
+def test_unknown_and_invalid_criteria_are_rejected(monkeypatch):
+    monkeypatch.setattr(_criteria, "_CRITERIA", dict(_criteria._CRITERIA))
+
+    with pytest.raises(ValueError, match="available criteria are"):
+        get_criterion("mean")
+    with pytest.raises(ValueError, match="Unknown splitting criterion"):
+        LinearQTree.from_array(random_image(0), 10, criterion="mean")
+    with pytest.raises(TypeError, match="callable"):
+        register_criterion("mean", "range")
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from _cases import CASES
+from qtreemesh import QTree, QTreeMesh, image_preprocess
+
+
+def build_mesh(name, drop_outside=False):
+    image, crit, scale, balancing = CASES[name]
+    array = image_preprocess(image(), virtual=drop_outside)
+    tree = QTree(None, array, crit, scale)
+    mesh = QTreeMesh(tree, balancing, drop_outside=drop_outside)
+    mesh.create_elements(compact=True)
+
+    return mesh
+
+
+@pytest.mark.parametrize("raster", [False, True])
+def test_draw_saves_a_figure_without_showing_it(raster, tmp_path):
+    backend_agg = pytest.importorskip("matplotlib.backends.backend_agg")
+    mesh = build_mesh("circle")
+
+    fig = mesh.draw(edge_color="red", save_name=tmp_path / "mesh.png", show=False)
+    if raster:
+        fig = mesh.draw(save_name=tmp_path / "mesh.png", show=False, raster=True)
+
+    assert isinstance(fig.canvas, backend_agg.FigureCanvasAgg)
+    with open(tmp_path / "mesh.png", "rb") as png_file:
+        assert png_file.read(8) == b"\x89PNG\r\n\x1a\n"
+
+
+@pytest.mark.parametrize("zoom", [1, 3])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_rasterize_paints_the_leaf_properties(name, zoom):
+    mesh = build_mesh(name)
+    size = image_preprocess(CASES[name][0]()).shape[0]
+
+    image = mesh.rasterize(zoom=zoom)
+    edges = mesh.rasterize(edge_value=-1.0, zoom=zoom)
+
+    assert image.shape == (size * zoom, size * zoom)
+    positions, sizes = mesh.leaf_positions * zoom, mesh.leaf_sizes * zoom
+    tops = size * zoom - positions[:, 1] - sizes
+    for top, left, cell_size, value in zip(
+        tops, positions[:, 0], sizes, mesh.leaf_properties
+    ):
+        cell = np.s_[top : top + cell_size, left : left + cell_size]
+        np.testing.assert_array_equal(image[cell], value)
+        np.testing.assert_array_equal(edges[cell][0], -1.0)
+        np.testing.assert_array_equal(edges[cell][:, 0], -1.0)
+        np.testing.assert_array_equal(edges[cell][1:, 1:], value)
+
+
+def test_rasterize_leaves_dropped_cells_empty():
+    mesh = build_mesh("steps", drop_outside=True)
+
+    image = mesh.rasterize()
+
+    # The image of 48 * 64 pixels is at the top of the padded 64 * 64 domain
+    assert image.shape == (64, 64)
+    assert not np.isnan(image[:48]).any()
+    assert np.isnan(image[48:]).any()
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_import_does_not_import_matplotlib():
+    code = "import sys, qtreemesh; print('matplotlib' in sys.modules)"
+    environment = dict(os.environ, PYTHONPATH=SRC)
+
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "False"
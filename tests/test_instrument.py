@@ -0,0 +1,102 @@
+import json
+import logging
+
+import pytest
+
+from _cases import CASES
+from qtreemesh import LinearQTree, QTree, QTreeMesh, image_preprocess, instrument
+
+
+def circle():
+    return image_preprocess(CASES["circle"][0]())
+
+
+def node_count(node):
+    children = (node.north_west, node.north_east, node.south_west, node.south_east)
+
+    return 1 + sum(node_count(child) for child in children if child is not None)
+
+
+def test_stages_are_timed_once_per_call():
+    with instrument() as stats:
+        mesh = QTreeMesh(LinearQTree.from_array(circle(), 125))
+        mesh.create_elements()
+        mesh.adjust_mesh_for_FEM()
+
+    calls = {name: stage["calls"] for name, stage in stats.stages.items()}
+    assert calls == {
+        "tree": 1,
+        "balancing": 1,
+        "mesh": 1,
+        "labeling": 1,
+        "refactor_edge": 1,
+        "create_elements": 1,
+        "adjust_mesh_for_FEM": 1,
+    }
+    assert all(stage["seconds"] >= 0 for stage in stats.stages.values())
+    assert stats.counters["elements"] == len(mesh.elements)
+    assert stats.counters["nodes"] == len(mesh.nodes)
+    assert sum(stats.leaves_per_depth.values()) == stats.counters["cells"]
+    assert sum(stats.elements_per_mode.values()) == stats.counters["cells"]
+    json.dumps(stats.as_dict())
+
+
+@pytest.mark.parametrize("build", ["qtree", "pyramid", "integral"])
+def test_tree_stage_is_timed_once_per_qtree_build(build):
+    # Only the root is instrumented, not the nodes built below it
+    array = circle()
+    with instrument() as stats:
+        if build == "qtree":
+            tree = QTree(None, array, 125)
+        elif build == "pyramid":
+            tree = QTree.from_pyramid(array, 125)
+        else:
+            tree = QTree.from_integral_image(array, 125)
+
+    assert list(stats.stages) == ["tree"]
+    assert stats.stages["tree"]["calls"] == 1
+    assert stats.counters["nodes_created"] == node_count(tree)
+    assert stats.counters["leaves"] == len(tree.leaf_arrays()[1])
+
+
+def test_nested_blocks_collect_their_own_stages():
+    array = circle()
+    with instrument() as outer:
+        tree = LinearQTree.from_array(array, 125)
+        with instrument() as inner:
+            tree.balancing()
+        QTree(None, array, 125)
+
+    assert list(inner.stages) == ["balancing"]
+    assert list(outer.stages) == ["tree"]
+    assert outer.stages["tree"]["calls"] == 2
+    assert "balancing_splits" not in outer.counters
+
+
+def test_stages_are_not_timed_outside_of_blocks():
+    with instrument() as stats:
+        pass
+    LinearQTree.from_array(circle(), 125)
+
+    assert stats.stages == {}
+
+
+def test_callback_is_called_when_the_block_raises():
+    collected = []
+    with pytest.raises(RuntimeError):
+        with instrument(callback=collected.append):
+            LinearQTree.from_array(circle(), 125)
+            raise RuntimeError
+
+    assert [list(stats.stages) for stats in collected] == [["tree"]]
+
+
+def test_statistics_are_logged_at_the_end_of_the_block(caplog):
+    caplog.set_level(logging.INFO, logger="qtreemesh")
+    with instrument(logger="qtreemesh") as stats:
+        LinearQTree.from_array(circle(), 125)
+
+    (record,) = caplog.records
+    assert record.levelno == logging.INFO
+    assert record.getMessage().startswith("qtreemesh stats: tree=")
+    assert record.qtreemesh_stats == stats.as_dict()
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from _cases import CASES
+from qtreemesh import IntegralImage, QTree, image_preprocess
+
+
+def random_windows(rng, shape, count=50):
+    heights = rng.integers(1, shape[0] + 1, count)
+    widths = rng.integers(1, shape[1] + 1, count)
+    rows = rng.integers(0, shape[0] - heights + 1)
+    cols = rng.integers(0, shape[1] - widths + 1)
+
+    return rows, cols, heights, widths
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.float64])
+@pytest.mark.parametrize("shape", [(16, 16), (13, 29), (40, 7)])
+def test_block_statistics_match_pixels(shape, dtype):
+    rng = np.random.default_rng(shape[0] * shape[1])
+    image = rng.integers(0, 256, shape).astype(dtype)
+    integral = IntegralImage(image)
+    rows, cols, heights, widths = random_windows(rng, shape)
+    windows = [
+        image[row : row + height, col : col + width].astype(np.float64)
+        for row, col, height, width in zip(rows, cols, heights, widths)
+    ]
+
+    np.testing.assert_allclose(
+        integral.block_sum(rows, cols, heights, widths),
+        [window.sum() for window in windows],
+    )
+    np.testing.assert_allclose(
+        integral.mean(rows, cols, heights, widths),
+        [window.mean() for window in windows],
+    )
+    np.testing.assert_allclose(
+        integral.variance(rows, cols, heights, widths),
+        [window.var() for window in windows],
+        atol=1e-6,
+    )
+
+
+def test_square_blocks_and_scalars():
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 256, (21, 34)).astype(np.uint8)
+    integral = IntegralImage(image)
+    sizes = rng.integers(1, 22, 20)
+    rows, cols = rng.integers(0, 22 - sizes), rng.integers(0, 35 - sizes)
+
+    # Integer images are summed exactly
+    assert integral.block_sum(3, 5, 7, 11) == image[3:10, 5:16].astype(int).sum()
+    np.testing.assert_array_equal(
+        integral.block_sum(rows, cols, sizes),
+        [
+            image[row : row + size, col : col + size].astype(int).sum()
+            for row, col, size in zip(rows, cols, sizes)
+        ],
+    )
+
+
+@pytest.mark.parametrize("balancing", [False, True])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_from_integral_image_matches_qtree(name, balancing):
+    image, crit, scale, _ = CASES[name]
+    array = image_preprocess(image())
+    tree = QTree.from_integral_image(array, crit, scale)
+    expected = QTree(None, array, crit, scale)
+    if balancing:
+        tree.balancing()
+        expected.balancing()
+    leaves, expected_leaves = tree.save_leaves(), expected.save_leaves()
+
+    assert [leaf.origin for leaf in leaves] == [leaf.origin for leaf in expected_leaves]
+    assert [leaf.array.shape for leaf in leaves] == [
+        leaf.array.shape for leaf in expected_leaves
+    ]
+    np.testing.assert_allclose(
+        [leaf.property for leaf in leaves],
+        [leaf.property for leaf in expected_leaves],
+    )
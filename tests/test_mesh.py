@@ -0,0 +1,347 @@
+import base64
+import zlib
+from xml.etree import ElementTree
+
+import numpy as np
+import pytest
+
+from _cases import CASES, element_geometry, flatten, mesh_outputs
+from qtreemesh import LinearQTree, QTree, QTreeMesh, image_preprocess
+
+
+def build_mesh(name, linear=False):
+    image, crit, scale, balancing = CASES[name]
+    array = image_preprocess(image())
+    if linear:
+        tree = LinearQTree.from_array(array, crit, scale)
+    else:
+        tree = QTree(None, array, crit, scale)
+
+    return QTreeMesh(tree, balancing)
+
+
+def vtk_lines(text):
+    return [line.split() for line in str(text).splitlines()]
+
+
+def assert_outputs_equal(outputs, expected):
+    assert outputs.keys() == expected.keys()
+    for key, value in expected.items():
+        if key == "vtk":
+            # The numbers of a line were aligned with spaces by 0.1.3
+            assert vtk_lines(outputs[key]) == vtk_lines(value)
+        else:
+            np.testing.assert_array_equal(outputs[key], value, err_msg=key)
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_create_elements_matches_baseline(name, baseline, tmp_path):
+    mesh = build_mesh(name)
+    mesh.create_elements()
+
+    assert_outputs_equal(mesh_outputs(mesh, tmp_path / "mesh.vtk"), baseline(name))
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_labeling_keeps_the_corner_coordinates_of_leaves(name):
+    mesh = build_mesh(name)
+    mesh.labeling()
+
+    for leaf in mesh.leaves:
+        left, bottom = leaf.bottom_left_corner.xy_coord
+        right, top = leaf.top_right_corner.xy_coord
+        np.testing.assert_allclose(
+            leaf.nodes_coordinate,
+            [(left, bottom), (right, bottom), (right, top), (left, top)],
+        )
+        np.testing.assert_array_equal(
+            leaf.nodes_coordinate, mesh.nodes[np.array(leaf.edge_points_numbers) - 1]
+        )
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_linear_tree_mesh_matches_baseline(name, baseline, tmp_path):
+    # The leaves are in Morton order, so only the numbering differs
+    mesh = build_mesh(name, linear=True)
+    mesh.create_elements()
+    outputs = mesh_outputs(mesh, tmp_path / "mesh.vtk")
+    expected = baseline(name)
+
+    assert element_geometry(outputs) == element_geometry(expected)
+    np.testing.assert_array_equal(
+        np.unique(outputs["nodes"], axis=0), np.unique(expected["nodes"], axis=0)
+    )
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_compact_elements_match_baseline(name, baseline, tmp_path):
+    mesh = build_mesh(name)
+    mesh.create_elements(compact=True)
+
+    assert_outputs_equal(mesh_outputs(mesh, tmp_path / "mesh.vtk"), baseline(name))
+
+
+@pytest.mark.parametrize("force", [True, False])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_fem_arrays_match_baseline(name, force, baseline):
+    expected = baseline(name)
+    offsets = expected[f"fem_offsets_{force}"]
+    fem_elements = np.split(expected[f"fem_nodes_{force}"], offsets[1:-1])
+    fem_properties = expected[f"fem_properties_{force}"]
+    mesh = build_mesh(name)
+    mesh.create_elements()
+
+    nodes, triangles, triangle_properties, quads, quad_properties = mesh.fem_arrays(
+        force
+    )
+
+    np.testing.assert_array_equal(nodes, expected["nodes"])
+    # The triangles and quadrilaterals keep the order of adjust_mesh_for_FEM
+    for array, properties, corners in (
+        (triangles, triangle_properties, 3),
+        (quads, quad_properties, 4),
+    ):
+        kept = [i for i, element in enumerate(fem_elements) if len(element) == corners]
+        np.testing.assert_array_equal(
+            array.reshape(-1, corners),
+            np.array([fem_elements[i] for i in kept]).reshape(-1, corners),
+        )
+        np.testing.assert_array_equal(properties, fem_properties[kept])
+
+
+def ascii_vtk_arrays(lines):
+    """
+    Return the points, cells (the number of nodes of each cell followed by
+    its nodes) and cell data of the lines of an ASCII legacy vtk file.
+    """
+    total_points = int(lines[4][1])
+    total_cells = int(lines[5 + total_points][1])
+    cells_end = 6 + total_points + total_cells
+    points = np.array(lines[5 : 5 + total_points], dtype=np.float64)
+    cells = [[int(n) for n in line] for line in lines[6 + total_points : cells_end]]
+    cell_data = np.array(lines[cells_end + total_cells + 4 :], dtype=np.float64)
+
+    return points, cells, cell_data.ravel()
+
+
+def read_binary_vtk(path):
+    """
+    Return the points, cells, cell types and cell data of a binary legacy
+    vtk file written by vtk_export.
+    """
+    with open(path, "rb") as vtk_file:
+        assert vtk_file.readline() == b"# vtk DataFile Version 2.0\n"
+        assert vtk_file.readline() == b"Output Data\n"
+        assert vtk_file.readline() == b"BINARY\n"
+        assert vtk_file.readline() == b"DATASET UNSTRUCTURED_GRID\n"
+        total_points = int(vtk_file.readline().split()[1])
+        points = np.fromfile(vtk_file, ">f4", 3 * total_points)
+        vtk_file.readline()
+        _, total_cells, total_data = vtk_file.readline().split()
+        cells = np.fromfile(vtk_file, ">i4", int(total_data))
+        vtk_file.readline()
+        vtk_file.readline()
+        cell_types = np.fromfile(vtk_file, ">i4", int(total_cells))
+        vtk_file.readline()
+        vtk_file.readline()
+        vtk_file.readline()
+        vtk_file.readline()
+        cell_data = np.fromfile(vtk_file, ">f4", int(total_cells))
+
+    return points.reshape(-1, 3), cells, cell_types, cell_data
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_binary_vtk_matches_baseline(name, baseline, tmp_path):
+    expected_points, expected_cells, expected_data = ascii_vtk_arrays(
+        vtk_lines(baseline(name)["vtk"])
+    )
+    mesh = build_mesh(name)
+    mesh.create_elements()
+    mesh.vtk_export(tmp_path / "mesh.vtk", binary=True)
+
+    points, cells, cell_types, cell_data = read_binary_vtk(tmp_path / "mesh.vtk")
+
+    np.testing.assert_array_equal(points, expected_points.astype(np.float32))
+    np.testing.assert_array_equal(cells, [n for cell in expected_cells for n in cell])
+    np.testing.assert_array_equal(cell_types, 7)
+    np.testing.assert_array_equal(cell_data, expected_data.astype(np.float32))
+
+
+def vtu_block_data(data, compressed):
+    """
+    Return the bytes of an array from its UInt64 header and data in a vtu
+    file, decompressing the blocks of vtkZLibDataCompressor.
+    """
+    count = int(np.frombuffer(data[:8], "<u8")[0])
+    if not compressed:
+        return data[8 : 8 + count]
+    header = np.frombuffer(data[: 8 * (3 + count)], "<u8").tolist()
+    blocks, start = [], 8 * (3 + count)
+    for size in header[3:]:
+        blocks.append(zlib.decompress(data[start : start + size]))
+        start += size
+    assert [len(block) for block in blocks[:-1]] == [header[1]] * (count - 1)
+    assert len(blocks[-1]) == header[2]
+
+    return b"".join(blocks)
+
+
+def read_vtu(path):
+    """
+    Return the data arrays of a vtu file written by vtu_export by name, and
+    the points as "Points".
+    """
+    with open(path, "rb") as vtu_file:
+        content = vtu_file.read()
+    marker = b'<AppendedData encoding="raw">\n   _'
+    appended = b""
+    if marker in content:
+        # The raw bytes are not XML, the elements before them are parsed
+        content, appended = content.split(marker)
+        content += b"</VTKFile>\n"
+    root = ElementTree.fromstring(content)
+    compressed = root.get("compressor") == "vtkZLibDataCompressor"
+    dtypes = {"Float64": "<f8", "Int64": "<i8", "UInt8": "u1"}
+    arrays = {}
+    for data_array in root.iter("DataArray"):
+        if data_array.get("format") == "appended":
+            data = appended[int(data_array.get("offset")) :]
+        else:
+            text = data_array.text.strip()
+            if compressed:
+                # The header is encoded separately, its length depends on
+                # the number of blocks
+                count = np.frombuffer(base64.b64decode(text[:12])[:8], "<u8")[0]
+                length = -(-8 * (3 + int(count)) // 3) * 4
+                data = base64.b64decode(text[:length]) + base64.b64decode(text[length:])
+            else:
+                data = base64.b64decode(text)
+        arrays[data_array.get("Name", "Points")] = np.frombuffer(
+            vtu_block_data(data, compressed), dtypes[data_array.get("type")]
+        )
+    arrays["Points"] = arrays["Points"].reshape(-1, 3)
+
+    return arrays
+
+
+def assert_vtu_matches_vtk(arrays, points, cells, cell_data):
+    np.testing.assert_allclose(arrays["Points"], points)
+    np.testing.assert_array_equal(
+        arrays["connectivity"], [n for cell in cells for n in cell[1:]]
+    )
+    np.testing.assert_array_equal(
+        arrays["offsets"], np.cumsum([cell[0] for cell in cells])
+    )
+    np.testing.assert_array_equal(arrays["types"], 7)
+    np.testing.assert_allclose(arrays["Average-Intensity"], cell_data)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("appended", [True, False])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_vtu_matches_baseline(name, appended, compress, baseline, tmp_path):
+    mesh = build_mesh(name)
+    mesh.create_elements()
+    mesh.vtu_export(tmp_path / "mesh.vtu", appended=appended, compress=compress)
+
+    assert_vtu_matches_vtk(
+        read_vtu(tmp_path / "mesh.vtu"),
+        *ascii_vtk_arrays(vtk_lines(baseline(name)["vtk"])),
+    )
+
+
+@pytest.mark.parametrize("appended", [True, False])
+def test_compressed_vtu_of_several_blocks_matches_vtk(appended, tmp_path):
+    image = np.random.default_rng(0).integers(0, 255, (100, 90)).astype(np.float64)
+    mesh = QTreeMesh(QTree(None, image_preprocess(image), 125), True)
+    mesh.create_elements()
+    mesh.vtk_export(tmp_path / "mesh.vtk")
+    mesh.vtu_export(tmp_path / "mesh.vtu", appended=appended, compress=True)
+    with open(tmp_path / "mesh.vtk", encoding="utf-8") as vtk_file:
+        expected = ascii_vtk_arrays(vtk_lines(vtk_file.read()))
+
+    arrays = read_vtu(tmp_path / "mesh.vtu")
+
+    assert arrays["Points"].nbytes > 32768
+    assert_vtu_matches_vtk(arrays, *expected)
+
+
+@pytest.mark.parametrize("linear", [False, True])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_drop_outside_keeps_the_cells_over_the_image(name, linear):
+    image, crit, scale, balancing = CASES[name]
+    image = image()
+    rows, cols = image.shape
+    array = image_preprocess(image, virtual=True)
+    if linear:
+        tree = LinearQTree.from_array(array, crit, scale)
+    else:
+        tree = QTree(None, array, crit, scale)
+    mesh = QTreeMesh(tree, balancing, drop_outside=True)
+    mesh.create_elements()
+    positions, sizes = mesh.leaf_positions, mesh.leaf_sizes
+    tops = array.shape[0] - positions[:, 1] - sizes
+
+    # No cell lies in the padding only, and the cells cover the image
+    assert (positions[:, 0] < cols).all()
+    assert (tops < rows).all()
+    covered = np.minimum(sizes, cols - positions[:, 0]) * np.minimum(sizes, rows - tops)
+    assert covered.sum() == rows * cols
+    assert mesh.connectivity.shape[0] == sizes.shape[0]
+
+
+def test_flatten():
+    offsets, numbers = flatten([[1, 2, 3], [4, 5, 6, 7]])
+
+    np.testing.assert_array_equal(offsets, [0, 3, 7])
+    np.testing.assert_array_equal(numbers, [1, 2, 3, 4, 5, 6, 7])
+
+
+def copy_leaves(tree):
+    # A tree with the same leaves, whose mesh is built from scratch
+    return LinearQTree(
+        tree.keys.copy(),
+        tree.levels.copy(),
+        tree.properties.copy(),
+        tree.max_level,
+        tree.scale,
+        tree.bottom_left_corner,
+        extent=tree.extent,
+        root_size=tree.root_size,
+    )
+
+
+@pytest.mark.parametrize("compact", [True, False])
+@pytest.mark.parametrize("balancing", [True, False])
+@pytest.mark.parametrize("root_size", [None, 8])
+# The later seeds used to give node numbers out of range
+@pytest.mark.parametrize("seed", [*range(8), 42, 44, 58, 71, 74])
+def test_update_matches_new_mesh(seed, root_size, balancing, compact, tmp_path):
+    rng = np.random.default_rng(seed)
+    shape = (int(rng.integers(4, 24)), int(rng.integers(4, 40)))
+    image = rng.integers(0, 4, shape).astype(np.float64) * 60
+    if root_size is None:
+        image = image_preprocess(image)
+    mesh = QTreeMesh(LinearQTree.from_array(image, 100, root_size=root_size), balancing)
+    mesh.create_elements(compact=compact)
+    for _ in range(int(rng.integers(1, 4))):
+        row, col = rng.integers(0, shape[0]), rng.integers(0, shape[1])
+        region = np.s_[row : row + rng.integers(1, 8), col : col + rng.integers(1, 8)]
+        image = image.copy()
+        image[region] = rng.integers(0, 4, image[region].shape) * 60
+        mesh.update(image, region)
+
+        count = mesh.nodes.shape[0]
+        assert mesh.connectivity.max() <= count
+        assert mesh.hanging_nodes.max() <= count
+        assert np.unique(mesh.connectivity).shape[0] == count
+        if not balancing:
+            expected = LinearQTree.from_array(image, 100, root_size=root_size)
+            np.testing.assert_array_equal(mesh.quad_tree.keys, expected.keys)
+            np.testing.assert_array_equal(mesh.quad_tree.levels, expected.levels)
+        new = QTreeMesh(copy_leaves(mesh.quad_tree), False)
+        new.create_elements()
+        assert element_geometry(mesh_outputs(mesh, tmp_path / "a.vtk")) == (
+            element_geometry(mesh_outputs(new, tmp_path / "b.vtk"))
+        )
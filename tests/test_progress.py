@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from _cases import CASES
+from qtreemesh import (
+    CancellationToken,
+    LinearQTree,
+    MeshingCancelled,
+    QTree,
+    QTreeMesh,
+    image_preprocess,
+    progress,
+)
+
+
+def blocks_image():
+    # 256 x 256 after padding, with leaves of all sizes
+    rng = np.random.default_rng(0)
+
+    return rng.integers(0, 4, (200, 230)).astype(np.float64) * 60
+
+
+BUILDS = {
+    "qtree": lambda array: QTree(None, array, 100),
+    "linear": lambda array: LinearQTree.from_array(array, 100),
+}
+
+
+def reports_by_stage(reports):
+    stages = {}
+    for stage, done, total in reports:
+        stages.setdefault(stage, []).append((done, total))
+
+    return stages
+
+
+@pytest.mark.parametrize("image", [blocks_image, CASES["noise"][0]])
+def test_totals_add_up_to_pixels_leaves_and_elements(image):
+    array = image_preprocess(image())
+    reports = []
+    with progress(lambda *report: reports.append(report), every=1):
+        tree = QTree(None, array, 100)
+        mesh = QTreeMesh(tree)
+        mesh.create_elements()
+
+    stages = reports_by_stage(reports)
+    leaves = len(tree.leaf_arrays()[1])
+    # Subtrees divided by balancing do not report their pixels again
+    assert stages["pixels"][-1] == (array.size, array.size)
+    assert [done for done, _ in stages["pixels"]] == sorted(
+        {done for done, _ in stages["pixels"]}
+    )
+    assert stages["balancing"][-1] == (leaves, None)
+    assert stages["labeling"] == [(leaves, leaves)]
+    assert stages["elements"][-1] == (len(mesh.elements), len(mesh.elements))
+
+
+def test_reports_of_single_items_are_batched():
+    array = image_preprocess(blocks_image())
+    reports = []
+    with progress(lambda *report: reports.append(report), every=1):
+        tree = LinearQTree.from_array(array, 100)
+        tree.balancing()
+
+    stages = reports_by_stage(reports)
+    assert len(stages["balancing"]) == -(-tree.sizes.shape[0] // 1024)
+    assert stages["balancing"][-1] == (tree.sizes.shape[0], None)
+
+
+def test_reports_are_spaced_by_every():
+    array = image_preprocess(blocks_image())
+    reports = []
+    with progress(lambda *report: reports.append(report), every=20000):
+        QTree(None, array, 100)
+
+    assert reports == [
+        ("pixels", done, array.size) for done in (20480, 40960, 61440)
+    ] + [("pixels", array.size, array.size)]
+
+
+@pytest.mark.parametrize("build", sorted(BUILDS))
+def test_cancelled_token_stops_the_tree_build(build):
+    array = image_preprocess(blocks_image())
+    token = CancellationToken()
+    reports = []
+
+    def cancel(*report):
+        reports.append(report)
+        token.cancel()
+
+    with progress(cancel, token, every=1):
+        with pytest.raises(MeshingCancelled, match="cancelled"):
+            BUILDS[build](array)
+
+    assert len(reports) == 1
+
+
+@pytest.mark.parametrize("build", sorted(BUILDS))
+def test_cancelled_token_stops_balancing(build):
+    tree = BUILDS[build](image_preprocess(blocks_image()))
+    token = CancellationToken()
+    token.cancel()
+
+    with progress(token=token):
+        with pytest.raises(MeshingCancelled):
+            tree.balancing()
+
+
+def test_cancelled_token_stops_create_elements():
+    mesh = QTreeMesh(LinearQTree.from_array(image_preprocess(blocks_image()), 100))
+    token = CancellationToken()
+    token.cancel()
+
+    with progress(token=token):
+        with pytest.raises(MeshingCancelled):
+            mesh.create_elements()
+    assert len(mesh.elements) < mesh.leaf_sizes.shape[0]
+
+
+def test_token_is_only_checked_inside_blocks():
+    token = CancellationToken()
+    token.cancel()
+    with progress(token=token):
+        pass
+
+    LinearQTree.from_array(image_preprocess(blocks_image()), 100)
+
+
+def test_exceeded_time_budget_cancels_the_token():
+    assert not CancellationToken(timeout=600).cancelled
+    token = CancellationToken(timeout=0)
+
+    assert token.cancelled
+    with progress(token=token):
+        with pytest.raises(MeshingCancelled, match="time budget of 0 s"):
+            QTree(None, image_preprocess(blocks_image()), 100)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from qtreemesh import ImagePyramid, image_preprocess
+
+
+def block_entropy(block, low, high, bins=16):
+    """
+    Shannon entropy of a block computed from its pixels.
+    """
+    levels = np.minimum(((block - low) * (bins / (high - low))).astype(int), bins - 1)
+    probability = np.bincount(levels.ravel(), minlength=bins) / block.size
+    probability = probability[probability > 0]
+
+    return -(probability * np.log2(probability)).sum()
+
+
+def random_image(rng, shape):
+    image = rng.integers(0, 5, shape) * 30.0
+    image[rng.integers(0, shape[0]) :, rng.integers(0, shape[1]) :] = 60
+
+    return image
+
+
+@pytest.mark.parametrize("virtual", [False, True])
+@pytest.mark.parametrize("seed", range(4))
+def test_entropy_matches_pixels_of_blocks(seed, virtual):
+    rng = np.random.default_rng(seed)
+    image = random_image(rng, (27, 19))
+    array = image_preprocess(image, virtual=virtual, fill_value=90)
+    padded = np.asarray(array)
+    pyramid = ImagePyramid(array, 1.0, "entropy")
+    low, high = padded.min(), padded.max()
+    for depth in range(pyramid.levels):
+        size = pyramid.block_size(depth)
+        rows, cols = pyramid.split[depth].shape
+        expected = [
+            [
+                block_entropy(
+                    padded[
+                        row * size : (row + 1) * size, col * size : (col + 1) * size
+                    ],
+                    low,
+                    high,
+                )
+                > 1.0
+                for col in range(cols)
+            ]
+            for row in range(rows)
+        ]
+
+        np.testing.assert_array_equal(pyramid.split[depth], expected)
+
+
+@pytest.mark.parametrize("virtual", [False, True])
+@pytest.mark.parametrize("seed", range(4))
+def test_entropy_after_update_matches_new_pyramid(seed, virtual):
+    rng = np.random.default_rng(seed)
+    image = random_image(rng, (40, 33))
+    pyramid = ImagePyramid(image_preprocess(image, virtual=virtual), 1.2, "entropy")
+    for _ in range(4):
+        row, col = rng.integers(0, 40), rng.integers(0, 33)
+        region = np.s_[row : row + rng.integers(1, 15), col : col + rng.integers(1, 15)]
+        image = image.copy()
+        # Values past the maximum also move the bins
+        image[region] = rng.integers(0, 6) * 30.0
+        array = image_preprocess(image, virtual=virtual)
+        pyramid.update(array, region)
+        expected = ImagePyramid(array, 1.2, "entropy")
+
+        for split, expected_split in zip(pyramid.split, expected.split):
+            np.testing.assert_array_equal(split, expected_split)
+        for counts, expected_counts in zip(
+            pyramid.block_histograms(), expected.block_histograms()
+        ):
+            np.testing.assert_array_equal(counts, expected_counts)
@@ -0,0 +1,98 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from _cases import CASES, mesh_outputs
+from qtreemesh import LinearQTree, QTree, QTreeMesh, image_preprocess
+
+
+def leaves(tree):
+    positions, sizes, properties = tree.leaf_arrays()
+    order = np.lexsort((positions[:, 0], positions[:, 1]))
+
+    return positions[order], sizes[order], properties[order]
+
+
+def assert_same_leaves(tree, expected):
+    for array, expected_array in zip(leaves(tree), leaves(expected)):
+        np.testing.assert_array_equal(array, expected_array)
+
+
+@pytest.mark.parametrize("mmap_mode", ["r", None])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_linear_tree_round_trip(name, mmap_mode, tmp_path):
+    image, crit, scale, _ = CASES[name]
+    tree = LinearQTree.from_array(image_preprocess(image()), crit, scale)
+    tree.balancing()
+    tree.save(tmp_path / "tree")
+
+    loaded = LinearQTree.load(tmp_path / "tree", mmap_mode)
+
+    assert isinstance(loaded.keys, np.memmap) == (mmap_mode == "r")
+    np.testing.assert_array_equal(loaded.keys, tree.keys)
+    np.testing.assert_array_equal(loaded.levels, tree.levels)
+    np.testing.assert_array_equal(loaded.properties, tree.properties)
+    assert loaded.max_level == tree.max_level
+    assert loaded.scale == tree.scale
+    assert_same_leaves(loaded, tree)
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_qtree_round_trip(name, tmp_path):
+    image, crit, scale, _ = CASES[name]
+    array = image_preprocess(image())
+    tree = QTree(None, array, crit, scale)
+    tree.balancing()
+    tree.save(tmp_path / "tree")
+
+    loaded = QTree.load(tmp_path / "tree", array)
+
+    assert isinstance(loaded, QTree)
+    assert_same_leaves(loaded, tree)
+    # A QTree is saved as the equivalent LinearQTree
+    assert_same_leaves(LinearQTree.load(tmp_path / "tree"), tree)
+
+
+@pytest.mark.parametrize("mmap_mode", ["r", None])
+@pytest.mark.parametrize("compact", [True, False])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_mesh_round_trip(name, compact, mmap_mode, tmp_path):
+    image, crit, scale, balancing = CASES[name]
+    mesh = QTreeMesh(QTree(None, image_preprocess(image()), crit, scale), balancing)
+    mesh.create_elements(compact=compact)
+    mesh.save(tmp_path / "mesh")
+
+    loaded = QTreeMesh.load(tmp_path / "mesh", mmap_mode)
+
+    assert isinstance(loaded.nodes, np.memmap) == (mmap_mode == "r")
+    for attribute in ("nodes", "connectivity", "hanging_nodes", "leaf_properties"):
+        np.testing.assert_array_equal(
+            getattr(loaded, attribute), getattr(mesh, attribute), err_msg=attribute
+        )
+    expected = mesh_outputs(mesh, tmp_path / "expected.vtk")
+    outputs = mesh_outputs(loaded, tmp_path / "loaded.vtk")
+    assert outputs.keys() == expected.keys()
+    for key, value in expected.items():
+        np.testing.assert_array_equal(outputs[key], value, err_msg=key)
+
+
+def test_newer_format_version_is_rejected(tmp_path):
+    image, crit, scale, _ = CASES["noise"]
+    mesh = QTreeMesh(LinearQTree.from_array(image_preprocess(image()), crit, scale))
+    mesh.create_elements()
+    mesh.save(tmp_path / "mesh")
+    metadata_path = os.path.join(tmp_path, "mesh", "metadata.json")
+    with open(metadata_path, encoding="utf-8") as metadata_file:
+        metadata = json.load(metadata_file)
+    metadata["version"] += 1
+    with open(metadata_path, "w", encoding="utf-8") as metadata_file:
+        json.dump(metadata, metadata_file)
+
+    with pytest.raises(ValueError, match="newer version"):
+        QTreeMesh.load(tmp_path / "mesh")
+    with pytest.raises(ValueError, match="not a saved LinearQTree"):
+        LinearQTree.load(tmp_path / "mesh")
+    with pytest.raises(ValueError, match="not a saved QTreeMesh"):
+        QTreeMesh.load(tmp_path)
@@ -0,0 +1,201 @@
+import numpy as np
+import pytest
+
+from _cases import CASES
+from qtreemesh import (
+    LinearQTree,
+    PaddedImage,
+    QTree,
+    build_parallel,
+    build_tiled,
+    image_preprocess,
+)
+
+
+def sorted_leaves(tree):
+    positions, sizes, properties = tree.leaf_arrays()
+    order = np.lexsort((positions[:, 0], positions[:, 1]))
+
+    return positions[order], sizes[order], properties[order]
+
+
+def assert_same_leaves(tree, expected):
+    for array, expected_array in zip(sorted_leaves(tree), sorted_leaves(expected)):
+        np.testing.assert_allclose(array, expected_array)
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_from_array_matches_qtree(name):
+    image, crit, scale, _ = CASES[name]
+    array = image_preprocess(image())
+
+    assert_same_leaves(
+        LinearQTree.from_array(array, crit, scale), QTree(None, array, crit, scale)
+    )
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_balanced_from_array_matches_qtree(name):
+    image, crit, scale, _ = CASES[name]
+    array = image_preprocess(image())
+    tree = LinearQTree.from_array(array, crit, scale)
+    expected = QTree(None, array, crit, scale)
+    tree.balancing()
+    expected.balancing()
+
+    assert_same_leaves(tree, expected)
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+@pytest.mark.parametrize("tile_level", [0, 1, 2])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_build_parallel_matches_from_array(name, tile_level, executor):
+    image, crit, _, _ = CASES[name]
+    array = image_preprocess(image())
+
+    assert_same_leaves(
+        build_parallel(
+            array, crit, tile_level=tile_level, workers=2, executor=executor
+        ),
+        LinearQTree.from_array(array, crit),
+    )
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_balanced_build_parallel_matches_from_array(name):
+    image, crit, _, _ = CASES[name]
+    array = image_preprocess(image())
+    expected = LinearQTree.from_array(array, crit)
+    expected.balancing()
+
+    assert_same_leaves(
+        build_parallel(array, crit, tile_level=2, workers=2, balance=True), expected
+    )
+
+
+@pytest.mark.parametrize("criterion", ["range", "std"])
+@pytest.mark.parametrize("tile_size", [8, 16])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_build_tiled_matches_from_array(name, tile_size, criterion):
+    image, crit, _, _ = CASES[name]
+    image = image()
+    if criterion == "std":
+        crit = crit / 4
+
+    assert_same_leaves(
+        build_tiled(image, crit, criterion=criterion, tile_size=tile_size),
+        LinearQTree.from_array(image_preprocess(image), crit, criterion=criterion),
+    )
+
+
+@pytest.mark.parametrize("fill_value", [0, 90])
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_virtual_padding_matches_dense_padding(name, fill_value):
+    image, crit, scale, _ = CASES[name]
+    image = image()
+    virtual = image_preprocess(image, virtual=True, fill_value=fill_value)
+    dense = image_preprocess(image, fill_value=fill_value)
+
+    assert_same_leaves(
+        LinearQTree.from_array(virtual, crit, scale),
+        LinearQTree.from_array(dense, crit, scale),
+    )
+    tree, expected = QTree(None, virtual, crit, scale), QTree(None, dense, crit, scale)
+    assert_same_leaves(tree, expected)
+    tree.balancing()
+    expected.balancing()
+    assert_same_leaves(tree, expected)
+
+
+@pytest.mark.parametrize("root_size", [None, 8])
+@pytest.mark.parametrize("seed", range(5))
+def test_update_matches_from_array(seed, root_size):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 4, (24, 40)).astype(np.float64) * 60
+    if root_size is None:
+        image = image_preprocess(image)
+    tree = LinearQTree.from_array(image, 100, root_size=root_size)
+    for _ in range(3):
+        row, col = rng.integers(0, image.shape[0]), rng.integers(0, image.shape[1])
+        region = np.s_[row : row + rng.integers(1, 12), col : col + rng.integers(1, 12)]
+        image = image.copy()
+        image[region] = rng.integers(0, 4) * 60
+        tree.update(image, region)
+
+        assert_same_leaves(
+            tree, LinearQTree.from_array(image, 100, root_size=root_size)
+        )
+
+
+def test_build_parallel_rejects_entropy_above_tiles():
+    array = image_preprocess(CASES["noise"][0]())
+    tree = build_parallel(array, 1.5, criterion="entropy", tile_level=0, workers=1)
+
+    assert_same_leaves(tree, LinearQTree.from_array(array, 1.5, criterion="entropy"))
+    with pytest.raises(ValueError, match="entropy"):
+        build_parallel(array, 1.5, criterion="entropy", tile_level=1, workers=1)
+
+
+def rectangles_image(seed, size=256, cell=64):
+    # The rectangles leave the borders of cells of 64 pixels uniform, so the
+    # gradients of the tiles are those of the image
+    rng = np.random.default_rng(seed)
+    image = np.zeros((size, size))
+    for row in range(0, size, cell):
+        for col in range(0, size, cell):
+            top, left = rng.integers(2, cell // 2, 2)
+            bottom, right = rng.integers(cell // 2, cell - 2, 2)
+            image[row + top : row + bottom, col + left : col + right] = (
+                rng.integers(1, 5) * 50
+            )
+
+    return image
+
+
+@pytest.mark.parametrize("limits", [(64, None), (16, None), (1, 32), (8, 64)])
+@pytest.mark.parametrize("criterion", ["std", "gradient"])
+def test_build_parallel_with_size_limits_matches_from_array(criterion, limits):
+    # Tiles smaller than 2 * min_size used to skip the criterion
+    image = rectangles_image(0)
+    min_size, max_size = limits
+    options = dict(criterion=criterion, min_size=min_size, max_size=max_size)
+    tree = build_parallel(
+        image, 20, tile_level=2, workers=1, executor="thread", **options
+    )
+
+    assert_same_leaves(tree, LinearQTree.from_array(image, 20, **options))
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_balanced_joined_trees_match_from_array(name):
+    # Leaves created by balancing take their property from the image
+    image, crit, _, _ = CASES[name]
+    image = image()
+    array = image_preprocess(image)
+    expected = LinearQTree.from_array(array, crit)
+    expected.balancing()
+    for tree in (
+        build_tiled(image, crit, tile_size=8),
+        build_parallel(array, crit, tile_level=2, workers=1, executor="thread"),
+    ):
+        tree.balancing()
+
+        assert_same_leaves(tree, expected)
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_qtree_of_padded_image_does_not_allocate_windows(name, monkeypatch):
+    image, crit, scale, _ = CASES[name]
+    padded = image_preprocess(image(), virtual=True)
+    expected = QTree(None, np.asarray(padded), crit, scale)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("a window of the padded image was allocated")
+
+    monkeypatch.setattr(PaddedImage, "__array__", fail)
+    tree = QTree(None, padded, crit, scale)
+    tree.balancing()
+    expected.balancing()
+
+    assert_same_leaves(tree, expected)
+    assert tree.extent == image().shape